@@ -8,6 +8,8 @@
 from Acquisition import aq_base
 from AccessControl.PermissionRole import rolesForPermissionOn
 
+import heapq
+from collections import OrderedDict
 from datetime import datetime
 from DateTime import DateTime
 
@@ -67,6 +69,9 @@ Thanks.
 
 _marker = object()
 
+# Request key of the UID -> object cache
+UID_CACHE_KEY = "bika.lims.api.uid_cache"
+
 
 class BikaLIMSError(Exception):
     """Base exception class for bika.lims errors."""
@@ -469,23 +474,109 @@ def get_object_by_uid(uid, default=_marker):
     if uid == '0':
         return get_portal()
 
+    # objects already looked up in this request
+    cache = get_uid_cache()
+    if cache is not None and uid in cache:
+        return cache[uid]
+
     # we try to find the object with both catalogs
     pc = get_portal_catalog()
     uc = get_tool("uid_catalog")
 
     # try to find the object with the reference catalog first
     brains = uc(UID=uid)
-    if brains:
-        return brains[0].getObject()
-
-    # try to find the object with the portal catalog
-    res = pc(UID=uid)
-    if not res:
+    if not brains:
+        # try to find the object with the portal catalog
+        brains = pc(UID=uid)
+    if not brains:
         if default is not _marker:
             return default
         fail("No object found for UID {}".format(uid))
 
-    return get_object(res[0])
+    obj = get_object(brains[0])
+    if cache is not None:
+        cache[uid] = obj
+    return obj
+
+
+def get_objects_by_uids(uids):
+    """Find the objects of the given UIDs with a single search per catalog
+
+    :param uids: The UIDs of the objects to find
+    :type uids: list
+    :returns: List of the found objects, in the order of the UIDs passed in.
+              UIDs without object are skipped
+    """
+    if isinstance(uids, basestring):
+        uids = [uids]
+    uids = filter(None, uids)
+    cache = get_uid_cache()
+    if cache is None:
+        cache = {}
+
+    found = {}
+    if "0" in uids:
+        found["0"] = get_portal()
+    missing = set()
+    for uid in uids:
+        if uid in found:
+            continue
+        if uid in cache:
+            found[uid] = cache[uid]
+        else:
+            missing.add(uid)
+
+    # try to find the objects with the reference catalog first and with the
+    # portal catalog afterwards
+    for catalog in (get_tool("uid_catalog"), get_portal_catalog()):
+        if not missing:
+            break
+        for brain in catalog(UID=list(missing)):
+            uid = brain.UID
+            if uid not in missing:
+                continue
+            obj = get_object(brain)
+            found[uid] = cache[uid] = obj
+            missing.discard(uid)
+
+    return [found[uid] for uid in uids if uid in found]
+
+
+def get_uid_cache():
+    """Returns the UID -> object cache of the current request
+
+    Objects looked up by UID are cached until the end of the request, so
+    repeated lookups of the same UID do not search the catalogs. The cache is
+    invalidated by `invalidate_uid_cache`.
+
+    :returns: The cache or None if there is no request
+    :rtype: dict
+    """
+    request = get_request()
+    if request is None:
+        return None
+    cache = request.get(UID_CACHE_KEY)
+    if cache is None:
+        cache = {}
+        request.set(UID_CACHE_KEY, cache)
+    return cache
+
+
+def invalidate_uid_cache(uid=None):
+    """Removes the object of the UID from the cache of the current request
+
+    :param uid: The UID of the object. Clears the whole cache if None
+    """
+    request = get_request()
+    if request is None:
+        return
+    cache = request.get(UID_CACHE_KEY)
+    if not cache:
+        return
+    if uid is None:
+        cache.clear()
+    else:
+        cache.pop(uid, None)
 
 
 def get_object_by_path(path, default=_marker):
@@ -623,31 +714,179 @@ def search(query, catalog=_marker):
     if not isinstance(portal_types, (tuple, list)):
         portal_types = [portal_types]
 
-    # The catalogs used for the query
-    catalogs = []
+    # The catalogs used for the query: catalog id -> (catalog, portal types)
+    catalogs = OrderedDict()
 
     # The user did **not** specify a catalog
     if catalog is _marker:
         # Find the registered catalogs for the queried portal types
         for portal_type in portal_types:
             # Just get the first registered/default catalog
-            catalogs.append(get_catalogs_for(
-                portal_type, default="portal_catalog")[0])
+            cat = get_catalogs_for(portal_type, default="portal_catalog")[0]
+            catalogs.setdefault(cat.getId(), (cat, []))[1].append(portal_type)
     else:
         # User defined catalogs
-        if isinstance(catalog, (list, tuple)):
-            catalogs.extend(map(get_tool, catalog))
+        if not isinstance(catalog, (list, tuple)):
+            catalog = [catalog]
+        for cat in map(get_tool, catalog):
+            catalogs.setdefault(cat.getId(), (cat, []))
+
+    if not catalogs:
+        return get_portal_catalog()(query)
+
+    if len(catalogs) == 1:
+        return catalogs.values()[0][0](query)
+
+    # The batch is sliced from the merged results. Every catalog only needs
+    # to sort the results up to the end of the batch
+    query = dict(query)
+    b_start = query.pop("b_start", 0) or 0
+    b_size = query.pop("b_size", None)
+    if b_size is not None:
+        limit = b_start + b_size
+        query["sort_limit"] = min(query.get("sort_limit") or limit, limit)
+
+    # Query every catalog for its portal types and merge the results
+    queries = []
+    for cat, types in catalogs.values():
+        if types:
+            queries.append((cat, dict(query, portal_type=types)))
         else:
-            catalogs.append(get_tool(catalog))
+            queries.append((cat, query))
+    results = MultiCatalogResults(queries)
+    if b_size is not None:
+        return results[b_start:b_start + b_size]
+    return results
+
+
+class MultiCatalogResults(object):
+    """Results of a query spanning multiple catalogs
+
+    Every catalog is searched with the same sort criteria (and `sort_limit`),
+    so the results of each catalog are already sorted. Batching parameters
+    (`b_start`, `b_size`) are resolved by `search` on the merged results. The results are merged
+    lazily: only the brains up to the highest position requested are merged,
+    so slicing the first page of a large result set is cheap.
+    """
+
+    def __init__(self, queries):
+        query = queries[0][1]
+        self.sort_on = query.get("sort_on")
+        if isinstance(self.sort_on, (list, tuple)):
+            # Only sorting by the first index is supported
+            self.sort_on = self.sort_on[0]
+        sort_order = query.get("sort_order", "ascending")
+        if isinstance(sort_order, (list, tuple)):
+            sort_order = sort_order[0]
+        self.reverse = sort_order in ("reverse", "descending")
+        self.sort_limit = query.get("sort_limit")
+
+        self.results = [(cat, cat(query)) for cat, query in queries]
+        self.actual_result_count = sum(
+            [getattr(results, "actual_result_count", len(results))
+             for cat, results in self.results])
+        self._merged = []
+        self._merge = self._iter_merge()
+
+    def __len__(self):
+        length = sum([len(results) for cat, results in self.results])
+        if self.sort_limit:
+            return min(length, self.sort_limit)
+        return length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            self._fill(stop)
+            return self._merged[start:stop:step]
+        if index < 0:
+            index += len(self)
+        self._fill(index + 1)
+        if index < 0 or index >= len(self._merged):
+            raise IndexError(index)
+        return self._merged[index]
+
+    def __getslice__(self, start, stop):
+        return self.__getitem__(slice(start, stop))
+
+    def __iter__(self):
+        position = 0
+        while True:
+            self._fill(position + 1)
+            if position >= len(self._merged):
+                return
+            yield self._merged[position]
+            position += 1
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def _fill(self, size):
+        """Merges the results up to the given size
+        """
+        size = min(size, len(self))
+        while len(self._merged) < size:
+            try:
+                self._merged.append(next(self._merge))
+            except StopIteration:
+                break
+
+    def _iter_merge(self):
+        """Yields the brains of all catalogs in sort order (k-way merge)
+        """
+        if not self.sort_on:
+            for cat, results in self.results:
+                for brain in results:
+                    yield brain
+            return
+
+        heap = []
+        for num, (cat, results) in enumerate(self.results):
+            get_key = self._get_sort_key_getter(cat)
+            self._push(heap, num, iter(results), get_key)
+        while heap:
+            key, num, brain, iterator, get_key = heapq.heappop(heap)
+            yield brain
+            self._push(heap, num, iterator, get_key)
+
+    def _push(self, heap, num, iterator, get_key):
+        """Pushes the next brain of the catalog results to the heap
+        """
+        try:
+            brain = next(iterator)
+        except StopIteration:
+            return
+        key = get_key(brain)
+        if self.reverse:
+            key = _ReverseKey(key)
+        heapq.heappush(heap, (key, num, brain, iterator, get_key))
+
+    def _get_sort_key_getter(self, cat):
+        """Returns a function that returns the value a brain of the catalog
+        is sorted by: the metadata column if the catalog has one, the value
+        of the sort index otherwise
+        """
+        sort_on = self.sort_on
+        if sort_on in cat.schema():
+            return lambda brain: getattr(brain, sort_on, None)
+        index = cat._catalog.getIndex(sort_on)
+        return lambda brain: index.getEntryForObject(brain.getRID(), None)
+
+
+class _ReverseKey(object):
+    """Sort key that sorts the value in descending order
+    """
+
+    __slots__ = ("value", )
 
-    # Cleanup: Avoid duplicate catalogs
-    catalogs = list(set(catalogs)) or [get_portal_catalog()]
+    def __init__(self, value):
+        self.value = value
 
-    # We only support **single** catalog queries
-    if len(catalogs) > 1:
-        fail("Multi Catalog Queries are not supported, please specify a catalog.")
+    def __lt__(self, other):
+        return other.value < self.value
 
-    return catalogs[0](query)
+    def __eq__(self, other):
+        return self.value == other.value
 
 
 def safe_getattr(brain_or_object, attr, default=_marker):
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Persistent counters of the assigned and unassigned analyses of Analysis
+Requests
+
+Every Analysis Request keeps the worksheet assignment of its analyses, so the
+`assigned_state` index is computed without waking up the analyses. The
+counters are updated when analyses are added, removed, assigned, unassigned,
+retracted, cancelled or rejected.
+"""
+
+import transaction
+from Acquisition import aq_base
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from bika.lims import api
+from bika.lims import logger
+from bika.lims.catalog import CATALOG_ANALYSIS_LISTING
+from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
+from persistent import Persistent
+
+# Attribute of the Analysis Request the counter is stored in
+COUNTER_ATTRIBUTE = "_assigned_state_counter"
+
+STATE_VAR = "worksheetanalysis_review_state"
+
+# Number of Analysis Requests checked between commits
+CHECK_BATCH_SIZE = 1000
+
+
+class AssignedStateCounter(Persistent):
+    """Worksheet assignment of the analyses of an Analysis Request
+
+    `analyses` maps the UID of every analysis to True if assigned, so repeated
+    updates of the same analysis are counted once. `total` and `unassigned` are
+    `BTrees.Length` counters, which resolve concurrent increments.
+    """
+
+    def __init__(self):
+        self.analyses = OOBTree()
+        self.total = Length()
+        self.unassigned = Length()
+
+    def set(self, uid, assigned):
+        """Sets the assignment of the analysis
+        """
+        assigned = bool(assigned)
+        old = self.analyses.get(uid)
+        if old == assigned:
+            return
+        if old is None:
+            self.total.change(1)
+            if not assigned:
+                self.unassigned.change(1)
+        else:
+            self.unassigned.change(assigned and -1 or 1)
+        self.analyses[uid] = assigned
+
+    def remove(self, uid):
+        """Removes the analysis
+        """
+        old = self.analyses.get(uid)
+        if old is None:
+            return
+        del self.analyses[uid]
+        self.total.change(-1)
+        if not old:
+            self.unassigned.change(-1)
+
+    def get_state(self):
+        """Returns `unassigned` if there are no analyses or at least one is
+        unassigned. Otherwise, returns `assigned`
+        """
+        if not self.total() or self.unassigned():
+            return "unassigned"
+        return "assigned"
+
+    def __eq__(self, other):
+        if not isinstance(other, AssignedStateCounter):
+            return False
+        return dict(self.analyses.items()) == dict(other.analyses.items()) \
+            and self.total() == other.total() \
+            and self.unassigned() == other.unassigned()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def get_counter(request):
+    """Returns the counter of the Analysis Request or None if not built yet
+    """
+    return getattr(aq_base(request), COUNTER_ATTRIBUTE, None)
+
+
+def is_counted(analysis):
+    """Checks if the analysis is counted, i.e. it is a routine analysis
+    """
+    return api.get_portal_type(analysis) == "Analysis"
+
+
+def is_assigned(analysis):
+    """Checks if the analysis is assigned to a worksheet
+    """
+    return api.get_workflow_status_of(analysis, STATE_VAR) == "assigned"
+
+
+def get_assigned_state(request):
+    """Returns `assigned` or `unassigned` from the counter of the Analysis
+    Request or None if the counter is not built
+    """
+    counter = get_counter(request)
+    if counter is None:
+        return None
+    return counter.get_state()
+
+
+def update_assigned_state(analysis, request=None):
+    """Updates the counter of the Analysis Request with the assignment of the
+    analysis. The counter is built from the analysis catalog if missing
+
+    :param analysis: The analysis that was added or transitioned
+    :param request: The Analysis Request of the analysis
+    """
+    if not is_counted(analysis):
+        return
+    if request is None:
+        request = analysis.getRequest()
+    counter = get_counter(request)
+    if counter is None:
+        counter = rebuild_assigned_state(request)
+    counter.set(api.get_uid(analysis), is_assigned(analysis))
+
+
+def remove_assigned_state(analysis, request=None):
+    """Removes the analysis from the counter of the Analysis Request
+
+    :param analysis: The removed analysis
+    :param request: The Analysis Request the analysis was removed from
+    """
+    if not is_counted(analysis):
+        return
+    if request is None:
+        request = analysis.getRequest()
+    counter = get_counter(request)
+    if counter is not None:
+        counter.remove(api.get_uid(analysis))
+
+
+def build_counter(request):
+    """Returns a new counter built from the analyses of the Analysis Request
+    in the analysis catalog
+    """
+    catalog = api.get_tool(CATALOG_ANALYSIS_LISTING)
+    brains = catalog.unrestrictedSearchResults(
+        portal_type="Analysis", getRequestUID=api.get_uid(request))
+    counter = AssignedStateCounter()
+    for brain in brains:
+        assigned = getattr(brain, STATE_VAR, None) == "assigned"
+        counter.set(brain.UID, assigned)
+    return counter
+
+
+def rebuild_assigned_state(request):
+    """Rebuilds the counter of the Analysis Request from the analysis catalog
+    """
+    counter = build_counter(request)
+    setattr(request, COUNTER_ATTRIBUTE, counter)
+    return counter
+
+
+def check_assigned_states(fix=True):
+    """Checks the counters of all Analysis Requests against the analysis
+    catalog and rebuilds the ones that are missing or inconsistent. The
+    transaction is committed every `CHECK_BATCH_SIZE` Analysis Requests
+
+    :param fix: Rebuild and reindex the inconsistent counters
+    :returns: The number of inconsistent counters
+    """
+    catalog = api.get_tool(CATALOG_ANALYSIS_REQUEST_LISTING)
+    brains = catalog.unrestrictedSearchResults(portal_type="AnalysisRequest")
+    total = len(brains)
+    logger.info("Checking the assigned state of {} Analysis Requests ..."
+                .format(total))
+    inconsistent = 0
+    for num, brain in enumerate(brains):
+        if num and num % CHECK_BATCH_SIZE == 0:
+            logger.info("Checking the assigned state: {}/{}"
+                        .format(num, total))
+            transaction.commit()
+            api.get_portal()._p_jar.cacheGC()
+        request = brain._unrestrictedGetObject()
+        counter = build_counter(request)
+        if counter == get_counter(request):
+            continue
+        inconsistent += 1
+        if not fix:
+            logger.warn("Inconsistent assigned state: {}"
+                        .format(api.get_path(request)))
+            continue
+        setattr(request, COUNTER_ATTRIBUTE, counter)
+        if brain.assigned_state != counter.get_state():
+            request.reindexObject(idxs=["assigned_state"])
+    logger.info("{} inconsistent assigned states {}".format(
+        inconsistent, fix and "rebuilt" or "found"))
+    return inconsistent
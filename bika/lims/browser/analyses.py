@@ -23,7 +23,7 @@ from bika.lims.utils import (check_permission, dicts_to_dict, format_supsub,
                              formatDecimalMark, get_image, get_link, getUsers,
                              t)
 from bika.lims.utils.analysis import format_uncertainty
-from bika.lims.workflow import isActive, wasTransitionPerformed
+from bika.lims.workflow import isActive, wasTransitionPerformedFor
 from plone.memoize import view as viewcache
 from Products.Archetypes.config import REFERENCE_CATALOG
 from Products.CMFCore.utils import getToolByName
@@ -181,6 +181,10 @@ class AnalysesView(BikaListingView):
         # Is managed by `is_analysis_edition_allowed` function
         self._keywords_poc_map = dict()
 
+        # Number of objects woken up by `get_object` while rendering, to keep
+        # track of the rows that cannot be rendered with the catalog metadata
+        self.woken_objects = 0
+
         # This is used to display method and instrument columns if there is at
         # least one analysis to be rendered that allows the assignment of method
         # and/or instrument
@@ -221,16 +225,7 @@ class AnalysesView(BikaListingView):
             # Retracted analyses cannot be edited
             return False
 
-        analysis_obj = None
-        analysis_keyword = analysis_brain.getKeyword
-        if analysis_keyword not in self._keywords_poc_map:
-            # Store the point of capture for this analysis keyword in cache, so
-            # waking up analyses with same keyword will not be longer required
-            analysis_obj = api.get_object(analysis_brain)
-            analysis_poc = analysis_obj.getPointOfCapture()
-            self._keywords_poc_map[analysis_keyword] = analysis_poc
-
-        poc = self._keywords_poc_map[analysis_keyword]
+        poc = self.get_point_of_capture(analysis_brain)
         if poc == 'field':
             # This analysis must be captured on field, during sampling.
             if not self.has_permission(EditFieldResults):
@@ -242,8 +237,7 @@ class AnalysesView(BikaListingView):
             # lab analyses.
             return False
 
-        analysis_obj = analysis_obj or api.get_object(analysis_brain)
-        if wasTransitionPerformed(analysis_obj, 'submit'):
+        if wasTransitionPerformedFor(analysis_brain, 'submit'):
             # Analysis has been already submitted. This analysis cannot be
             # edited anymore.
             return False
@@ -253,6 +247,23 @@ class AnalysesView(BikaListingView):
         # instrument assigned or the instrument assigned is valid.
         return self.is_analysis_instrument_valid(analysis_brain)
 
+    def get_point_of_capture(self, analysis_brain):
+        """Returns the point of capture of the analysis passed in. The value is
+        cached by analysis keyword and taken from the catalog metadata, so the
+        analysis is only woken up if the brain is outdated
+
+        :param analysis_brain: Brain that represents an analysis
+        :return: 'lab' or 'field'
+        """
+        analysis_keyword = analysis_brain.getKeyword
+        if analysis_keyword not in self._keywords_poc_map:
+            poc = getattr(analysis_brain, 'getPointOfCapture', None)
+            if not poc:
+                # Missing metadata, not reindexed yet
+                poc = self.get_object(analysis_brain).getPointOfCapture()
+            self._keywords_poc_map[analysis_keyword] = poc
+        return self._keywords_poc_map[analysis_keyword]
+
     @viewcache.memoize
     def is_analysis_instrument_valid(self, analysis_brain):
         """Return if the analysis has a valid instrument.
@@ -291,7 +302,10 @@ class AnalysesView(BikaListingView):
         :returns: content object
         """
         if api.is_uid(brain_or_object_or_uid):
+            self.woken_objects += 1
             return api.get_object_by_uid(brain_or_object_or_uid, default=None)
+        if api.is_brain(brain_or_object_or_uid):
+            self.woken_objects += 1
         if api.is_object(brain_or_object_or_uid):
             return api.get_object(brain_or_object_or_uid)
         return None
@@ -637,6 +651,9 @@ class AnalysesView(BikaListingView):
         self.columns['Method']['toggle'] = self.show_methodinstr_columns
         self.columns['Instrument']['toggle'] = self.show_methodinstr_columns
 
+        logger.debug("{}: {} objects woken up to render {} items".format(
+            self.__class__.__name__, self.woken_objects, len(items)))
+
         return items
 
     def _folder_item_category(self, analysis_brain, item):
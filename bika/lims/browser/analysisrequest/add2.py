@@ -5,10 +5,12 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
+import collections
 import json
 from datetime import datetime
 
 import magnitude
+import transaction
 from BTrees.OOBTree import OOBTree
 from DateTime import DateTime
 from Products.CMFPlone.utils import _createObjectByType
@@ -29,7 +31,7 @@ from bika.lims import bikaMessageFactory as _
 from bika.lims import logger
 from bika.lims.interfaces import IGetDefaultFieldValueARAddHook
 from bika.lims.utils import tmpID
-from bika.lims.utils.analysisrequest import create_analysisrequest as crar
+from bika.lims.utils.analysisrequest import create_analysisrequests
 
 AR_CONFIGURATION_STORAGE = "bika.lims.browser.analysisrequest.manage.add"
 SKIP_FIELD_ON_COPY = ["Sample"]
@@ -1658,8 +1660,8 @@ class ajaxAnalysisRequestAddView(AnalysisRequestAddView):
 
             profile_uids = record.get("Profiles_uid", "").split(",")
             profile_uids = filter(lambda x: x, profile_uids)
-            profiles = map(self.get_object_by_uid, profile_uids)
-            services = map(self.get_object_by_uid, record.get("Analyses", []))
+            profiles = api.get_objects_by_uids(profile_uids)
+            services = api.get_objects_by_uids(record.get("Analyses", []))
 
             # ANALYSIS PROFILES PRICE
             for profile in profiles:
@@ -1835,8 +1837,8 @@ class ajaxAnalysisRequestAddView(AnalysisRequestAddView):
             errors["fielderrors"] = fielderrors
             return {'errors': errors}
 
-        # Process Form
-        ARs = []
+        # Process Form, creating the Analysis Requests of every client at once
+        records_by_client = collections.OrderedDict()
         for n, record in enumerate(valid_records):
             client_uid = record.get("Client")
             client = self.get_object_by_uid(client_uid)
@@ -1846,13 +1848,27 @@ class ajaxAnalysisRequestAddView(AnalysisRequestAddView):
 
             # get the specifications and pass them directly to the AR create function.
             specifications = record.pop("Specifications", {})
-
-            # Create the Analysis Request
-            try:
-                ar = crar(client, self.request, record, specifications=specifications)
-            except (KeyError, RuntimeError) as e:
-                errors["message"] = e.message
+            client, numbers, records = records_by_client.setdefault(
+                client_uid, (client, [], []))
+            numbers.append(n)
+            records.append({"values": record,
+                            "specifications": specifications})
+
+        # Create the Analysis Requests. The ARs of the form are created all
+        # or none, so the ARs created before a failing record are discarded
+        savepoint = transaction.savepoint()
+        created = []
+        for client, numbers, records in records_by_client.values():
+            ars, create_errors = create_analysisrequests(
+                client, self.request, records)
+            if create_errors:
+                savepoint.rollback()
+                errors["message"] = create_errors.values()[0]
                 return {"errors": errors}
+            created.extend(zip(numbers, ars))
+
+        ARs = []
+        for n, ar in sorted(created):
             ARs.append(ar.Title())
 
             _attachments = []
@@ -103,6 +103,7 @@ class AnalysisRequestsView(BikaListingView):
             ("getClientOrderNumber", {
                 "title": _("Client Order"),
                 "sortable": True,
+                "index": "getClientOrderNumber",
                 "toggle": True}),
             ("Creator", {
                 "title": PMF("Creator"),
@@ -158,6 +159,7 @@ class AnalysisRequestsView(BikaListingView):
             ("getSampleTypeTitle", {
                 "title": _("Sample Type"),
                 "sortable": True,
+                "index": "getSampleTypeTitle",
                 "toggle": True}),
             ("getSamplePointTitle", {
                 "title": _("Sample Point"),
@@ -208,7 +210,7 @@ class AnalysisRequestsView(BikaListingView):
             ("getProfilesTitle", {
                 "title": _("Profile"),
                 "sortable": True,
-                "index": "getProfilesTitle",
+                "index": "getProfilesTitleStr",
                 "toggle": False}),
             ("getAnalysesNum", {
                 "title": _("Number of Analyses"),
@@ -13,12 +13,13 @@ from copy import copy
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
-from operator import itemgetter
+from operator import attrgetter
 from smtplib import SMTPAuthenticationError
 from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from time import time
 
 import App
-import transaction
+from Acquisition import aq_base
 from DateTime import DateTime
 from Products.Archetypes.interfaces import IDateTimeField, IFileField, \
     ILinesField, IReferenceField, IStringField, ITextField
@@ -27,13 +28,19 @@ from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.utils import _createObjectByType, safe_unicode
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from bika.lims import POINTS_OF_CAPTURE, bikaMessageFactory as _, t
+from bika.lims import api
 from bika.lims import logger
 from bika.lims.browser import BrowserView, ulocalized_time
+from bika.lims.browser.fields.proxyfield import get_many
+from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
 from bika.lims.catalog.analysis_catalog import CATALOG_ANALYSIS_LISTING
+from bika.lims.digestqueue import dequeue_digest
+from bika.lims.digestqueue import is_digest_queued
+from bika.lims.digestqueue import queue_digest
 from bika.lims.idserver import renameAfterCreation
 from bika.lims.interfaces import IAnalysisRequest, IResultOutOfRange
 from bika.lims.interfaces.field import IUIDReferenceField
-from bika.lims.utils import attachPdf, createPdf, encode_header, \
+from bika.lims.utils import attachPdf, createPdf, createPdfs, encode_header, \
     format_supsub, \
     isnumber
 from bika.lims.utils import formatDecimalMark, to_utf8
@@ -305,19 +312,70 @@ class AnalysisRequestPublishView(BrowserView):
         uids = self.request.form.get('uid').split(':')
         reporthtml = "<html><head>%s</head><body><div " \
                      "id='report'>%s</body></html>" % (style, html)
+        results_html = safe_unicode(reporthtml).encode('utf-8')
+        return self.publishReports([(uid, results_html) for uid in uids])
+
+    def publishReports(self, reports):
+        """Publishes the HTML reports of the ARs. The PDFs of two or more ARs
+        are rendered in parallel by a pool of processes, while the data of
+        the ARs is gathered and the reports and emails are recorded in the
+        current thread. Identical HTML reports are rendered only once. The
+        ARs of a report that cannot be rendered are not published.
+
+        :param reports: list of (AR UID, HTML report) tuples
+        :returns: list of the published ARs
+        """
+        if len(reports) < 2:
+            publishedars = []
+            for aruid, results_html in reports:
+                publishedars.extend(
+                    self.publishFromHTML(aruid, results_html))
+            return publishedars
+
+        # Gather the publishable ARs and their distinct HTML reports
+        htmlreports = []
+        arsbyreport = []
+        for aruid, results_html in reports:
+            ar = self.getPublishableAnalysisRequest(aruid)
+            if ar is None:
+                continue
+            self._writeDebugHTML(ar, results_html)
+            if results_html in htmlreports:
+                arsbyreport[htmlreports.index(results_html)].append(ar)
+                continue
+            htmlreports.append(results_html)
+            arsbyreport.append([ar])
+
+        # Record the reports and send the emails as the PDFs are rendered
         publishedars = []
-        for uid in uids:
-            ars = self.publishFromHTML(
-                uid, safe_unicode(reporthtml).encode('utf-8'))
-            publishedars.extend(ars)
+        start = time()
+        total = len(htmlreports)
+        pdfs = createPdfs(htmlreports)
+        for num, (index, pdf_report, seconds) in enumerate(pdfs, 1):
+            ars = arsbyreport[index]
+            if pdf_report is None:
+                logger.error("Publish: PDF {}/{} for {} failed, not published"
+                             .format(num, total,
+                                     ", ".join(map(api.get_id, ars))))
+                continue
+            logger.info("Publish: PDF {}/{} for {} rendered in {:.2f}s"
+                        .format(num, total, ", ".join(map(api.get_id, ars)),
+                                seconds))
+            for ar in ars:
+                publishedars.extend(
+                    self.publishPDF(ar, htmlreports[index], pdf_report))
+        logger.info("Publish: {} ARs published in {:.2f}s"
+                    .format(len(publishedars), time() - start))
         return publishedars
 
-    def publishFromHTML(self, aruid, results_html):
+    def getPublishableAnalysisRequest(self, aruid):
+        """Returns the AR with the UID if it can be published, else None
+        """
         # The AR can be published only and only if allowed
         uc = getToolByName(self.context, 'uid_catalog')
         ars = uc(UID=aruid)
         if not ars or len(ars) != 1:
-            return []
+            return None
 
         ar = ars[0].getObject()
         wf = getToolByName(self.context, 'portal_workflow')
@@ -326,15 +384,26 @@ class AnalysisRequestPublishView(BrowserView):
         if wf.getInfoFor(ar, 'review_state') not in allowed_states:
             # Pre-publish allowed?
             if not ar.getAnalyses(review_state=allowed_states):
-                return []
+                return None
+        return ar
 
-        # HTML written to debug file
-        debug_mode = App.config.getConfiguration().debug_mode
-        if debug_mode:
+    def _writeDebugHTML(self, ar, results_html):
+        """HTML written to debug file
+        """
+        if App.config.getConfiguration().debug_mode:
             tmp_fn = tempfile.mktemp(suffix=".html")
             logger.debug("Writing HTML for %s to %s" % (ar.Title(), tmp_fn))
             open(tmp_fn, "wb").write(results_html)
 
+    def publishFromHTML(self, aruid, results_html):
+        ar = self.getPublishableAnalysisRequest(aruid)
+        if ar is None:
+            return []
+
+        # HTML written to debug file
+        self._writeDebugHTML(ar, results_html)
+        debug_mode = App.config.getConfiguration().debug_mode
+
         # Create the pdf report (will always be attached to the AR)
         # we must supply the file ourself so that createPdf leaves it alone.
         pdf_fn = tempfile.mktemp(suffix=".pdf")
@@ -346,6 +415,14 @@ class AnalysisRequestPublishView(BrowserView):
         else:
             os.remove(pdf_fn)
 
+        return self.publishPDF(ar, results_html, pdf_report)
+
+    def publishPDF(self, ar, results_html, pdf_report):
+        """Attaches the PDF report to the AR, transitions the AR and sends the
+        report to the lab managers and the recipients of the AR
+        """
+        wf = getToolByName(self.context, 'portal_workflow')
+        debug_mode = App.config.getConfiguration().debug_mode
         recipients = []
         contact = ar.getContact()
         lab = ar.bika_setup.laboratory
@@ -475,17 +552,18 @@ class AnalysisRequestPublishView(BrowserView):
         result).
         """
         if len(self._ars) > 1:
-            published_ars = []
+            reports = []
             for ar in self._ars:
                 arpub = AnalysisRequestPublishView(
                     ar, self.request, publish=True)
-                ar = arpub.publish()
-                published_ars.extend(ar)
+                results_html = safe_unicode(arpub.template()).encode('utf-8')
+                reports.append((ar.UID(), results_html))
+            published_ars = self.publishReports(reports)
             published_ars = [par.id for par in published_ars]
             return published_ars
 
         results_html = safe_unicode(self.template()).encode('utf-8')
-        return self.publishFromHTML(results_html)
+        return self.publishFromHTML(self.context.UID(), results_html)
 
     def get_recipients(self, ar):
         """Returns a list with the recipients and all its publication prefs
@@ -690,12 +768,13 @@ class AnalysisRequestDigester:
 
     Passing overwrite=True when calling the instance will cause the
     ar.Digest field to be overwritten with a new digestion.  This flag
-    is set True by default in the EndRequestHandler that is responsible for
-    automated re-building.
+    is set True by the digest queue that is responsible for automated
+    re-building.
 
     It should be run once when the AR is verified (or when a verified AR is
     modified) to pre-digest the data so that AnalysisRequestPublishView will
-    run a little faster.
+    run a little faster. The sections of the previous digestion whose source
+    objects did not change since are reused.
 
     Note: ProxyFields are not included in the reading of the schema.  If you
     want to access sample fields in the report template, you must refer
@@ -716,17 +795,30 @@ class AnalysisRequestDigester:
             'locallyAllowedTypes', 'nextPreviousEnabled', 'constrainTypesMode',
             'RestrictedCategories', 'Digest',
         ]
+        # (batch UID, analysis states) -> keyword -> brains of the results
+        self._batch_histories = {}
+        # UID -> dict of the analyses displayed as previous results
+        self._previous_analyses = {}
 
     def __call__(self, ar, overwrite=False):
         # cheating
         self.context = ar
         self.request = ar.REQUEST
 
+        # Prevent any error related with digest
+        previous = ar.getDigest() if hasattr(ar, 'getDigest') else {}
+        if not isinstance(previous, dict):
+            previous = {}
+
+        if not overwrite and is_digest_queued(ar):
+            # Modified after the last digestion, but not digested yet
+            dequeue_digest(ar)
+            overwrite = True
+
         # if AR was previously digested, use existing data (if exists)
         verified = wasTransitionPerformed(ar, 'verify')
         if not overwrite and verified:
-            # Prevent any error related with digest
-            data = ar.getDigest() if hasattr(ar, 'getDigest') else {}
+            data = previous
             if data:
                 # Check if the department managers have changed since
                 # verification:
@@ -751,7 +843,7 @@ class AnalysisRequestDigester:
         logger.info("=========== creating new data for %s" % ar)
 
         # Set data to the AR schema field, and return it.
-        data = self._ar_data(ar)
+        data = self._ar_data(ar, previous=previous)
         if hasattr(ar, 'setDigest'):
             ar.setDigest(data)
         logger.info("=========== new data for %s created." % ar)
@@ -769,15 +861,15 @@ class AnalysisRequestDigester:
             'obj': instance,
         }
 
-        fields = instance.Schema().fields()
+        fields = [fld for fld in instance.Schema().fields()
+                  if fld.getName() not in self.SKIP_FIELDNAMES
+                  and not (skip_fields and fld.getName() in skip_fields)
+                  and fld.type != 'computed']
+        # Proxied values are read with one resolution of every proxy
+        rawvalues = get_many(instance, [fld.getName() for fld in fields])
         for fld in fields:
             fieldname = fld.getName()
-            if fieldname in self.SKIP_FIELDNAMES \
-                    or (skip_fields and fieldname in skip_fields) \
-                    or fld.type == 'computed':
-                continue
-
-            rawvalue = fld.get(instance)
+            rawvalue = rawvalues[fieldname]
 
             if rawvalue is True or rawvalue is False:
                 # Booleans are special; we'll str and return them.
@@ -905,12 +997,45 @@ class AnalysisRequestDigester:
         } for e in history if e['action']}
         return data
 
-    def _ar_data(self, ar, excludearuids=None):
+    def _get_signature(self, *objs):
+        """Returns the signature of the objects passed in: their UIDs with the
+        serials of their last committed changes. Returns None if any of the
+        objects has uncommitted changes
+        """
+        signature = []
+        for obj in objs:
+            if not obj:
+                signature.append(None)
+                continue
+            base = aq_base(obj)
+            base._p_activate()
+            if base._p_jar is None or base._p_changed:
+                return None
+            signature.append((obj.UID(), base._p_serial))
+        return tuple(signature)
+
+    def _set_section(self, data, previous, name, sources, func, *args):
+        """Sets the section of the digestion, reusing the section of the
+        previous digestion if its source objects did not change since
+        """
+        signature = self._get_signature(*sources)
+        signatures = data.setdefault('signatures', {})
+        signatures[name] = signature
+        previous_signatures = previous and previous.get('signatures') or {}
+        if signature is not None and name in previous \
+                and previous_signatures.get(name) == signature:
+            data[name] = previous[name]
+            return
+        data[name] = func(*args)
+
+    def _ar_data(self, ar, excludearuids=None, previous=None):
         """ Creates an ar dict, accessible from the view and from each
             specific template.
         """
         if not excludearuids:
             excludearuids = []
+        if not previous:
+            previous = {}
         bs = ar.bika_setup
         data = {'obj': ar,
                 'id': ar.getId(),
@@ -960,12 +1085,34 @@ class AnalysisRequestDigester:
         data['prepublish'] = wf.getInfoFor(ar,
                                            'review_state') not in allowed_states
 
-        data['contact'] = self._contact_data(ar)
-        data['client'] = self._client_data(ar)
-        data['sample'] = self._sample_data(ar)
-        data['batch'] = self._batch_data(ar)
-        data['specifications'] = self._specs_data(ar)
-        data['analyses'] = self._analyses_data(ar, ['verified', 'published'])
+        client = ar.aq_parent
+        sample = ar.getSample()
+        sample_sources = [sample]
+        if sample:
+            sample_sources.extend([sample.getSampleType(),
+                                   sample.getSamplePoint()])
+        batch = ar.getBatch()
+        batch_sources = [batch] + self._get_batch_labels(batch)
+        specs = ar.getPublicationSpecification() or ar.getSpecification()
+        self._set_section(data, previous, 'contact', [ar.getContact()],
+                          self._contact_data, ar)
+        self._set_section(data, previous, 'client', [client],
+                          self._client_data, ar)
+        self._set_section(data, previous, 'sample', sample_sources,
+                          self._sample_data, ar)
+        if data['sample'] and data['sample'] is previous.get('sample'):
+            # The sampler is read from the member properties, which have no
+            # serial to tell if they changed
+            data['sample'] = dict(data['sample'],
+                                  sampler=self._sampler_data(sample))
+        self._set_section(data, previous, 'batch', batch_sources,
+                          self._batch_data, ar)
+        self._set_section(data, previous, 'specifications', [specs],
+                          self._specs_data, ar)
+        data['analyses'] = self._analyses_data(
+            ar, ['verified', 'published'],
+            previous=previous.get('analyses'),
+            sources=[bs, client, batch, specs])
         data['qcanalyses'] = self._qcanalyses_data(ar,
                                                    ['verified', 'published'])
         data['points_of_capture'] = sorted(
@@ -1028,7 +1175,9 @@ class AnalysisRequestDigester:
         portal = self.context.portal_url.getPortalObject()
         data['portal'] = {'obj': portal,
                           'url': portal.absolute_url()}
-        data['laboratory'] = self._lab_data()
+        lab = bs.laboratory
+        self._set_section(data, previous, 'laboratory',
+                          [lab, lab.getSupervisor()], self._lab_data)
 
         # results interpretation
         data = self._set_results_interpretation(ar, data)
@@ -1119,13 +1268,22 @@ class AnalysisRequestDigester:
                     'client_batchid': to_utf8(batch.getClientBatchID()),
                     'remarks': to_utf8(batch.getRemarks())}
 
-            uids = batch.Schema()['BatchLabels'].getAccessor(batch)()
-            uc = getToolByName(self.context, 'uid_catalog')
-            data['labels'] = [to_utf8(p.getObject().Title()) for p in
-                              uc(UID=uids)]
+            data['labels'] = [to_utf8(label.Title()) for label in
+                              self._get_batch_labels(batch)]
 
         return data
 
+    def _get_batch_labels(self, batch):
+        """Returns the BatchLabel objects of the batch
+        """
+        if not batch:
+            return []
+        uids = batch.Schema()['BatchLabels'].getAccessor(batch)()
+        if not uids:
+            return []
+        uc = getToolByName(self.context, 'uid_catalog')
+        return [brain.getObject() for brain in uc(UID=uids)]
+
     def _sample_data(self, ar):
         data = {}
         sample = ar.getSample()
@@ -1270,13 +1428,25 @@ class AnalysisRequestDigester:
 
         return data
 
-    def _analyses_data(self, ar, analysis_states=None):
+    def _analyses_data(self, ar, analysis_states=None, previous=None,
+                       sources=None):
+        """Returns the list of analysis dicts. The dicts of the analyses in
+        `previous` are reused if neither the analysis nor the `sources` they
+        depend on changed since. Previous results of analyses from the same
+        batch are always read again.
+        """
         if not analysis_states:
             analysis_states = ['verified', 'published']
         analyses = []
+        reusable = {}
+        base_signature = sources and self._get_signature(*sources)
+        if previous and base_signature and not ar.getBatch():
+            for andict in previous:
+                signature = andict.get('signature')
+                if signature and signature[0] == base_signature:
+                    reusable[signature[1]] = andict
         dm = ar.aq_parent.getDecimalMark()
         batch = ar.getBatch()
-        workflow = getToolByName(self.context, 'portal_workflow')
         showhidden = self.isHiddenAnalysesVisible()
 
         catalog = getToolByName(self.context, CATALOG_ANALYSIS_LISTING)
@@ -1289,32 +1459,92 @@ class AnalysisRequestDigester:
             if not showhidden and an.getHidden():
                 continue
 
+            an_signature = self._get_signature(
+                *self._get_analysis_sources(an))
+            if an_signature is not None:
+                an_signature += (brain.review_state, )
+            if an_signature in reusable:
+                analyses.append(reusable[an_signature])
+                continue
+
             # Build the analysis-specific dict
             andict = self._analysis_data(an, dm)
+            if base_signature and an_signature:
+                andict['signature'] = (base_signature, an_signature)
 
             # Are there previous results for the same AS and batch?
             andict['previous'] = []
             andict['previous_results'] = ""
             if batch:
-                keyword = an.getKeyword()
-                bars = [bar for bar in batch.getAnalysisRequests()
-                        if an.aq_parent.UID() != bar.UID()
-                        and keyword in bar]
-                for bar in bars:
-                    pan = bar[keyword]
-                    pan_state = workflow.getInfoFor(pan, 'review_state')
-                    if pan.getResult() and pan_state in analysis_states:
-                        pandict = self._analysis_data(pan)
-                        andict['previous'].append(pandict)
-
-                andict['previous'] = sorted(
-                    andict['previous'], key=itemgetter("capture_date"))
+                history = self._get_batch_history(batch, analysis_states)
+                andict['previous'] = [
+                    self._get_previous_analysis_data(pan)
+                    for pan in history.get(an.getKeyword(), [])
+                    if pan.getParentUID != ar.UID()]
                 andict['previous_results'] = ", ".join(
                     [p['formatted_result'] for p in andict['previous'][-5:]])
 
             analyses.append(andict)
         return analyses
 
+    def _get_analysis_sources(self, analysis):
+        """Returns the objects the dict of the analysis is built from
+        """
+        return [analysis,
+                analysis.getAnalysisService(),
+                analysis.getCategory(),
+                analysis.getMethod(),
+                analysis.getInstrument(),
+                analysis.getWorksheet()]
+
+    def _get_batch_history(self, batch, analysis_states):
+        """Returns the results of the routine analyses of the batch in the
+        states passed in, as a dict of keyword -> list of analysis brains
+        sorted by capture date, with the last captured result of each Analysis
+        Request. Built once per batch from the catalogs
+        """
+        batch_uid = api.get_uid(batch)
+        key = (batch_uid, tuple(sorted(analysis_states)))
+        history = self._batch_histories.get(key)
+        if history is not None:
+            return history
+
+        # The Analysis Requests are reindexed when moved to another batch,
+        # but not their analyses
+        ar_catalog = getToolByName(self.context,
+                                   CATALOG_ANALYSIS_REQUEST_LISTING)
+        ar_uids = [brain.UID for brain in ar_catalog(getBatchUID=batch_uid)]
+        history = {}
+        if ar_uids:
+            catalog = getToolByName(self.context, CATALOG_ANALYSIS_LISTING)
+            brains = catalog(portal_type='Analysis',
+                             getRequestUID=ar_uids,
+                             review_state=analysis_states,
+                             sort_on='getResultCaptureDate')
+            # (Analysis Request UID, keyword) -> last captured result
+            results = {}
+            for brain in brains:
+                if not brain.getResult:
+                    continue
+                results[(brain.getParentUID, brain.getKeyword)] = brain
+            for (ar_uid, keyword), brain in results.items():
+                history.setdefault(keyword, []).append(brain)
+            for brains in history.values():
+                brains.sort(key=attrgetter('getResultCaptureDate'))
+        self._batch_histories[key] = history
+        return history
+
+    def _get_previous_analysis_data(self, brain):
+        """Returns the dict of the analysis displayed as a previous result.
+        Built once per analysis, regardless of the number of Analysis
+        Requests of the batch it is displayed in
+        """
+        uid = api.get_uid(brain)
+        if uid not in self._previous_analyses:
+            analysis = api.get_object(brain)
+            self._previous_analyses[uid] = self._analysis_data(analysis)
+        return self._previous_analyses[uid]
+
     def _analysis_data(self, analysis, decimalmark=None):
 
         andict = {'obj': analysis,
@@ -1501,43 +1731,21 @@ class AnalysisRequestDigester:
 
 def ARModifiedHandler(instance, event):
     """After any modification of an AR that has already been verified,
-    re-populate the ar.Digest.
+    queue the AR to re-populate the ar.Digest after the transaction is
+    committed.
     """
     if IAnalysisRequest.providedBy(instance):
         if wasTransitionPerformed(instance, 'verify'):
-            request = instance.REQUEST
-            ars_to_digest = set(request.get('ars_to_digest', []))
-            ars_to_digest.add(instance)
-            request['ars_to_digest'] = ars_to_digest
+            queue_digest(instance)
 
 
 def AnalysisAfterTransitionHandler(instance, event):
-    """After a 'verify' transition on any analysis, we must set a flag in
-    the request so that the AR is digested before the request terminates.
-    We're doing it here so that the digestion happens only once at the end
-    of the request, regardless of how many children were transitioned.
+    """After a 'verify' transition on any analysis, the AR is queued to be
+    digested after the transaction is committed. The AR is queued once,
+    regardless of how many children were transitioned.
     """
     if event.transition and event.transition.id == 'verify':
-        request = instance.REQUEST
-        ar = instance.aq_parent
-        ars_to_digest = set(request.get('ars_to_digest', []))
-        ars_to_digest.add(ar)
-        request['ars_to_digest'] = ars_to_digest
-
-
-def EndRequestHandler(event):
-    """At the end of the request, we check, to see if any pre-digestion is
-    required, for any ars or analyses that were processed during the request.
-    """
-    request = event.request
-    ars_to_digest = set(request.get('ars_to_digest', []))
-    digester = AnalysisRequestDigester()
-    if ars_to_digest:
-        for ar in ars_to_digest:
-            digester(ar, overwrite=True)
-    # If this commit() is not here, then the data does not appear to be
-    # saved.  IEndRequest happens outside the transaction?
-    transaction.commit()
+        queue_digest(instance.aq_parent)
 
 
 def get_client_address(context):
@@ -30,6 +30,7 @@ from bika.lims.utils import isActive
 from bika.lims.utils import t
 from bika.lims.utils import tmpID
 from bika.lims.workflow import doActionFor
+from bika.lims.workflow import doActionForObjects
 from bika.lims.workflow import getCurrentState
 from bika.lims.workflow import wasTransitionPerformed
 from email.Utils import formataddr
@@ -487,8 +488,7 @@ class AnalysisRequestWorkflowAction(WorkflowAction):
             if can_submit and analysis not in submissable:
                 submissable.append(analysis)
         # and then submit them.
-        for analysis in submissable:
-            doActionFor(analysis, 'submit')
+        doActionForObjects(submissable, 'submit')
 
         # LIMS-2366: Finally, when we are done processing all applicable
         # analyses, we must attempt to initiate the submit transition on the
@@ -8,6 +8,7 @@
 import collections
 import copy
 import DateTime
+import heapq
 import json
 import re
 import time
@@ -15,7 +16,7 @@ import Missing
 from AccessControl import getSecurityManager
 from bika.lims import bikaMessageFactory as _
 from bika.lims import PMF, api, deprecated, logger
-from bika.lims.api import (get_current_user, get_object, get_object_by_uid,
+from bika.lims.api import (get_current_user, get_object, get_objects_by_uids,
                            get_tool, get_transitions_for)
 from bika.lims.browser import BrowserView
 from bika.lims.interfaces import (IFieldIcons, ITopLeftHTMLComponentsHook,
@@ -24,6 +25,7 @@ from bika.lims.interfaces import (IFieldIcons, ITopLeftHTMLComponentsHook,
 from bika.lims.utils import (getFromString, getHiddenAttributesForClass,
                              isActive, t, to_utf8)
 from bika.lims.workflow import doActionFor, skip
+from bika.lims.workflow import transitionBatch
 from plone.app.content.browser import tableview
 from plone.memoize import view as viewcache
 from Products.CMFCore.utils import getToolByName
@@ -33,6 +35,11 @@ from zope.component import getAdapters, getMultiAdapter
 
 COOKIE_LISTING_FILTER_BAR = "bika_listing_filter_bar"
 
+# Number of manual (in-memory) sorts per (catalog, metadata column). A manual
+# sort happens when a listing is sorted on a column that has no sortable index
+# in the catalog. Add a FieldIndex to the catalog definition to avoid it.
+MANUAL_SORT_COUNTER = collections.Counter()
+
 
 class WorkflowAction:
     """Workflow actions taken in any Bika contextAnalysisRequest context
@@ -89,10 +96,8 @@ class WorkflowAction:
         form = self.request.form
         uids = form.get("uids", [])
         selected_items = collections.OrderedDict()
-        for uid in uids:
-            obj = get_object_by_uid(uid)
-            if obj:
-                selected_items[uid] = obj
+        for obj in get_objects_by_uids(uids):
+            selected_items[obj.UID()] = obj
         return selected_items
 
     def workflow_action_default(self, action, came_from):
@@ -215,41 +220,44 @@ class WorkflowAction:
         workflow = getToolByName(self.context, 'portal_workflow')
 
         # transition selected items from the bika_listing/Table.
-        for item in items:
-            # the only actions allowed on inactive/cancelled
-            # items are "reinstate" and "activate"
-            if not isActive(item) and action not in ('reinstate', 'activate'):
-                continue
-            if not skip(item, action, peek=True):
-                allowed_transitions = \
-                    [it['id'] for it in workflow.getTransitionsFor(item)]
-                if action in allowed_transitions:
-                    # if action is "verify" and the item is an analysis or
-                    # reference analysis, check if the if the required number
-                    # of verifications done for the analysis is, at least,
-                    # the number of verifications performed previously+1
-                    if (action == 'verify' and
-                            hasattr(item, 'getNumberOfVerifications') and
-                            hasattr(item, 'getNumberOfRequiredVerifications')):
-                        success = True
-                        message = "Unknown error while submitting."
-                        revers = item.getNumberOfRequiredVerifications()
-                        nmvers = item.getNumberOfVerifications()
-                        member = get_current_user()
-                        username = member.getUserName()
-                        item.addVerificator(username)
-                        if revers - nmvers <= 1:
+        # The transitions promoted to the parents of the items (e.g. to the
+        # Analysis Request of analyses) are performed once at the end
+        with transitionBatch():
+            for item in items:
+                # the only actions allowed on inactive/cancelled
+                # items are "reinstate" and "activate"
+                if not isActive(item) and action not in ('reinstate', 'activate'):
+                    continue
+                if not skip(item, action, peek=True):
+                    allowed_transitions = \
+                        [it['id'] for it in workflow.getTransitionsFor(item)]
+                    if action in allowed_transitions:
+                        # if action is "verify" and the item is an analysis or
+                        # reference analysis, check if the if the required number
+                        # of verifications done for the analysis is, at least,
+                        # the number of verifications performed previously+1
+                        if (action == 'verify' and
+                                hasattr(item, 'getNumberOfVerifications') and
+                                hasattr(item, 'getNumberOfRequiredVerifications')):
+                            success = True
+                            message = "Unknown error while submitting."
+                            revers = item.getNumberOfRequiredVerifications()
+                            nmvers = item.getNumberOfVerifications()
+                            member = get_current_user()
+                            username = member.getUserName()
+                            item.addVerificator(username)
+                            if revers - nmvers <= 1:
+                                success, message = doActionFor(item, action)
+                                if not success:
+                                    # If failed, delete last verificator.
+                                    item.deleteLastVerificator()
+                            item.reindexObject()
+                        else:
                             success, message = doActionFor(item, action)
-                            if not success:
-                                # If failed, delete last verificator.
-                                item.deleteLastVerificator()
-                        item.reindexObject()
-                    else:
-                        success, message = doActionFor(item, action)
-                    if success:
-                        transitioned.append(item.UID())
-                    else:
-                        self.addPortalMessage(message, 'error')
+                        if success:
+                            transitioned.append(item.UID())
+                        else:
+                            self.addPortalMessage(message, 'error')
 
         # automatic label printing
         auto_stickers_action = self.portal.bika_setup.getAutoPrintStickers()
@@ -274,7 +282,9 @@ class BikaListingView(BrowserView):
     description = ""
 
     # The name of the catalog which will, by default, be searched for results
-    # matching self.contentFilter
+    # matching self.contentFilter. A tuple of catalog names searches all of
+    # them and merges the sorted results, see `api.search`. The first catalog
+    # provides the indexes and metadata columns of the listing
     catalog = "portal_catalog"
 
     # This is the list of query parameters passed to the catalog.
@@ -368,6 +378,17 @@ class BikaListingView(BrowserView):
     # it only searches visible items
     manual_sort_on = None
 
+    # The ZCTextIndex of the listing catalog used to filter the results by the
+    # value entered in the search box. The search is delegated to the catalog
+    # and only the brains of the current page are fetched.
+    searchable_text_index = "listing_searchable_text"
+
+    # Match the value entered in the search box against the metadata columns
+    # of all catalog results with a regular expression. This is slow on large
+    # catalogs, but allows to search for any displayed value. It is always
+    # used if the catalog does not provide the `searchable_text_index`
+    enable_metadata_search = False
+
     # Column definitions:
     #
     # The keys of the columns dictionary must all exist in all
@@ -1023,8 +1044,11 @@ class BikaListingView(BrowserView):
 
         :returns: ZCatalog tool
         """
+        catalog = self.catalog
+        if isinstance(catalog, (list, tuple)):
+            catalog = catalog[0]
         try:
-            return api.get_tool(self.catalog)
+            return api.get_tool(catalog)
         except api.BikaLIMSError:
             return api.get_tool(default)
 
@@ -1155,9 +1179,11 @@ class BikaListingView(BrowserView):
         # set the sort_order criteria
         query["sort_order"] = self.get_sort_order()
 
-        # # Pass the searchterm as well to the Searchable Text index
-        # if searchterm and isinstance(searchterm, basestring):
-        #     query.update({"SearchableText": searchterm + "*"})
+        # Pass the searchterm to the searchable text index of the catalog
+        if searchterm and self.is_catalog_search_enabled():
+            text_query = self.make_query_for(searchterm)
+            if text_query:
+                query[self.searchable_text_index] = text_query
 
         # Adding the extra filtering elements
         extra = self.get_filter_bar_queryaddition() or {}
@@ -1257,11 +1283,35 @@ class BikaListingView(BrowserView):
             return re.compile(searchterm, re.IGNORECASE)
         return re.compile(searchterm)
 
-    def sort_brains(self, brains, sort_on=None):
+    def make_query_for(self, searchterm):
+        """Make a ZCTextIndex query for the given searchterm
+
+        Each word of the searchterm is globbed, so that partially entered
+        values, e.g. the first digits of an ID, are matched as well.
+
+        :param searchterm: The searchterm entered in the search box
+        :returns: ZCTextIndex query string
+        """
+        # split on the same characters the word splitter of the index uses
+        words = re.findall(r"\w+", safe_unicode(searchterm), re.UNICODE)
+        return u" AND ".join(map(lambda word: u"{}*".format(word), words))
+
+    def is_catalog_search_enabled(self):
+        """Checks if the searchterm can be resolved by the catalog
+
+        :returns: True if the searchable text index of the listing catalog
+                  can be used to filter the results by the searchterm
+        """
+        if self.enable_metadata_search:
+            return False
+        return self.searchable_text_index in self.get_catalog_indexes()
+
+    def sort_brains(self, brains, sort_on=None, limit=None):
         """Sort the brains
 
         :param brains: List of catalog brains
         :param sort_on: The metadata column name to sort on
+        :param limit: Only return the first `limit` sorted brains
         :returns: Manually sorted list of brains
         """
         if sort_on not in self.get_metadata_columns():
@@ -1269,30 +1319,53 @@ class BikaListingView(BrowserView):
                         .format(sort_on))
             return brains
 
-        logger.warn("ListingView::sort_brains: Manual sorting on metadata column '{}'. "
-                    "Consider to add an explicit catalog index to speed up filtering."
-                    .format(self.manual_sort_on))
+        key = (self.catalog, sort_on)
+        MANUAL_SORT_COUNTER[key] += 1
+        logger.warn("ListingView::sort_brains: Manual sorting on metadata column '{}' "
+                    "of '{}' ({} times). Consider to add a FieldIndex to the "
+                    "catalog definition to sort in the catalog."
+                    .format(sort_on, self.catalog, MANUAL_SORT_COUNTER[key]))
 
         # calculate the sort_order
         reverse = self.get_sort_order() == "descending"
 
-        def metadata_sort(a, b):
-            a = getattr(a, self.manual_sort_on, "")
-            b = getattr(b, self.manual_sort_on, "")
-            return cmp(safe_unicode(a), safe_unicode(b))
+        # fetch the metadata value of each brain only once
+        def sort_key(brain):
+            return safe_unicode(getattr(brain, sort_on, ""))
 
-        return sorted(brains, cmp=metadata_sort, reverse=reverse)
+        if limit is not None:
+            if reverse:
+                return heapq.nlargest(limit, brains, key=sort_key)
+            return heapq.nsmallest(limit, brains, key=sort_key)
+        return sorted(brains, key=sort_key, reverse=reverse)
+
+    def get_manual_sort_count(self, sort_on=None):
+        """Returns how many times the results of the listing catalog had to be
+        sorted manually
+
+        :param sort_on: The metadata column name (None: all columns)
+        :returns: Number of manual sorts
+        """
+        if sort_on is not None:
+            return MANUAL_SORT_COUNTER[(self.catalog, sort_on)]
+        return sum([count for (catalog, column), count
+                    in MANUAL_SORT_COUNTER.items() if catalog == self.catalog])
 
-    def search(self, searchterm="", ignorecase=True):
+    def search(self, searchterm="", ignorecase=True, b_start=0, b_size=None):
         """Search the catalog tool
 
+        If the catalog provides the searchable text index of the listing, the
+        searchterm is resolved by the catalog. Otherwise, or if the metadata
+        search is enabled explicitly, the metadata columns of all results are
+        matched against a regular expression built from the searchterm.
+
         :param searchterm: The searchterm for the regular expression
         :param ignorecase: Flag to compile with re.IGNORECASE
+        :param b_start: Index of the first result to return
+        :param b_size: Maximum number of results to return (None: all)
         :returns: List of catalog brains
         """
 
-        # TODO Append start and pagesize to return just that slice of results
-
         # start the timer for performance checks
         start = time.time()
 
@@ -1307,22 +1380,57 @@ class BikaListingView(BrowserView):
                     .format(self.catalog))
         query = self.get_catalog_query(searchterm=searchterm)
 
-        # search the catalog
-        catalog = api.get_tool(self.catalog)
-        brains = catalog(query)
+        # Can the catalog take over the filtering and the sorting?
+        metadata_search = searchterm and not self.is_catalog_search_enabled()
+        catalog_sorting = b_size is not None and not metadata_search \
+            and self.manual_sort_on is None
+
+        # Only the brains up to the requested batch need to be sorted. The
+        # batch is not passed to the catalog, because not all versions of the
+        # catalog support it, but sliced from the results below
+        if catalog_sorting and "sort_on" in query:
+            query["sort_limit"] = b_start + b_size
+
+        # search the catalog(s)
+        brains = api.search(query, self.catalog)
 
         # Sort manually?
         if self.manual_sort_on is not None:
-            brains = self.sort_brains(brains, sort_on=self.manual_sort_on)
+            # Only the brains up to the requested batch need to be sorted
+            limit = None
+            if b_size is not None and not metadata_search:
+                limit = b_start + b_size
+            brains = self.sort_brains(
+                brains, sort_on=self.manual_sort_on, limit=limit)
+
+        if metadata_search:
+            # Always expand all categories if we have a searchterm
+            self.expand_all_categories = True
+            brains = self.metadata_search(brains, searchterm, ignorecase)
+        elif searchterm:
+            # Always expand all categories if we have a searchterm
+            self.expand_all_categories = True
+
+        # Return the requested batch only
+        if b_size is not None:
+            brains = brains[b_start:b_start + b_size]
 
-        # return the unfiltered catalog results
-        if not searchterm:
-            logger.info(u"ListingView::search: return {} results".format(len(brains)))
-            return brains
+        end = time.time()
+        logger.info(u"ListingView::search: Search for '{}' executed in "
+                    u"{:.2f}s ({} results)"
+                    .format(searchterm, end - start, len(brains)))
+        return brains
+
+    def metadata_search(self, brains, searchterm, ignorecase=True):
+        """Filter the brains by matching their metadata against the searchterm
 
-        # Always expand all categories if we have a searchterm
-        self.expand_all_categories = True
+        N.B. This wakes up every brain of the given results
 
+        :param brains: List of catalog brains
+        :param searchterm: The searchterm for the regular expression
+        :param ignorecase: Flag to compile with re.IGNORECASE
+        :returns: List of catalog brains with matching metadata
+        """
         # Build a regular expression for the given searchterm
         regex = self.make_regex_for(searchterm, ignorecase=ignorecase)
 
@@ -1339,12 +1447,7 @@ class BikaListingView(BrowserView):
             return False
 
         # Filtered brains by searchterm -> metadata match
-        out = filter(match, brains)
-
-        end = time.time()
-        logger.info(u"ListingView::search: Search for '{}' executed in {:.2f}s ({} matches)"
-                    .format(searchterm, end - start, len(out)))
-        return out
+        return filter(match, brains)
 
     def get_searchterm(self):
         """Get the user entered search value from the request
@@ -1358,15 +1461,47 @@ class BikaListingView(BrowserView):
 
     def _fetch_brains(self, idxfrom=0):
         """Fetch the catalog results for the current listing table state
-        """
 
+        Unless all items have to be displayed, the results are fetched from
+        the catalog in batches of the page size (plus one to find out if there
+        are more items to show). Further batches are only searched if the
+        consumer asks for more items, e.g. because some of them were not
+        allowed by `isItemAllowed`.
+        """
         searchterm = self.get_searchterm()
-        brains = self.search(searchterm=searchterm)
 
-        # Return a subset of results, if necessary
-        if idxfrom and len(brains) > idxfrom:
-            return brains[idxfrom:]
-        return brains
+        # The results of a metadata search are filtered in memory, so they
+        # are fetched at once instead of searching the catalog per batch
+        metadata_search = searchterm and not self.is_catalog_search_enabled()
+
+        if self.is_show_all() or metadata_search:
+            brains = self.search(searchterm=searchterm)
+            # Return a subset of results, if necessary
+            if idxfrom and len(brains) > idxfrom:
+                return brains[idxfrom:]
+            return brains
+
+        return self._fetch_brains_batched(searchterm, idxfrom)
+
+    def is_show_all(self):
+        """Checks if all items have to be displayed instead of a page
+        """
+        if self.request.get('show_all', '').lower() == 'true':
+            return True
+        return self.show_all is True or self.pagesize <= 0
+
+    def _fetch_brains_batched(self, searchterm, b_start=0):
+        """Generator that yields the brains batch by batch
+        """
+        b_size = self.pagesize + 1
+        while True:
+            brains = self.search(
+                searchterm=searchterm, b_start=b_start, b_size=b_size)
+            for brain in brains:
+                yield brain
+            if len(brains) < b_size:
+                break
+            b_start += b_size
 
     # noinspection PyUnusedLocal
     @deprecated("Using bikalisting.folderitems(classic=True) is very slow")
@@ -1378,12 +1513,7 @@ class BikaListingView(BrowserView):
                                        name=u'plone_layout')
         plone_utils = getToolByName(self.context.aq_inner, 'plone_utils')
         portal_types = getToolByName(self.context.aq_inner, 'portal_types')
-        if self.request.get('show_all', '').lower() == 'true' \
-                or self.show_all is True \
-                or self.pagesize == 0:
-            show_all = True
-        else:
-            show_all = False
+        show_all = self.is_show_all()
 
         # idx increases one unit each time an object is added to the 'items'
         # dictionary to be returned. Note that if the item is not rendered,
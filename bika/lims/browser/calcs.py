@@ -6,7 +6,6 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import json
-import math
 import plone
 
 from zope.component import adapts
@@ -204,17 +203,10 @@ class ajaxCalculateAnalysisEntry(BrowserView):
                     except ValueError:
                         pass
 
-            # convert formula to a valid python string, ready for interpolation
             formula = calculation.getMinifiedFormula()
-            formula = formula.replace('[', '%(').replace(']', ')f')
             try:
-                formula = eval("'%s'%%mapping" % formula,
-                               {"__builtins__": None,
-                                'math': math,
-                                'context': self.context},
-                               {'mapping': mapping})
                 # calculate
-                result = eval(formula, calculation._getGlobals())
+                result = calculation.calculateFormula(mapping)
                 Result['result'] = result
                 self.current_results[uid]['result'] = result
             except TypeError as e:
@@ -18,6 +18,7 @@ from Products.CMFCore.utils import getToolByName
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from bika.lims import bikaMessageFactory as _
 from bika.lims import logger
+from bika.lims import statistics as dashboard_statistics
 from bika.lims.api import get_tool
 from bika.lims.api import search
 from bika.lims.browser import BrowserView
@@ -788,6 +789,11 @@ class DashboardView(BrowserView):
     def fill_dates_evo(self, catalog, query):
         sorted_query = collections.OrderedDict(sorted(query.items()))
         query_json = json.dumps(sorted_query)
+        if self.use_statistics():
+            outevo = self._get_dates_evo(query_json, catalog.id,
+                                         self.periodicity, statistics=True)
+            if outevo is not None:
+                return outevo
         return self._fill_dates_evo(query_json, catalog.id, self.periodicity)
 
     def _fill_dates_evo_cachekey(method, self, query_json, catalog_name,
@@ -804,6 +810,16 @@ class DashboardView(BrowserView):
         This is an expensive function that will not be called more than once
         every 2 hours (note cache decorator with `time() // (60 * 60 * 2)
         """
+        return self._get_dates_evo(query_json, catalog_name, periodicity)
+
+    def _get_dates_evo(self, query_json, catalog_name, periodicity,
+                       statistics=False):
+        """Returns the evolution of the items created within the date range of
+        the periodicity, counted with the catalog or with the precomputed
+        dashboard statistics.
+
+        Returns None if the statistics cannot answer the query
+        """
         outevoidx = {}
         outevo = []
         days = 1
@@ -829,6 +845,18 @@ class DashboardView(BrowserView):
         query['created'] = {'query': (date_from, date_to),
                             'range': 'min:max'}
 
+        if statistics:
+            counts = dashboard_statistics.count_by_day(
+                query, date_from, date_to, get_tool(catalog_name))
+            if counts is None:
+                return None
+            counts = [(DateTime(date.year, date.month, date.day), state,
+                       amount) for date, state, amount in counts]
+        else:
+            brains = search(query, catalog_name)
+            counts = ((brain.created, brain.review_state, 1)
+                      for brain in brains)
+
         otherstate = _('Other status')
         statesmap = self.get_states_map(query['portal_type'])
         stats = statesmap.values()
@@ -848,25 +876,22 @@ class DashboardView(BrowserView):
                 outevoidx[currstr] = len(outevo)-1
             curr = curr + datetime.timedelta(days=days)
 
-        brains = search(query, catalog_name)
-        for brain in brains:
-            created = brain.created
-            state = brain.review_state
+        for created, state, amount in counts:
             if state not in statesmap:
                 logger.warn("'%s' State for '%s' not available" % (state, query['portal_type']))
             state = statesmap[state] if state in statesmap else otherstate
             created = self._getDateStr(periodicity, created)
-            statscount[state] += 1
+            statscount[state] += amount
             if created in outevoidx:
                 oidx = outevoidx[created]
                 if state in outevo[oidx]:
-                    outevo[oidx][state] += 1
+                    outevo[oidx][state] += amount
                 else:
-                    outevo[oidx][state] = 1
+                    outevo[oidx][state] = amount
             else:
                 # Create new row
                 currow = {'date': created,
-                          state: 1 }
+                          state: amount }
                 outevo.append(currow)
 
         # Remove all those states for which there is no data
@@ -890,9 +915,23 @@ class DashboardView(BrowserView):
     @viewcache.memoize
     def _search_count(self, query_json, catalog_name):
         query = json.loads(query_json)
+        if self.use_statistics():
+            total = dashboard_statistics.count(query, get_tool(catalog_name))
+            if total is not None:
+                return total
         brains = search(query, catalog_name)
         return len(brains)
 
+    @viewcache.memoize
+    def use_statistics(self):
+        """Checks if the panels can be filled with the precomputed dashboard
+        statistics. These count all the objects, so they are only used for
+        users that see all the objects of the laboratory
+        """
+        if dashboard_statistics.get_storage() is None:
+            return False
+        return dashboard_statistics.is_lab_user()
+
     def _update_criteria_with_filters(self, query, section_name):
         """
         This method updates the 'query' dictionary with the criteria stored in
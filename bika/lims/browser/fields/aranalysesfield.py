@@ -29,6 +29,8 @@ Run this test from the buildout directory:
     bin/test test_textual_doctests -t ARAnalysesField
 """
 
+INDEXES_CACHE_KEY = "bika.lims.browser.fields.aranalysesfield.indexes"
+
 
 class ARAnalysesField(ObjectField):
     """A field that stores Analyses instances
@@ -48,12 +50,14 @@ class ARAnalysesField(ObjectField):
         """Returns a list of Analyses assigned to this AR
 
         Return a list of catalog brains unless `full_objects=True` is passed.
+        Return a list of tuples with the values of the metadata columns when
+        `columns` is passed, e.g. `columns=("UID", "getKeyword")`.
         Overrides "ViewRetractedAnalyses" when `retracted=True` is passed.
         Other keyword arguments are passed to bika_analysis_catalog
 
         :param instance: Analysis Request object
         :param kwargs: Keyword arguments to be passed to control the output
-        :returns: A list of Analysis Objects/Catalog Brains
+        :returns: A list of Analysis Objects/Catalog Brains/tuples
         """
 
         full_objects = False
@@ -69,6 +73,8 @@ class ARAnalysesField(ObjectField):
             get_reflexed = kwargs['get_reflexed']
             del kwargs['get_reflexed']
 
+        columns = kwargs.pop('columns', None)
+
         if 'retracted' in kwargs:
             retracted = kwargs['retracted']
             del kwargs['retracted']
@@ -78,30 +84,42 @@ class ARAnalysesField(ObjectField):
                 ViewRetractedAnalyses, instance)
 
         bac = getToolByName(instance, CATALOG_ANALYSIS_LISTING)
+        indexes = self._get_catalog_indexes(bac)
         contentFilter = dict([(k, v) for k, v in kwargs.items()
-                              if k in bac.indexes()])
+                              if k in indexes])
         contentFilter['portal_type'] = "Analysis"
         contentFilter['sort_on'] = "getKeyword"
         contentFilter['path'] = {'query': api.get_path(instance),
                                  'level': 0}
+        if not get_reflexed:
+            # Only the final analyses, not the ones that have been reflexed
+            contentFilter['isReflexed'] = False
         analyses = bac(contentFilter)
-        if not retracted or full_objects or not get_reflexed:
-            analyses_filtered = []
-            for a in analyses:
-                if not retracted and a.review_state == 'retracted':
-                    continue
-                if full_objects or not get_reflexed:
-                    a_obj = a.getObject()
-                    # Check if analysis has been reflexed
-                    if not get_reflexed and \
-                            a_obj.getReflexRuleActionsTriggered() != '':
-                        continue
-                    if full_objects:
-                        a = a_obj
-                analyses_filtered.append(a)
-            analyses = analyses_filtered
+        if not retracted:
+            analyses = [a for a in analyses if a.review_state != 'retracted']
+        if full_objects:
+            analyses = map(api.get_object, analyses)
+        elif columns:
+            analyses = [tuple([getattr(a, column) for column in columns])
+                        for a in analyses]
         return analyses
 
+    def _get_catalog_indexes(self, catalog):
+        """Returns the names of the indexes of the catalog. The names are
+        looked up once per request
+        """
+        request = api.get_request()
+        cache = {}
+        if request is not None:
+            cache = request.get(INDEXES_CACHE_KEY)
+            if cache is None:
+                cache = {}
+                request.set(INDEXES_CACHE_KEY, cache)
+        key = catalog.getId()
+        if key not in cache:
+            cache[key] = frozenset(catalog.indexes())
+        return cache[key]
+
     security.declarePrivate('set')
 
     def set(self, instance, items, prices=None, specs=None, **kwargs):
@@ -15,6 +15,7 @@ from Products.Archetypes.Field import ObjectField
 from Products.Archetypes.Registry import registerField
 
 from bika.lims.interfaces import IProxyField
+from bika.lims import api
 from bika.lims import logger
 
 """A field that proxies to an object which is retrieved by the evaluation of
@@ -23,6 +24,76 @@ the `proxy` property, e.g. `proxy="context.getSample()"`.
 See `docs/AnalysisRequest.rst` for further details.
 """
 
+PROXY_CACHE_KEY = "bika.lims.browser.fields.proxyfield.proxy_cache"
+
+# proxy expression -> compiled code, shared by the fields with the same proxy
+_compiled = {}
+
+
+def compile_proxy(expression):
+    """Returns the compiled code of the proxy expression. Every expression is
+    compiled once per process
+    """
+    code = _compiled.get(expression)
+    if code is None:
+        code = compile(expression, "<proxy>", "eval")
+        _compiled[expression] = code
+    return code
+
+
+def get_proxy_cache():
+    """Returns the (UID, proxy expression) -> proxy object cache of the
+    current request or None if there is no request
+    """
+    request = api.get_request()
+    if request is None:
+        return None
+    cache = request.get(PROXY_CACHE_KEY)
+    if cache is None:
+        cache = {}
+        request.set(PROXY_CACHE_KEY, cache)
+    return cache
+
+
+def invalidate_proxy_cache(instance):
+    """Removes the cached proxy objects of the instance from the cache of the
+    current request, e.g. after the reference the proxy is resolved from
+    changed
+    """
+    request = api.get_request()
+    cache = request is not None and request.get(PROXY_CACHE_KEY) or None
+    if not cache:
+        return
+    uid = api.get_uid(instance)
+    for key in [key for key in cache.keys() if key[0] == uid]:
+        del cache[key]
+
+
+def get_many(instance, field_names):
+    """Returns the values of the fields of the instance. The proxy of the
+    ProxyFields is resolved once for all the fields with the same proxy
+
+    :param instance: The object the fields belong to
+    :param field_names: The names of the fields to read
+    :returns: Dict of field name -> value
+    """
+    values = {}
+    proxies = {}
+    for field_name in field_names:
+        field = instance.getField(field_name)
+        if field is None:
+            raise KeyError("Object '{}' with id '{}' has no field named '{}'"
+                           .format(instance.portal_type, instance.getId(),
+                                   field_name))
+        if not IProxyField.providedBy(field):
+            values[field_name] = field.get(instance)
+            continue
+        if field.proxy not in proxies:
+            proxies[field.proxy] = field.get_proxy(instance)
+        values[field_name] = field.get(
+            instance, proxy_object=proxies[field.proxy])
+    return values
+
 
 class ProxyField(ObjectField):
     """A field that proxies to another field of an object, which is retrieved
@@ -43,11 +114,25 @@ class ProxyField(ObjectField):
     security.declarePrivate('get_proxy')
 
     def get_proxy(self, instance):
-        """Evaluate the `proxy` property to retrieve the proxy object.
+        """Evaluate the `proxy` property to retrieve the proxy object. The
+        proxy object is resolved once per instance and request
         """
+        uid = api.get_uid(instance)
+        cache = uid and get_proxy_cache() or None
+        key = (uid, self.proxy)
+        if cache is not None and key in cache:
+            return cache[key]
+
         # evaluates the 'proxy' expression on the field definition in the schema,
         # e.g. 'context.getSample()' on an AR
-        return eval(self.proxy, {'context': instance, 'here': instance})
+        proxy_object = eval(compile_proxy(self.proxy),
+                            {'context': instance, 'here': instance})
+
+        # Not found proxy objects, e.g. the Sample of an AR not created yet,
+        # are resolved again
+        if cache is not None and proxy_object is not None:
+            cache[key] = proxy_object
+        return proxy_object
 
     security.declarePrivate('get')
 
@@ -57,8 +142,10 @@ class ProxyField(ObjectField):
         # The default value
         default = self.getDefault(instance)
 
-        # Retrieve the proxy object
-        proxy_object = self.get_proxy(instance)
+        # Retrieve the proxy object, unless already resolved by `get_many`
+        proxy_object = kwargs.get('proxy_object')
+        if proxy_object is None:
+            proxy_object = self.get_proxy(instance)
 
         # Return None if we could not find a proxied object, e.g. through
         # the proxy expression 'context.getSample()' on an AR
@@ -6,18 +6,22 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 from AccessControl import ClassSecurityInfo
+from BTrees.OOBTree import OOTreeSet
 from Products.Archetypes.BaseContent import BaseContent
 from Products.Archetypes.Field import Field, StringField
 from bika.lims import logger
 from bika.lims import api
+from bika.lims.browser.fields.proxyfield import invalidate_proxy_cache
 from bika.lims.interfaces.field import IUIDReferenceField
-from persistent.list import PersistentList
 from persistent.dict import PersistentDict
 from zope.annotation.interfaces import IAnnotations
 from zope.interface import implements
 
 BACKREFS_STORAGE = "bika.lims.browser.fields.uidreferencefield.backreferences"
 
+# (portal path, portal_type) -> id of the catalog, cached per process
+_catalog_ids = {}
+
 
 class ReferenceException(Exception):
     pass
@@ -61,6 +65,37 @@ class UIDReferenceField(StringField):
                 "be returned.".format(context, self.getName(), value))
         return obj
 
+    @security.public
+    def get_objects(self, context, values):
+        """Resolve a list of UIDs, brains or objects to objects, searching
+        the UIDs in a single catalog query.
+
+        :param context: context is the object containing the field's schema.
+        :type context: BaseContent
+        :param values: UIDs, brains or objects.
+        :type values: list
+        :return: Returns the Content objects found, in the order of values.
+        :rtype: list[BaseContent]
+        """
+        values = filter(None, values)
+        uids = filter(api.is_uid, values)
+        objects = dict([(api.get_uid(obj), obj)
+                        for obj in api.get_objects_by_uids(uids)])
+        ret = []
+        for value in values:
+            if not api.is_uid(value):
+                obj = self.get_object(context, value)
+            elif value in objects:
+                obj = objects[value]
+            else:
+                obj = None
+                logger.warning(
+                    "{}.{}: Resolving UIDReference failed for {}.  No object "
+                    "will be returned.".format(context, self.getName(), value))
+            if obj is not None:
+                ret.append(obj)
+        return ret
+
     @security.public
     def get_uid(self, context, value):
         """Takes a brain or object (or UID), and returns a UID.
@@ -105,8 +140,7 @@ class UIDReferenceField(StringField):
             # Only return objects which actually exist; this is necessary here
             # because there are no HoldingReferences. This opens the
             # possibility that deletions leave hanging references.
-            ret = filter(
-                lambda x: x, [self.get_object(context, uid) for uid in value])
+            ret = self.get_objects(context, value)
         else:
             ret = self.get_object(context, value)
         return ret
@@ -146,10 +180,9 @@ class UIDReferenceField(StringField):
                 # Because no relationship is passed to get_backreferences,
                 # the entire set of backrefs is returned by reference.
                 backrefs = get_backreferences(item, relationship=None)
-                if key not in backrefs:
-                    backrefs[key] = PersistentList()
-                if uid not in backrefs[key]:
-                    backrefs[key].append(uid)
+                uids = get_backreferences_set(backrefs, key)
+                # The set is only modified if the UID is not there yet
+                uids.insert(uid)
 
     @security.public
     def set(self, context, value, **kwargs):
@@ -169,7 +202,7 @@ class UIDReferenceField(StringField):
                 value = []
             if type(value) not in (list, tuple):
                 value = [value, ]
-            ret = [self.get_object(context, val) for val in value if val]
+            ret = self.get_objects(context, value)
             self._set_backreferences(context, ret)
             uids = [self.get_uid(context, r) for r in ret if r]
             StringField.set(self, context, uids, **kwargs)
@@ -191,6 +224,9 @@ class UIDReferenceField(StringField):
                 StringField.set(self, context, uid, **kwargs)
             else:
                 StringField.set(self, context, '', **kwargs)
+        # Proxy objects cached for this request may be resolved from the
+        # reference, e.g. the Sample of an Analysis Request
+        invalidate_proxy_cache(context)
 
 
 def is_uid(context, value):
@@ -203,9 +239,7 @@ def is_uid(context, value):
     :return: True if the value is a UID and exists as an entry in uid_catalog.
     :rtype: bool
     """
-    uc = api.get_tool('uid_catalog', context=context)
-    brains = uc(UID=value)
-    return brains and True or False
+    return _get_object(context, value) is not None
 
 
 def _get_object(context, value):
@@ -221,11 +255,9 @@ def _get_object(context, value):
 
     if api.is_at_content(value) or api.is_dexterity_content(value):
         return value
-    elif value and is_uid(context, value):
-        uc = api.get_tool('uid_catalog', context=context)
-        brains = uc(UID=value)
-        assert len(brains) == 1
-        return brains[0].getObject()
+    elif value and isinstance(value, basestring) and value != "0":
+        # Objects looked up in the current request are not searched again
+        return api.get_object_by_uid(value, None)
 
 
 def get_storage(context):
@@ -235,21 +267,65 @@ def get_storage(context):
     return annotation[BACKREFS_STORAGE]
 
 
+def get_backreferences_set(backrefs, relationship):
+    """Returns the set of UIDs of the relationship from the backreferences
+    storage, creating it if missing. Lists of UIDs stored by former versions
+    are converted to sets
+
+    :param backrefs: The backreferences storage of the target object
+    :param relationship: The relationship name of the UIDReferenceField
+    :returns: The UIDs of the objects that reference the target
+    :rtype: BTrees.OOBTree.OOTreeSet
+    """
+    uids = backrefs.get(relationship)
+    if isinstance(uids, OOTreeSet):
+        return uids
+    backrefs[relationship] = OOTreeSet(uids or [])
+    return backrefs[relationship]
+
+
+def migrate_backreferences(context):
+    """Converts the lists of UIDs of the backreferences storage of the object
+    to sets
+
+    :returns: True if the storage was converted
+    """
+    backrefs = IAnnotations(context).get(BACKREFS_STORAGE)
+    if not backrefs:
+        return False
+    converted = False
+    for relationship, uids in backrefs.items():
+        if not isinstance(uids, OOTreeSet):
+            get_backreferences_set(backrefs, relationship)
+            converted = True
+    return converted
+
+
 def _get_catalog_for_uid(uid):
-    at = api.get_tool('archetype_tool')
     uc = api.get_tool('uid_catalog')
-    pc = api.get_tool('portal_catalog')
     # get uid_catalog brain for uid
     ub = uc(UID=uid)[0]
     # get portal_type of brain
-    pt = ub.portal_type
-    # get the registered catalogs for portal_type
-    cats = at.getCatalogsByType(pt)
-    # try avoid 'portal_catalog'; XXX multiple catalogs in setuphandlers.py?
-    cats = [cat for cat in cats if cat != pc]
-    if cats:
-        return cats[0]
-    return pc
+    return _get_catalog_for_type(ub.portal_type)
+
+
+def _get_catalog_for_type(portal_type):
+    """Returns the catalog to search the objects of the portal type in. The
+    catalog of every portal type is looked up once per process
+    """
+    portal = api.get_portal()
+    key = (api.get_path(portal), portal_type)
+    catalog_id = _catalog_ids.get(key)
+    if catalog_id is None:
+        at = api.get_tool('archetype_tool')
+        pc = api.get_tool('portal_catalog')
+        # get the registered catalogs for portal_type
+        cats = at.getCatalogsByType(portal_type)
+        # try avoid 'portal_catalog'; XXX multiple catalogs in setuphandlers.py?
+        cats = [cat for cat in cats if cat != pc]
+        catalog_id = cats and cats[0].getId() or pc.getId()
+        _catalog_ids[key] = catalog_id
+    return api.get_tool(catalog_id)
 
 
 def get_backreferences(context, relationship=None, as_brains=None):
@@ -267,12 +343,12 @@ def get_backreferences(context, relationship=None, as_brains=None):
 
       If relationship is provided, then you can request that the backrefs
       should be returned as catalog brains.  If you do not specify as_brains,
-      the raw list of UIDs will be returned.
+      the raw list of UIDs will be returned, sorted by UID.
 
     - If the relationship is not provided, then the entire set of
       backreferences to the context object is returned (by reference) as a
-      dictionary.  This value can then be modified in-place, to edit the stored
-      backreferences.
+      dictionary of relationship -> set of UIDs.  This value can then be
+      modified in-place, to edit the stored backreferences.
     """
 
     instance = context.aq_base
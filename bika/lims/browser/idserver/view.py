@@ -94,8 +94,7 @@ class IDServerView(BrowserView):
 
     @property
     def storage(self):
-        number_generator = getUtility(INumberGenerator)
-        return number_generator.storage
+        return getUtility(INumberGenerator)
 
     def to_int(self, number, default=0):
         """Returns an integer
@@ -59,6 +59,8 @@ class AnalysesView(BaseView):
                              {'id':'verify'},
                              {'id':'retract'},
                              {'id':'unassign'}],
+             'custom_transitions': [{'id': 'calculate',
+                                     'title': _('Calculate')}],
              'columns':['Pos',
                         'Service',
                         'Method',
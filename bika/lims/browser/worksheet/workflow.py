@@ -22,6 +22,8 @@ from bika.lims.permissions import EditResults, ManageWorksheets
 from bika.lims.subscribers import doActionFor
 from bika.lims.subscribers import skip
 from bika.lims.utils import isActive
+from bika.lims.utils.analysis import calculate_results
+from bika.lims.workflow import doActionForObjects
 from plone.protect import CheckAuthenticator
 
 
@@ -165,6 +167,9 @@ class WorksheetWorkflowAction(WorkflowAction):
             self.context.plone_utils.addPortalMessage(message, 'info')
             self.destination_url = self.context.absolute_url()
             self.request.response.redirect(self.destination_url)
+        ## calculate
+        elif action == 'calculate':
+            self.calculate()
         ## verify
         elif action == 'verify':
             # default bika_listing.py/WorkflowAction, but then go to view screen.
@@ -175,6 +180,22 @@ class WorksheetWorkflowAction(WorkflowAction):
             # default bika_listing.py/WorkflowAction for other transitions
             WorkflowAction.__call__(self)
 
+    def calculate(self):
+        """ Calculates the results of the selected analyses with calculation
+            at once, in dependency order
+        """
+        sm = getSecurityManager()
+        selected = WorkflowAction._get_selected_items(self)
+        analyses = filter(
+            lambda analysis: sm.checkPermission(EditResults, analysis),
+            selected.values())
+        calculated = calculate_results(analyses, override=True)
+        message = _("${count} results calculated",
+                    mapping={"count": len(calculated)})
+        self.context.plone_utils.addPortalMessage(message, 'info')
+        self.destination_url = self.context.absolute_url()
+        self.request.response.redirect(self.destination_url)
+
     def submit(self):
         """ Saves the form
         """
@@ -205,6 +226,7 @@ class WorksheetWorkflowAction(WorkflowAction):
                 item_data = json.loads(form['item_data'])
 
         # Iterate for each selected analysis and save its data as needed
+        submissable = []
         for uid, analysis in selected.items():
 
             allow_edit = sm.checkPermission(EditResults, analysis)
@@ -283,7 +305,11 @@ class WorksheetWorkflowAction(WorkflowAction):
                 if can_submit:
                     # doActionFor transitions the analysis to verif pending,
                     # so must only be done when results are submitted.
-                    doActionFor(analysis, 'submit')
+                    submissable.append(analysis)
+
+        # Submit the analyses at once, so the worksheet and the Analysis
+        # Requests are only transitioned after the last analysis
+        doActionForObjects(submissable, 'submit')
 
         # Maybe some analyses need to be retracted due to a QC failure
         # Done here because don't know if the last selected analysis is
@@ -53,6 +53,7 @@ _indexes_dict = {
     'getSampleConditionUID': 'FieldIndex',
     'getAnalysisRequestPrintStatus': 'FieldIndex',
     'getWorksheetUID': 'FieldIndex',
+    'isReflexed': 'FieldIndex',
     'getOriginalReflexedAnalysisUID': 'FieldIndex',
     'getPrioritySortkey': 'FieldIndex',
 }
@@ -107,6 +108,8 @@ _columns_list = [
     'getServiceUID',
     'getDepartmentUID',
     'getInstrumentEntryOfResults',
+    'getPointOfCapture',
+    'isReflexed',
     'getAllowedInstrumentUIDs',
     'getInstrumentUID',
     'getResultsRange',
@@ -39,7 +39,20 @@ _indexes_dict = {
     # To sort in lists
     'getClientTitle': 'FieldIndex',
     'getPrioritySortkey': 'FieldIndex',
+    'getCreatorFullName': 'FieldIndex',
+    'getBatchID': 'FieldIndex',
+    'getClientOrderNumber': 'FieldIndex',
+    'getClientReference': 'FieldIndex',
+    'getContactFullName': 'FieldIndex',
+    'getSampleTypeTitle': 'FieldIndex',
+    'getSamplePointTitle': 'FieldIndex',
+    'getStorageLocationTitle': 'FieldIndex',
+    'getSamplingDeviationTitle': 'FieldIndex',
+    'getProfilesTitleStr': 'FieldIndex',
+    'getTemplateTitle': 'FieldIndex',
     'assigned_state': 'FieldIndex',
+    # Used by the search box of the listings
+    'listing_searchable_text': 'ZCTextIndex',
 }
 # Defining the columns for this catalog
 _columns_list = [
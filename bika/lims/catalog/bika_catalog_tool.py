@@ -5,16 +5,32 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
+import copy
 import sys
 import traceback
+from zlib import crc32
+
 from AccessControl import ClassSecurityInfo
+from Acquisition import aq_base
+from BTrees.OOBTree import OOBTree
+from persistent.mapping import PersistentMapping
+from plone.indexer.interfaces import IIndexableObject
 from Products.CMFCore.permissions import ManagePortal
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.CatalogTool import CatalogTool
+from Products.ZCatalog.Catalog import Catalog
 from Products.ZCatalog.ZCatalog import ZCatalog
+from ZODB.POSException import ConflictError
+from zope.component import queryMultiAdapter
 import transaction
 from bika.lims import logger
 
+# Number of objects cataloged in the shadow catalog per transaction
+SHADOW_BATCH_SIZE = 1000
+
+# Number of attempts to catalog a batch of objects on write conflicts
+SHADOW_CONFLICT_ATTEMPTS = 5
+
 
 class BikaCatalogTool(CatalogTool):
     """
@@ -112,3 +128,243 @@ class BikaCatalogTool(CatalogTool):
         logger.info('%s cleaned and rebuilt' % self.id)
 
     security.declareProtected(ManagePortal, 'softClearFindAndRebuild')
+
+    def updateIndexesAndColumns(self, indexes=None, columns=None,
+                                batch_size=SHADOW_BATCH_SIZE):
+        """
+            Fills the given indexes and metadata columns for the objects
+            that are already cataloged, without updating the rest of indexes
+            and columns. Used when indexes or columns are added to the
+            catalog, so a full rebuild is not needed.
+            The progress is committed every `batch_size` objects.
+        """
+        indexes = [idx for idx in indexes or [] if idx in self.indexes()]
+        columns = [col for col in columns or [] if col in self.schema()]
+        if not indexes and not columns:
+            return 0
+
+        catalog = self._catalog
+        paths = list(catalog.uids.keys())
+        total = len(paths)
+        logger.info('Updating indexes {} and columns {} of {} objects in {}'
+                    .format(indexes, columns, total, self.id))
+        for num, path in enumerate(paths, 1):
+            rid = catalog.uids.get(path)
+            obj = self.unrestrictedTraverse(path, None)
+            if rid is None or obj is None:
+                # Uncataloged or removed meanwhile
+                continue
+            wrapper = self._getIndexableObject(obj)
+            for idx in indexes:
+                catalog.getIndex(idx).index_object(rid, wrapper)
+            if columns:
+                catalog.updateMetadata(wrapper, path, rid)
+            if num % batch_size == 0:
+                transaction.commit()
+                logger.info(
+                    'Progress: {}/{} objects have been updated in {}.'
+                    .format(num, total, self.id))
+        transaction.commit()
+        logger.info('Indexes and columns of {} updated'.format(self.id))
+        return total
+
+    security.declareProtected(ManagePortal, 'updateIndexesAndColumns')
+
+    def shadowRebuild(self, workers=1, worker=0, batch_size=SHADOW_BATCH_SIZE):
+        """
+            Rebuilds the catalog into a shadow catalog, while the current
+            catalog keeps serving the searches, and swaps the shadow
+            catalog in once all the objects have been cataloged.
+
+            The objects are taken from the uid_catalog and split across the
+            given number of workers, so several ZEO clients can rebuild the
+            catalog at the same time, each one with a different worker
+            number. The progress is committed every `batch_size` objects, so
+            an interrupted rebuild is resumed by calling this method again
+            with the same parameters. Objects cataloged or uncataloged while
+            the rebuild is running are written to the shadow catalog too.
+
+            Returns True if the shadow catalog has been swapped in, i.e. all
+            the workers have finished.
+        """
+        if worker < 0 or worker >= workers:
+            raise ValueError("Worker must be between 0 and {}".format(
+                workers - 1))
+
+        rebuild = self._getShadowRebuild(workers)
+        progress = rebuild['progress']
+        if not rebuild['done'].get(worker):
+            brains = self._getShadowRebuildBrains(workers, worker)
+            last_uid = progress.get(worker)
+            if last_uid:
+                brains = [b for b in brains if b.UID > last_uid]
+                logger.info('Resuming the rebuild of {} by worker {} after '
+                            '{}'.format(self.id, worker, last_uid))
+            total = len(brains)
+            logger.info('Rebuilding {} objects of {} in a shadow catalog '
+                        '(worker {}/{})'.format(total, self.id, worker + 1,
+                                                workers))
+            for start in range(0, total, batch_size):
+                batch = brains[start:start + batch_size]
+                self._catalogShadowBatch(batch, worker)
+                logger.info('Progress: {}/{} objects have been cataloged in '
+                            'the shadow catalog of {} (worker {}/{})'.format(
+                                min(start + batch_size, total), total,
+                                self.id, worker + 1, workers))
+            rebuild['done'][worker] = True
+            transaction.commit()
+
+        return self._swapShadowCatalog()
+
+    security.declareProtected(ManagePortal, 'shadowRebuild')
+
+    def abortShadowRebuild(self):
+        """
+            Discards the shadow catalog of an unfinished rebuild
+        """
+        if getattr(aq_base(self), '_shadow_rebuild', None) is not None:
+            del self._shadow_rebuild
+            logger.info('Shadow rebuild of {} aborted'.format(self.id))
+
+    security.declareProtected(ManagePortal, 'abortShadowRebuild')
+
+    def catalog_object(self, object, uid=None, idxs=None,
+                       update_metadata=1, pghandler=None):
+        """Catalogs the object, also in the shadow catalog of a running
+        rebuild
+        """
+        CatalogTool.catalog_object(self, object, uid=uid, idxs=idxs,
+                                   update_metadata=update_metadata,
+                                   pghandler=pghandler)
+        shadow = self._getShadowCatalog()
+        if shadow is None:
+            return
+        if uid is None:
+            uid = '/'.join(object.getPhysicalPath())
+        shadow.catalogObject(self._getIndexableObject(object), uid, None,
+                             idxs or [], update_metadata=update_metadata)
+
+    def uncatalog_object(self, uid):
+        """Uncatalogs the object, also from the shadow catalog of a running
+        rebuild
+        """
+        CatalogTool.uncatalog_object(self, uid)
+        shadow = self._getShadowCatalog()
+        if shadow is not None and shadow.uids.get(uid) is not None:
+            shadow.uncatalogObject(uid)
+
+    def _getShadowCatalog(self):
+        """Returns the wrapped shadow catalog of a running rebuild or None
+        """
+        rebuild = getattr(aq_base(self), '_shadow_rebuild', None)
+        if rebuild is None:
+            return None
+        return rebuild['catalog'].__of__(self)
+
+    def _getShadowRebuild(self, workers):
+        """Returns the state of the running rebuild. Creates the empty shadow
+        catalog, with the same indexes and columns, if not started yet
+        """
+        rebuild = getattr(aq_base(self), '_shadow_rebuild', None)
+        if rebuild is not None:
+            if rebuild['workers'] != workers:
+                raise ValueError(
+                    "The shadow rebuild of {} was started with {} workers"
+                    .format(self.id, rebuild['workers']))
+            return rebuild
+
+        catalog = self._catalog
+        shadow = Catalog()
+        shadow.schema = dict(catalog.schema)
+        shadow.names = tuple(catalog.names)
+        shadow.updateBrains()
+        wrapped = shadow.__of__(self)
+        for name, index in catalog.indexes.items():
+            clone = copy.copy(aq_base(index))
+            clone.__of__(wrapped).clear()
+            shadow.indexes[name] = clone
+
+        rebuild = PersistentMapping()
+        rebuild['catalog'] = shadow
+        rebuild['workers'] = workers
+        # worker -> UID of the last cataloged object
+        rebuild['progress'] = OOBTree()
+        # worker -> True if finished
+        rebuild['done'] = OOBTree()
+        self._shadow_rebuild = rebuild
+        transaction.commit()
+        logger.info('Shadow catalog for {} created'.format(self.id))
+        return rebuild
+
+    def _getShadowRebuildBrains(self, workers, worker):
+        """Returns the uid_catalog brains of the objects to be cataloged by
+        the worker, sorted by UID
+        """
+        at = getToolByName(self, 'archetype_tool')
+        types = [k for k, v in at.catalog_map.items()
+                 if self.id in v]
+        uid_c = getToolByName(self, 'uid_catalog')
+        brains = uid_c(portal_type=types)
+        brains = [b for b in brains
+                  if crc32(b.UID) % workers == worker]
+        return sorted(brains, key=lambda b: b.UID)
+
+    def _catalogShadowBatch(self, brains, worker):
+        """Catalogs the objects in the shadow catalog and commits the
+        progress of the worker. Retries the batch on write conflicts
+        """
+        for attempt in range(SHADOW_CONFLICT_ATTEMPTS):
+            try:
+                shadow = self._getShadowCatalog()
+                for brain in brains:
+                    try:
+                        obj = brain._unrestrictedGetObject()
+                    except (AttributeError, KeyError):
+                        # Removed since the rebuild started
+                        continue
+                    # Same key as catalog_object, the paths of the
+                    # uid_catalog are relative to the portal
+                    path = '/'.join(obj.getPhysicalPath())
+                    shadow.catalogObject(
+                        self._getIndexableObject(obj), path,
+                        None, [], update_metadata=1)
+                self._shadow_rebuild['progress'][worker] = brains[-1].UID
+                transaction.commit()
+                return
+            except ConflictError:
+                transaction.abort()
+                logger.info('Conflict cataloging a batch in the shadow '
+                            'catalog of {} (attempt {})'.format(
+                                self.id, attempt + 1))
+        raise ConflictError(
+            'Could not catalog a batch in the shadow catalog of {}'
+            .format(self.id))
+
+    def _getIndexableObject(self, obj):
+        """Wraps the object for indexing, like CatalogTool.catalog_object
+        """
+        if IIndexableObject.providedBy(obj):
+            return obj
+        wrapper = queryMultiAdapter((obj, self), IIndexableObject)
+        if wrapper is None:
+            return obj
+        return wrapper
+
+    def _swapShadowCatalog(self):
+        """Replaces the catalog by the shadow catalog if all the workers have
+        finished. Returns True if swapped
+        """
+        rebuild = getattr(aq_base(self), '_shadow_rebuild', None)
+        if rebuild is None:
+            # Swapped by another worker
+            return True
+        if len(rebuild['done']) < rebuild['workers']:
+            logger.info('Waiting for {} workers to finish the rebuild of {}'
+                        .format(rebuild['workers'] - len(rebuild['done']),
+                                self.id))
+            return False
+        self._catalog = rebuild['catalog']
+        del self._shadow_rebuild
+        transaction.commit()
+        logger.info('%s rebuilt, shadow catalog swapped in' % self.id)
+        return True
@@ -73,6 +73,9 @@ def setup_catalogs(
     catalogs and then checks the indexes and metacolumns, if one index/column
     doesn't exist in the catalog_definition any more it will be
     removed, otherwise, if a new index/column is found, it will be created.
+    Catalogs whose content types changed are rebuilt, while only the new
+    indexes and columns are filled for the objects of the rest of catalogs.
+    Removed indexes and columns do not require any reindexing.
 
     :param portal: The Plone's Portal object
     :param catalogs_definition: a dictionary with the following structure
@@ -114,16 +117,23 @@ def setup_catalogs(
     clean_and_rebuild = _map_content_types(archetype_tool, definition)
 
     # Indexing
+    # Catalog id -> (added indexes, added columns)
+    to_update = {}
     for cat_id in definition.keys():
-        reindex = False
-        reindex = _setup_catalog(
+        added_indexes, added_columns = _setup_catalog(
             portal, cat_id, definition.get(cat_id, {}))
-        if (reindex or force_reindex) and (cat_id not in clean_and_rebuild):
+        if force_reindex and (cat_id not in clean_and_rebuild):
             # add the catalog if it has not been added before
             clean_and_rebuild.append(cat_id)
+        elif added_indexes or added_columns:
+            to_update[cat_id] = (added_indexes, added_columns)
     # Reindex the catalogs which needs it
     if not force_no_reindex:
         _cleanAndRebuildIfNeeded(portal, clean_and_rebuild)
+        # Rebuilt catalogs have the new indexes and columns filled already
+        for cat_id in clean_and_rebuild:
+            to_update.pop(cat_id, None)
+        _updateIfNeeded(portal, to_update)
     return clean_and_rebuild
 
 def _merge_catalog_definitions(dict1, dict2):
@@ -255,40 +265,39 @@ def _setup_catalog(portal, catalog_id, catalog_definition):
                 ...
             ]
         }
+    :returns: a tuple with the list of added indexes and the list of added
+        columns, which need to be filled for the cataloged objects
     """
 
-    reindex = False
+    added_indexes = []
+    added_columns = []
     catalog = getToolByName(portal, catalog_id, None)
     if catalog is None:
         logger.warning('Could not find the %s tool.' % (catalog_id))
-        return False
+        return added_indexes, added_columns
     # Indexes
     indexes_ids = catalog_definition.get('indexes', {}).keys()
     # Indexing
     for idx in indexes_ids:
         # The function returns if the index needs to be reindexed
-        indexed = _addIndex(catalog, idx, catalog_definition['indexes'][idx])
-        reindex = True if indexed else reindex
-    # Removing indexes
+        if _addIndex(catalog, idx, catalog_definition['indexes'][idx]):
+            added_indexes.append(idx)
+    # Removing indexes. The remaining indexes are not affected
     in_catalog_idxs = catalog.indexes()
     to_remove = list(set(in_catalog_idxs)-set(indexes_ids))
     for idx in to_remove:
-        # The function returns if the index has been deleted
-        desindexed = _delIndex(catalog, idx)
-        reindex = True if desindexed else reindex
+        _delIndex(catalog, idx)
     # Columns
     columns_ids = catalog_definition.get('columns', [])
     for col in columns_ids:
-        created = _addColumn(catalog, col)
-        reindex = True if created else reindex
-    # Removing columns
+        if _addColumn(catalog, col):
+            added_columns.append(col)
+    # Removing columns. The metadata records are updated by delColumn
     in_catalog_cols = catalog.schema()
     to_remove = list(set(in_catalog_cols)-set(columns_ids))
     for col in to_remove:
-        # The function returns if the index has been deleted
-        desindexed = _delColumn(catalog, col)
-        reindex = True if desindexed else reindex
-    return reindex
+        _delColumn(catalog, col)
+    return added_indexes, added_columns
 
 
 def _addIndex(catalog, index, indextype):
@@ -421,6 +430,24 @@ def _cleanAndRebuildIfNeeded(portal, cleanrebuild):
             logger.warning('%s do not found' % cat)
 
 
+def _updateIfNeeded(portal, toupdate):
+    """
+    Fills the added indexes and columns of the given catalogs.
+    :portal: the Plone portal object
+    :toupdate: a dict with catalog ids as keys and tuples with the list of
+        added indexes and the list of added columns as values
+    """
+    for cat, (indexes, columns) in toupdate.items():
+        catalog = getToolByName(portal, cat, None)
+        if catalog is None:
+            logger.warning('%s do not found' % cat)
+        elif getattr(catalog, 'updateIndexesAndColumns', None) is None:
+            # Not a Bika catalog
+            catalog.refreshCatalog()
+        else:
+            catalog.updateIndexesAndColumns(indexes=indexes, columns=columns)
+
+
 class Empty:
     """
     Just a class to use when we need an object with some attributes to send to
@@ -6,9 +6,32 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 from bika.lims import api
+from bika.lims.assignedstate import get_assigned_state
 from bika.lims.interfaces import IAnalysisRequest
 from bika.lims.workflow import getCurrentState
 from plone.indexer import indexer
+from Products.CMFPlone.utils import safe_unicode
+
+# Accessors of the values displayed in Analysis Requests listings. The search
+# box of the listings looks up these values through `listing_searchable_text`
+LISTING_SEARCHABLE_TEXT_ACCESSORS = [
+    "getId",
+    "getSampleID",
+    "getBatchID",
+    "getClientTitle",
+    "getClientOrderNumber",
+    "getClientReference",
+    "getClientSampleID",
+    "getContactFullName",
+    "getCreatorFullName",
+    "getSamplerFullName",
+    "getSampleTypeTitle",
+    "getSamplePointTitle",
+    "getProfilesTitleStr",
+    "getTemplateTitle",
+    "getProvince",
+    "getDistrict",
+]
 
 
 @indexer(IAnalysisRequest)
@@ -17,6 +40,11 @@ def assigned_state(instance):
     analyses the analysisrequest contains. Return `unassigned` if the Analysis
     Request does not contain any analysis or if has at least one in `unassigned`
     state. Otherwise, returns `assigned`"""
+    # Counted without waking up the analyses
+    state = get_assigned_state(instance)
+    if state is not None:
+        return state
+
     analyses = instance.getAnalyses()
     if not analyses:
         return 'unassigned'
@@ -28,3 +56,20 @@ def assigned_state(instance):
             return 'unassigned'
 
     return 'assigned'
+
+
+@indexer(IAnalysisRequest)
+def listing_searchable_text(instance):
+    """Returns a text blob with the values displayed in the Analysis Requests
+    listings, so that the search box of the listings can be resolved by the
+    catalog instead of matching the metadata of all results
+    """
+    entries = []
+    for accessor in LISTING_SEARCHABLE_TEXT_ACCESSORS:
+        value = getattr(instance, accessor, None)
+        if callable(value):
+            value = value()
+        if not value or not isinstance(value, basestring):
+            continue
+        entries.append(safe_unicode(value))
+    return u" ".join(entries)
@@ -6,7 +6,6 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import cgi
-import math
 from decimal import Decimal
 
 from AccessControl import ClassSecurityInfo
@@ -502,6 +501,31 @@ class AbstractAnalysis(AbstractBaseAnalysis):
         if not calc:
             return False
 
+        dependencies = self.getDependencies()
+        for dependency in dependencies:
+            if dependency.getResult():
+                continue
+            # Dependency without results found
+            if not cascade:
+                return False
+            # Try to calculate the dependency result
+            dependency.calculateResult(override, cascade)
+
+        result = self.computeResult(calc, dependencies)
+        if result is None:
+            return False
+        self.setResult(result)
+        return True
+
+    @security.private
+    def computeResult(self, calc, dependencies):
+        """Computes the result of the calculation with the interim fields of
+        this analysis and the results of the dependencies given. The result is
+        not stored.
+        :param calc: the calculation of this analysis
+        :param dependencies: the analyses this analysis depends on
+        :return: the result as a string or None if it cannot be computed
+        """
         mapping = {}
 
         # Interims' priority order (from low to high):
@@ -517,62 +541,42 @@ class AbstractAnalysis(AbstractBaseAnalysis):
                 mapping[i['keyword']] = ivalue
             except (TypeError, ValueError):
                 # Interim not float, abort
-                return False
+                return None
 
         # Add dependencies results to mapping
-        dependencies = self.getDependencies()
         for dependency in dependencies:
             result = dependency.getResult()
             if not result:
-                # Dependency without results found
-                if cascade:
-                    # Try to calculate the dependency result
-                    dependency.calculateResult(override, cascade)
-                    result = dependency.getResult()
-                else:
-                    return False
-            if result:
-                try:
-                    result = float(str(result))
-                    key = dependency.getKeyword()
-                    ldl = dependency.getLowerDetectionLimit()
-                    udl = dependency.getUpperDetectionLimit()
-                    bdl = dependency.isBelowLowerDetectionLimit()
-                    adl = dependency.isAboveUpperDetectionLimit()
-                    mapping[key] = result
-                    mapping['%s.%s' % (key, 'RESULT')] = result
-                    mapping['%s.%s' % (key, 'LDL')] = ldl
-                    mapping['%s.%s' % (key, 'UDL')] = udl
-                    mapping['%s.%s' % (key, 'BELOWLDL')] = int(bdl)
-                    mapping['%s.%s' % (key, 'ABOVEUDL')] = int(adl)
-                except (TypeError, ValueError):
-                    return False
+                continue
+            try:
+                result = float(str(result))
+                key = dependency.getKeyword()
+                ldl = dependency.getLowerDetectionLimit()
+                udl = dependency.getUpperDetectionLimit()
+                bdl = dependency.isBelowLowerDetectionLimit()
+                adl = dependency.isAboveUpperDetectionLimit()
+                mapping[key] = result
+                mapping['%s.%s' % (key, 'RESULT')] = result
+                mapping['%s.%s' % (key, 'LDL')] = ldl
+                mapping['%s.%s' % (key, 'UDL')] = udl
+                mapping['%s.%s' % (key, 'BELOWLDL')] = int(bdl)
+                mapping['%s.%s' % (key, 'ABOVEUDL')] = int(adl)
+            except (TypeError, ValueError):
+                return None
 
         # Calculate
-        formula = calc.getMinifiedFormula()
-        formula = formula.replace('[', '%(').replace(']', ')f')
         try:
-            formula = eval("'%s'%%mapping" % formula,
-                           {"__builtins__": None,
-                            'math': math,
-                            'context': self},
-                           {'mapping': mapping})
-            result = eval(formula, calc._getGlobals())
+            result = calc.calculateFormula(mapping)
         except TypeError:
-            self.setResult("NA")
-            return True
+            return "NA"
         except ZeroDivisionError:
-            self.setResult('0/0')
-            return True
-        except KeyError as e:
-            self.setResult("NA")
-            return True
-        except ImportError as e:
-            self.setResult("NA")
-            return True
+            return "0/0"
+        except KeyError:
+            return "NA"
+        except ImportError:
+            return "NA"
 
-        self.setResult(str(result))
-        return True
+        return str(result)
 
     @security.public
     def getPrice(self):
@@ -24,8 +24,10 @@ from bika.lims.interfaces import IAnalysis, IRoutineAnalysis, \
 from bika.lims.interfaces.analysis import IRequestAnalysis
 from bika.lims.workflow import doActionFor, getCurrentState
 from bika.lims.workflow import getTransitionDate
+from bika.lims.workflow import promoteTransition
 from bika.lims.workflow import skip
 from bika.lims.workflow import wasTransitionPerformed
+from bika.lims.workflow import wasTransitionPerformedFor
 from bika.lims.workflow.analysis import STATE_RETRACTED, STATE_REJECTED
 from zope.interface import implements
 
@@ -139,6 +141,14 @@ schema = schema.copy() + Schema((
 ))
 
 
+def _all_analyses_submitted(ar):
+    """Returns whether all the analyses of the Analysis Request passed in have
+    been submitted, checked with the metadata of the analyses catalog
+    """
+    analyses = ar.getAnalyses()
+    return all([wasTransitionPerformedFor(an, 'submit') for an in analyses])
+
+
 class AbstractRoutineAnalysis(AbstractAnalysis):
     implements(IAnalysis, IRequestAnalysis, IRoutineAnalysis, ISamplePrepWorkflow)
     security = ClassSecurityInfo()
@@ -550,6 +560,23 @@ class AbstractRoutineAnalysis(AbstractAnalysis):
         old = self.getReflexRuleActionsTriggered()
         self.setReflexRuleActionsTriggered(old + text + '|')
 
+    @security.public
+    def setReflexRuleActionsTriggered(self, value):
+        """Sets the reflex rule actions triggered by this analysis and
+        reindexes the analysis, so it can be searched by `isReflexed`
+        :param value: a str object with the triggered actions separated by '|'
+        """
+        self.getField('ReflexRuleActionsTriggered').set(self, value)
+        self.reindexObject(idxs=['isReflexed'])
+
+    @security.public
+    def isReflexed(self):
+        """Returns whether reflex rule actions were triggered by this
+        analysis, so the analysis has been reflexed
+        :returns: True if this analysis triggered reflex rule actions
+        """
+        return self.getReflexRuleActionsTriggered() != ''
+
     @security.public
     def getOriginalReflexedAnalysisUID(self):
         """
@@ -653,11 +680,8 @@ class AbstractRoutineAnalysis(AbstractAnalysis):
         # If all analyses from the Analysis Request to which this Analysis
         # belongs have been submitted, then promote the action to the parent
         # Analysis Request
-        ar = self.getRequest()
-        ans = [an.getObject() for an in ar.getAnalyses()]
-        anssub = [an for an in ans if wasTransitionPerformed(an, 'submit')]
-        if len(ans) == len(anssub):
-            doActionFor(ar, 'submit')
+        promoteTransition(self.getRequest(), 'submit',
+                          check=_all_analyses_submitted)
 
         # Delegate the transition of Worksheet to base class AbstractAnalysis
         super(AbstractRoutineAnalysis, self).workflow_script_submit()
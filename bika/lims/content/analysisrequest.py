@@ -59,6 +59,9 @@ from bika.lims.interfaces import IAnalysisRequest, ISamplePrepWorkflow
 # Bika Permissions
 from bika.lims.permissions import *
 from bika.lims.permissions import Verify as VerifyPermission
+from bika.lims.reindexqueue import is_reindex_deferred
+from bika.lims.reindexqueue import queue_reindex
+from bika.lims.statistics import update_statistics
 # Bika Utils
 from bika.lims.utils import dicts_to_dict, getUsers
 from bika.lims.utils import user_email
@@ -1875,6 +1878,15 @@ class AnalysisRequest(BaseFolder):
         from bika.lims.catalog import getCatalog
         return getCatalog(self)
 
+    def reindexObject(self, idxs=[]):
+        """Reindexes the object, or queues the reindex if it is deferred,
+        e.g. while creating Analysis Requests in bulk
+        """
+        if is_reindex_deferred():
+            queue_reindex(self, idxs=idxs)
+            return
+        super(AnalysisRequest, self).reindexObject(idxs=idxs)
+
     def Title(self):
         """ Return the Request ID as title """
         return self.getId()
@@ -2109,6 +2121,7 @@ class AnalysisRequest(BaseFolder):
         if last_report and not last_report.getDatePrinted():
             last_report.setDatePrinted(DateTime())
             self.reindexObject(idxs=['getPrinted'])
+            update_statistics(self)
 
     security.declareProtected(View, 'getBillableItems')
 
@@ -20,7 +20,7 @@ from bika.lims.content.sample import schema as sample_schema
 from bika.lims.idserver import renameAfterCreation
 from bika.lims.interfaces import IARImport, IClient
 from bika.lims.utils import tmpID
-from bika.lims.utils.analysisrequest import create_analysisrequest
+from bika.lims.utils.analysisrequest import create_analysisrequests
 from bika.lims.vocabularies import CatalogVocabulary
 from bika.lims.workflow import doActionFor
 from collective.progressbar.events import InitialiseProgressBar
@@ -297,10 +297,9 @@ class ARImport(BaseFolder):
         profiles = [x.getObject() for x in bsc(portal_type='AnalysisProfile')]
 
         gridrows = self.schema['SampleData'].get(self)
-        row_cnt = 0
+        records = []
         for therow in gridrows:
             row = deepcopy(therow)
-            row_cnt += 1
 
             # Profiles are titles, profile keys, or UIDS: convert them to UIDs.
             newprofiles = []
@@ -324,13 +323,22 @@ class ARImport(BaseFolder):
             contact_uid =\
                 self.getContact().UID() if self.getContact() else None
             row['Contact'] = contact_uid
-            # Creating analysis request from gathered data
-            ar = create_analysisrequest(
-                client,
-                self.REQUEST,
-                row,
-                analyses=list(newanalyses),
-                partitions=None,)
+            records.append({
+                'values': row,
+                'analyses': list(newanalyses),
+            })
+
+        # Creating analysis requests from gathered data
+        ars, errors = create_analysisrequests(client, self.REQUEST, records)
+        for num, msg in sorted(errors.items()):
+            self.error("Row %s: %s" % (num + 1, msg))
+
+        row_cnt = 0
+        for ar, record in zip(ars, records):
+            row = record['values']
+            row_cnt += 1
+            if ar is None:
+                continue
 
             # Container is special... it could be a containertype.
             container = self.get_row_container(row)
@@ -28,7 +28,7 @@ from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.utils import safe_unicode
 
 from bika.lims import bikaMessageFactory as _
-from bika.lims.api import get_object_by_uid
+from bika.lims.api import get_objects_by_uids
 from bika.lims.browser.fields import InterimFieldsField
 from bika.lims.browser.fields.uidreferencefield import UIDReferenceField
 from bika.lims.browser.fields.uidreferencefield import get_backreferences
@@ -38,6 +38,14 @@ from bika.lims.config import PROJECTNAME
 from bika.lims.content.bikaschema import BikaSchema
 from bika.lims.interfaces.calculation import ICalculation
 
+# Keywords in square brackets of a formula, e.g. [Ca] or [Ca.LDL]
+FORMULA_KEYWORD = re.compile(r"\[([^\]]+)\]")
+
+# Process local caches of the compiled formulas and the resolved python
+# imports of the calculations: {UID: (modification time, source, value)}
+_compiled_formulas = {}
+_resolved_imports = {}
+
 
 schema = BikaSchema.copy() + Schema((
 
@@ -243,7 +251,7 @@ class Calculation(BaseFolder, HistoryAwareMixin):
         if deps is None:
             deps = []
         backrefs = get_backreferences(self, 'AnalysisServiceCalculation')
-        services = map(get_object_by_uid, backrefs)
+        services = get_objects_by_uids(backrefs)
         for service in services:
             calc = service.getCalculation()
             if calc and calc.UID() != self.UID():
@@ -313,6 +321,54 @@ class Calculation(BaseFolder, HistoryAwareMixin):
             result = "Unspecified exception: {}".format(str(e.args[0]))
         test_result_field.set(self, str(result))
 
+    def getCompiledFormula(self):
+        """Return the formula compiled to a code object.
+
+        The keywords in square brackets are replaced by python variables, so
+        the values do not need to be interpolated into the formula. The
+        compiled formula is cached by UID and modification time.
+
+        :returns: tuple of the code object and a tuple of (variable, keyword)
+        """
+        formula = self.getMinifiedFormula()
+        uid = self.UID()
+        modified = self.modified()
+        cached = _compiled_formulas.get(uid)
+        if cached and cached[0] == modified and cached[1] == formula:
+            return cached[2]
+
+        variables = {}
+
+        def to_variable(match):
+            keyword = match.group(1)
+            if keyword not in variables:
+                variables[keyword] = "_{}_{}".format(
+                    len(variables), re.sub(r"\W", "_", keyword))
+            return variables[keyword]
+
+        source = FORMULA_KEYWORD.sub(to_variable, formula)
+        code = compile(source, "<formula {}>".format(self.getId()), "eval")
+        compiled = (code, tuple((v, k) for k, v in variables.items()))
+        _compiled_formulas[uid] = (modified, formula, compiled)
+        return compiled
+
+    def calculateFormula(self, mapping, **kwargs):
+        """Evaluate the compiled formula with the values of the mapping.
+
+        The values are rounded to 6 decimals, like the former interpolation
+        of the values into the formula text did.
+
+        :param mapping: keyword -> value of the keywords used in the formula
+        :param kwargs: additional globals for the formula
+        :raises KeyError: if a keyword of the formula is not in the mapping
+        :raises TypeError: if a value of the mapping is not numeric
+        """
+        code, variables = self.getCompiledFormula()
+        values = {}
+        for variable, keyword in variables:
+            values[variable] = float("%f" % mapping[keyword])
+        return eval(code, self._getGlobals(**kwargs), values)
+
     def _getGlobals(self, **kwargs):
         """Return the globals dictionary for the formula calculation
         """
@@ -329,16 +385,33 @@ class Calculation(BaseFolder, HistoryAwareMixin):
         # Update with keyword arguments
         globs.update(kwargs)
         # Update with additional Python libraries
-        for imp in self.getPythonImports():
-            mod = imp["module"]
-            func = imp["function"]
+        globs.update(self._getImportedMembers())
+        return globs
+
+    def _getImportedMembers(self):
+        """Return a dictionary of the members of the python imports.
+
+        The resolved members are cached by UID and modification time, so the
+        modules are not inspected on every calculation.
+        """
+        imports = tuple((imp["module"], imp["function"])
+                        for imp in self.getPythonImports())
+        uid = self.UID()
+        modified = self.modified()
+        cached = _resolved_imports.get(uid)
+        if cached and cached[0] == modified and cached[1] == imports:
+            return cached[2]
+
+        members = {}
+        for mod, func in imports:
             member = self._getModuleMember(mod, func)
             if member is None:
                 raise ImportError(
                     "Could not find member {} of module {}".format(
                         func, mod))
-            globs[func] = member
-        return globs
+            members[func] = member
+        _resolved_imports[uid] = (modified, imports, members)
+        return members
 
     def _getModuleMember(self, dotted_name, member):
         """Get the member object of a module.
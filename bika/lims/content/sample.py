@@ -10,7 +10,7 @@
 from AccessControl import ClassSecurityInfo
 from Products.CMFCore.WorkflowCore import WorkflowException
 from bika.lims import bikaMessageFactory as _, logger
-from bika.lims.api import get_object_by_uid
+from bika.lims.api import get_objects_by_uids
 from bika.lims.browser.fields.uidreferencefield import get_backreferences
 from bika.lims.utils import t, getUsers
 from Products.ATExtensions.field import RecordsField
@@ -22,6 +22,8 @@ from bika.lims.content.bikaschema import BikaSchema
 from bika.lims.interfaces import ISample, ISamplePrepWorkflow
 from bika.lims.permissions import SampleSample
 from bika.lims.permissions import ScheduleSampling
+from bika.lims.reindexqueue import is_reindex_deferred
+from bika.lims.reindexqueue import queue_reindex
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import isBasicTransitionAllowed
 from bika.lims.workflow import isTransitionAllowed
@@ -666,6 +668,15 @@ class Sample(BaseFolder, HistoryAwareMixin):
         from bika.lims.catalog import getCatalog
         return getCatalog(self)
 
+    def reindexObject(self, idxs=[]):
+        """Reindexes the object, or queues the reindex if it is deferred,
+        e.g. while creating Analysis Requests in bulk
+        """
+        if is_reindex_deferred():
+            queue_reindex(self, idxs=idxs)
+            return
+        super(Sample, self).reindexObject(idxs=idxs)
+
     def getSampleID(self):
         """ Return the Sample ID as title """
         return safe_unicode(self.getId()).encode('utf-8')
@@ -790,8 +801,9 @@ class Sample(BaseFolder, HistoryAwareMixin):
 
     def getAnalysisRequests(self):
         backrefs = get_backreferences(self, 'AnalysisRequestSample')
-        ars = map(get_object_by_uid, backrefs)
-        return ars
+        ars = get_objects_by_uids(backrefs)
+        # Backreferences are sorted by UID, keep the primary AR first
+        return sorted(ars, key=lambda ar: ar.created())
 
     security.declarePublic('getAnalyses')
 
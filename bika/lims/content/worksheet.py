@@ -679,7 +679,7 @@ class Worksheet(BaseFolder, HistoryAwareMixin):
         if slot < 1:
             return list()
 
-        analyses = list()
+        uids = list()
         layout = self.getLayout()
 
         for pos in layout:
@@ -687,9 +687,9 @@ class Worksheet(BaseFolder, HistoryAwareMixin):
             uid = pos['analysis_uid']
             if layout_slot != slot or not uid:
                 continue
-            analyses.append(api.get_object_by_uid(uid))
+            uids.append(uid)
 
-        return analyses
+        return api.get_objects_by_uids(uids)
 
     def get_container_at(self, slot):
         """Returns the container object assigned to the slot passed in
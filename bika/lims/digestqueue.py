@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Queue of Analysis Requests to digest for publication
+
+Analysis Requests are queued when their analyses are verified or when they are
+modified after verification. The queue is stored in the database together with
+the changes, and it is processed after the transaction is committed by a
+background thread with its own database connection, so the requests that
+verify or modify Analysis Requests do not wait for the digestion. Analysis
+Requests still queued on publication are digested right away.
+"""
+
+import threading
+import traceback
+from Queue import Queue
+
+import transaction
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import system
+from Acquisition import aq_base
+from BTrees.OOBTree import OOBTree
+from bika.lims import api
+from bika.lims import logger
+from bika.lims.numbergenerator import get_portal_annotation
+from Testing.makerequest import makerequest
+from ZODB.POSException import ConflictError
+from zope.component.hooks import setSite
+from zope.globalrequest import setRequest
+
+DIGEST_QUEUE_STORAGE = "bika.lims.digest_queue"
+
+# Analysis Requests that could not be digested: UID -> id of the user
+DIGEST_FAILED_STORAGE = "bika.lims.digest_queue_failed"
+
+# Number of attempts to digest an Analysis Request on write conflicts
+DIGEST_ATTEMPTS = 3
+
+_local = threading.local()
+
+# Databases and site paths with Analysis Requests queued, for the worker
+_pending = Queue()
+_worker_lock = threading.Lock()
+_worker = None
+
+
+def get_digest_queue(create=False):
+    """Returns the queue of Analysis Requests to digest: UID -> id of the user
+    that queued the Analysis Request
+
+    :param create: Create the queue if it does not exist yet
+    :returns: The queue or None
+    """
+    annotation = get_portal_annotation()
+    queue = annotation.get(DIGEST_QUEUE_STORAGE)
+    if queue is None and create:
+        queue = OOBTree()
+        annotation[DIGEST_QUEUE_STORAGE] = queue
+    return queue
+
+
+def queue_digest(ar):
+    """Queues the Analysis Request to be digested after the transaction is
+    committed
+    """
+    uid = api.get_uid(ar)
+    queue = get_digest_queue(create=True)
+    user = api.get_current_user()
+    userid = user and user.getId() or ""
+    if queue.get(uid) != userid:
+        queue[uid] = userid
+
+    # Notify the background worker once the transaction is committed
+    txn = transaction.get()
+    if getattr(_local, "transaction", None) is not txn:
+        _local.transaction = txn
+        portal = api.get_portal()
+        db = aq_base(portal)._p_jar.db()
+        txn.addAfterCommitHook(
+            _notify_worker, (db, portal.getPhysicalPath()))
+
+
+def get_failed_digests(create=False):
+    """Returns the Analysis Requests that failed to be digested: UID -> id of
+    the user that queued the Analysis Request
+
+    :param create: Create the storage if it does not exist yet
+    :returns: The failed digests or None
+    """
+    annotation = get_portal_annotation()
+    failed = annotation.get(DIGEST_FAILED_STORAGE)
+    if failed is None and create:
+        failed = OOBTree()
+        annotation[DIGEST_FAILED_STORAGE] = failed
+    return failed
+
+
+def is_digest_queued(ar):
+    """Checks if the Analysis Request is waiting to be digested, also if it
+    failed to be digested by the queue
+    """
+    uid = api.get_uid(ar)
+    for storage in (get_digest_queue(), get_failed_digests()):
+        if storage is not None and uid in storage:
+            return True
+    return False
+
+
+def dequeue_digest(ar):
+    """Removes the Analysis Request from the queue and the failed digests
+    """
+    uid = api.get_uid(ar)
+    for storage in (get_digest_queue(), get_failed_digests()):
+        if storage is not None and uid in storage:
+            del storage[uid]
+
+
+def process_digest_queue(tm=None):
+    """Digests the queued Analysis Requests, committing after each one
+
+    Analysis Requests that fail to be digested are moved from the queue to
+    the failed digests (see `get_failed_digests`), so they do not block the
+    rest of the queue. They are digested on publication.
+
+    :param tm: The transaction manager of the current connection
+    :returns: The number of digested Analysis Requests
+    """
+    tm = tm or transaction.manager
+    queue = get_digest_queue()
+    if not queue:
+        return 0
+
+    # The digester is shared, so the history of the batches is built once
+    # for all the queued Analysis Requests of the same batch
+    digester = _get_digester()
+    digested = 0
+    for uid in list(queue.keys()):
+        for attempt in range(DIGEST_ATTEMPTS):
+            try:
+                if digest(uid, digester=digester):
+                    digested += 1
+                tm.commit()
+                break
+            except ConflictError:
+                tm.abort()
+                digester = _get_digester()
+                logger.info("Conflict digesting {} (attempt {})"
+                            .format(uid, attempt + 1))
+            except Exception:
+                tm.abort()
+                digester = _get_digester()
+                logger.error("Could not digest {}, moved to the failed "
+                             "digests: {}".format(uid, traceback.format_exc()))
+                try:
+                    _fail(uid)
+                    tm.commit()
+                except ConflictError:
+                    tm.abort()
+                    logger.warn("Could not move {} to the failed digests, "
+                                "left in the queue".format(uid))
+                break
+        else:
+            logger.warn("Could not digest {}, left in the queue".format(uid))
+    logger.info("{} Analysis Requests digested".format(digested))
+    return digested
+
+
+def digest(uid, digester=None):
+    """Digests the queued Analysis Request of the UID as the user that queued
+    it and removes it from the queue
+
+    :param digester: The digester to use. A new one if None
+    :returns: True if the Analysis Request was digested
+    """
+    queue = get_digest_queue()
+    if queue is None or uid not in queue:
+        # Digested meanwhile
+        return False
+    userid = queue[uid]
+    del queue[uid]
+
+    _login(userid)
+    ar = api.get_object_by_uid(uid, None)
+    if ar is None:
+        return False
+    digester = digester or _get_digester()
+    digester(ar, overwrite=True)
+    return True
+
+
+def _fail(uid):
+    """Moves the UID from the queue to the failed digests
+    """
+    queue = get_digest_queue()
+    if queue is None or uid not in queue:
+        return
+    get_failed_digests(create=True)[uid] = queue[uid]
+    del queue[uid]
+
+
+def _get_digester():
+    """Returns a new Analysis Request digester
+    """
+    from bika.lims.browser.analysisrequest.publish import \
+        AnalysisRequestDigester
+    return AnalysisRequestDigester()
+
+
+def _login(userid):
+    """Switches the security context to the user or to the system user if the
+    user does not exist anymore
+    """
+    portal = api.get_portal()
+    for acl_users in (portal.acl_users, portal.getPhysicalRoot().acl_users):
+        user = userid and acl_users.getUserById(userid) or None
+        if user is not None:
+            newSecurityManager(None, user.__of__(acl_users))
+            return
+    newSecurityManager(None, system)
+
+
+def _notify_worker(success, db, site_path):
+    """Hands the queue over to the background worker, starting it if needed
+    """
+    global _worker
+    if not success:
+        return
+    _pending.put((db, site_path))
+    _worker_lock.acquire()
+    try:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="digest-queue")
+            _worker.setDaemon(True)
+            _worker.start()
+    finally:
+        _worker_lock.release()
+
+
+def _work():
+    """Processes the queues of the notified sites forever
+    """
+    while True:
+        db, site_path = _pending.get()
+        try:
+            _process_in_connection(db, site_path)
+        except Exception:
+            logger.error("Digest queue: {}".format(traceback.format_exc()))
+
+
+def _process_in_connection(db, site_path):
+    """Processes the queue of the site with a new database connection
+    """
+    tm = transaction.TransactionManager()
+    connection = db.open(transaction_manager=tm)
+    try:
+        app = makerequest(connection.root()["Application"])
+        site = app.unrestrictedTraverse(site_path)
+        setSite(site)
+        setRequest(app.REQUEST)
+        process_digest_queue(tm)
+    finally:
+        tm.abort()
+        setRequest(None)
+        setSite(None)
+        noSecurityManager()
+        connection.close()
@@ -14,6 +14,10 @@ from bika.lims import bikaMessageFactory as _
 
 
 class EltraCSTSVParser(InstrumentCSVResultsFileParser):
+
+    # Each line is a single record, so the file can be parsed incrementally
+    streaming = True
+
     def __init__(self, tsv, analysis1, analysis2):
         InstrumentCSVResultsFileParser.__init__(self, tsv)
         self._analysis1 = analysis1
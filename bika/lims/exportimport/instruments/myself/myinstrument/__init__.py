@@ -12,6 +12,9 @@ title = "My Instrument"
 
 class MyInstrumentCSVParser(InstrumentCSVResultsFileParser):
 
+    # Each line is a single record, so the file can be parsed incrementally
+    streaming = True
+
     def __init__(self, csv):
         InstrumentCSVResultsFileParser.__init__(self, csv)
 
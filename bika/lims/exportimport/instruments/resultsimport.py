@@ -6,7 +6,11 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import codecs
+from collections import deque
 from datetime import datetime
+from itertools import islice
+
+import transaction
 from DateTime import DateTime
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.utils import _createObjectByType
@@ -17,11 +21,18 @@ from bika.lims.exportimport.instruments.logger import Logger
 from bika.lims.idserver import renameAfterCreation
 from bika.lims.utils import t
 from bika.lims.utils import tmpID
+from bika.lims.utils.analysis import calculate_results
 from bika.lims.workflow import doActionFor
 
 
 class InstrumentResultsFileParser(Logger):
 
+    # Parsers that add every raw result once with _addRawResult and neither
+    # read nor modify the raw results afterwards can set this flag to opt in
+    # the incremental parsing. The importer consumes the parsed records with
+    # iter_records() then, without keeping the whole file in memory.
+    streaming = False
+
     def __init__(self, infile, mimetype):
         Logger.__init__(self)
         self._infile = infile
@@ -29,6 +40,12 @@ class InstrumentResultsFileParser(Logger):
         self._rawresults = {}
         self._mimetype = mimetype
         self._numline = 0
+        self._parsed = False
+        # Records pending to be consumed while parsing incrementally
+        self._stream = None
+        self._streamed_objids = set()
+        self._streamed_keywords = set()
+        self._streamed_count = 0
 
     def getInputFile(self):
         """ Returns the results input file
@@ -45,6 +62,75 @@ class InstrumentResultsFileParser(Logger):
         """
         raise NotImplementedError
 
+    def iter_records(self):
+        """ Generator of the parsed (objid, values) records, where values is
+            a dictionary as described in getRawResults().
+            If the parser supports streaming, the input file is parsed while
+            the records are consumed and the records are not kept in memory.
+            Otherwise, the records parsed by parse() are returned.
+        """
+        if not self.streaming:
+            for objid, results in self.getRawResults().iteritems():
+                for values in results:
+                    yield objid, values
+            return
+
+        self._stream = deque()
+        for parsed in self._iterparse():
+            while self._stream:
+                yield self._stream.popleft()
+
+    def _iterparse(self):
+        """ Parses the input results file and yields after each step, so the
+            records added meanwhile can be consumed by iter_records().
+            By default, the whole file is parsed in a single step. Line based
+            parsers yield after every line.
+        """
+        self._parsed = self.parse()
+        yield self._parsed
+
+    def _parselines(self, lines):
+        """ Feeds the lines to _parseline() one by one and yields after every
+            line parsed. The lines are stripped and blank lines are skipped.
+        """
+        self._parsed = False
+        jump = 0
+        for line in lines:
+            self._numline += 1
+            if jump == -1:
+                # Something went wrong. Finish
+                self.err("File processing finished due to critical errors")
+                return
+            if jump > 0:
+                # Jump some lines
+                jump -= 1
+                continue
+
+            line = line.strip()
+            if not line:
+                continue
+
+            jump = self._parseline(line)
+            yield jump
+
+        self.log(
+            "End of file reached successfully: ${total_objects} objects, "
+            "${total_analyses} analyses, ${total_results} results",
+            mapping={"total_objects": self.getObjectsTotalCount(),
+                     "total_analyses": self.getAnalysesTotalCount(),
+                     "total_results": self.getResultsTotalCount()}
+        )
+        self._parsed = True
+
+    def _parseline(self, line):
+        """ Parses a line from the input file and populates rawresults
+            (look at getRawResults comment)
+            returns -1 if critical error found and parser must end
+            returns the number of lines to be jumped in next read. If 0, the
+            parser reads the next line as usual
+        """
+        raise NotImplementedError
+
     def getAttachmentFileType(self):
         """ Returns the file type name that will be used when creating the
             AttachmentType used by the importer for saving the results file as
@@ -93,8 +179,16 @@ class InstrumentResultsFileParser(Logger):
                        'Exp Conc':      '1.9531',
                        'Accuracy':      '98.19' }
                 }
+
+            While parsing incrementally, the values are handed over to
+            iter_records() instead, so override has no effect.
         """
-        if override or resid not in self._rawresults.keys():
+        if self._stream is not None:
+            self._stream.append((resid, values))
+            self._streamed_objids.add(resid)
+            self._streamed_keywords.update(values.keys())
+            self._streamed_count += 1
+        elif override or resid not in self._rawresults.keys():
             self._rawresults[resid] = [values]
         else:
             self._rawresults[resid].append(values)
@@ -107,11 +201,15 @@ class InstrumentResultsFileParser(Logger):
     def getObjectsTotalCount(self):
         """ The total number of objects (ARs, ReferenceSamples, etc.) parsed
         """
+        if self._stream is not None:
+            return len(self._streamed_objids)
         return len(self.getRawResults())
 
     def getResultsTotalCount(self):
         """ The total number of analysis results parsed
         """
+        if self._stream is not None:
+            return self._streamed_count
         count = 0
         for val in self.getRawResults().values():
             count += len(val)
@@ -125,6 +223,8 @@ class InstrumentResultsFileParser(Logger):
     def getAnalysisKeywords(self):
         """ The analysis service keywords found
         """
+        if self._stream is not None:
+            return list(self._streamed_keywords)
         analyses = []
         for rows in self.getRawResults().values():
             for row in rows:
@@ -186,7 +286,7 @@ class InstrumentResultsFileParser(Logger):
         """ Resumes the parse process
             Called by the Results Importer after parse() call
         """
-        if len(self.getRawResults()) == 0:
+        if self.getObjectsTotalCount() == 0:
             self.warn("No results found")
             return False
         return True
@@ -201,10 +301,14 @@ class InstrumentCSVResultsFileParser(InstrumentResultsFileParser):
         self._encoding = encoding
 
     def parse(self):
+        for parsed in self._iterparse():
+            pass
+        return self._parsed
+
+    def _iterparse(self):
         infile = self.getInputFile()
         self.log("Parsing file ${file_name}",
                  mapping={"file_name": infile.filename})
-        jump = 0
         # We test in import functions if the file was uploaded
         try:
             if self._encoding:
@@ -213,47 +317,13 @@ class InstrumentCSVResultsFileParser(InstrumentResultsFileParser):
                 f = open(infile.name, 'rU')
         except AttributeError:
             f = infile
-        for line in f.readlines():
-            self._numline += 1
-            if jump == -1:
-                # Something went wrong. Finish
-                self.err("File processing finished due to critical errors")
-                return False
-            if jump > 0:
-                # Jump some lines
-                jump -= 1
-                continue
-
-            if not line or not line.strip():
-                continue
-
-            line = line.strip()
-            jump = 0
-            if line:
-                jump = self._parseline(line)
-
-        self.log(
-            "End of file reached successfully: ${total_objects} objects, "
-            "${total_analyses} analyses, ${total_results} results",
-            mapping={"total_objects": self.getObjectsTotalCount(),
-                     "total_analyses": self.getAnalysesTotalCount(),
-                     "total_results": self.getResultsTotalCount()}
-        )
-        return True
+        # Read line by line, without loading the whole file into memory
+        return self._parselines(iter(f.readline, ''))
 
     def splitLine(self, line):
         sline = line.split(',')
         return [token.strip() for token in sline]
 
-    def _parseline(self, line):
-        """ Parses a line from the input CSV file and populates rawresults
-            (look at getRawResults comment)
-            returns -1 if critical error found and parser must end
-            returns the number of lines to be jumped in next read. If 0, the
-            parser reads the next line as usual
-        """
-        raise NotImplementedError
-
 
 class InstrumentTXTResultsFileParser(InstrumentResultsFileParser):
 
@@ -265,36 +335,14 @@ class InstrumentTXTResultsFileParser(InstrumentResultsFileParser):
         self._encoding = encoding
 
     def parse(self):
+        for parsed in self._iterparse():
+            pass
+        return self._parsed
+
+    def _iterparse(self):
         infile = self.getInputFile()
         self.log("Parsing file ${file_name}", mapping={"file_name": infile.filename})
-        jump = 0
-        lines = self.read_file(infile)
-        for line in lines:
-            self._numline += 1
-            if jump == -1:
-                # Something went wrong. Finish
-                self.err("File processing finished due to critical errors")
-                return False
-            if jump > 0:
-                # Jump some lines
-                jump -= 1
-                continue
-
-            if not line:
-                continue
-
-            jump = 0
-            if line:
-                jump = self._parseline(line)
-
-        self.log(
-            "End of file reached successfully: ${total_objects} objects, "
-            "${total_analyses} analyses, ${total_results} results",
-            mapping={"total_objects": self.getObjectsTotalCount(),
-                     "total_analyses": self.getAnalysesTotalCount(),
-                     "total_results": self.getResultsTotalCount()}
-        )
-        return True
+        return self._parselines(self.iter_file(infile))
 
     def read_file(self, infile):
         """Given an input file read its contents, strip whitespace from the
@@ -304,32 +352,37 @@ class InstrumentTXTResultsFileParser(InstrumentResultsFileParser):
         :param infile: file that contains the data to be read
         :return: list of the read lines with stripped whitespace
         """
-        try:
-            encoding = self._encoding if self._encoding else None
-            mode = 'r' if self._encoding else 'rU'
-            with codecs.open(infile.name, mode, encoding=encoding) as f:
-                lines = f.readlines()
-        except AttributeError:
-            lines = infile.readlines()
-        lines = [line.strip() for line in lines]
-        return lines
+        return list(self.iter_file(infile))
+
+    def iter_file(self, infile):
+        """Given an input file, yield its lines one by one with whitespace
+         stripped from the beginning and end, without reading the whole file
+         into memory.
+
+        :param infile: file that contains the data to be read
+        :return: generator of the read lines with stripped whitespace
+        """
+        if getattr(infile, 'name', None) is None:
+            for line in iter(infile.readline, ''):
+                yield line.strip()
+            return
+
+        encoding = self._encoding if self._encoding else None
+        mode = 'r' if self._encoding else 'rU'
+        with codecs.open(infile.name, mode, encoding=encoding) as f:
+            for line in iter(f.readline, ''):
+                yield line.strip()
 
     def split_line(self, line):
         sline = line.split(self._separator)
         return [token.strip() for token in sline]
 
-    def _parseline(self, line):
-        """ Parses a line from the input CSV file and populates rawresults
-            (look at getRawResults comment)
-            returns -1 if critical error found and parser must end
-            returns the number of lines to be jumped in next read. If 0, the
-            parser reads the next line as usual
-        """
-        raise NotImplementedError
-
 
 class AnalysisResultsImporter(Logger):
 
+    # Number of records processed per transaction with streaming parsers
+    chunk_size = 500
+
     def __init__(self, parser, context,
                  idsearchcriteria=None,
                  override=[False, False],
@@ -344,6 +397,8 @@ class AnalysisResultsImporter(Logger):
         self._override = override
         self._idsearch = idsearchcriteria
         self._priorizedsearchcriteria = ''
+        self._ar_analyses = {}
+        self._analyses = {}
         self.bsc = getToolByName(self.context, 'bika_setup_catalog')
         self.bac = getToolByName(self.context, 'bika_analysis_catalog')
         self.ar_catalog = getToolByName(
@@ -408,15 +463,25 @@ class AnalysisResultsImporter(Logger):
         return []
 
     def process(self):
-        self._parser.parse()
-        parsed = self._parser.resume()
-        self._errors = self._parser.errors
-        self._warns = self._parser.warns
-        self._logs = self._parser.logs
+        """ Imports the results parsed from the results file.
+            The records are processed in chunks of chunk_size records: the
+            objects and keywords of a chunk are resolved at once, and the
+            transaction is committed after each chunk. Parsers that do not
+            support streaming are parsed completely first and processed as a
+            single chunk.
+        """
+        parser = self._parser
+        self._errors = parser.errors
+        self._warns = parser.warns
+        self._logs = parser.logs
         self._priorizedsearchcriteria = ''
 
-        if parsed is False:
-            return False
+        streaming = parser.streaming
+        if not streaming:
+            parser.parse()
+            parsed = parser.resume()
+            if parsed is False:
+                return False
 
         # Allowed analysis states
         allowed_ar_states_msg = [t(_(s)) for s in self.getAllowedARStates()]
@@ -427,190 +492,35 @@ class AnalysisResultsImporter(Logger):
         self.log("Allowed analysis states: ${allowed_states}",
                  mapping={'allowed_states': ', '.join(allowed_an_states_msg)})
 
-        # Exclude non existing ACODEs
-        acodes = []
-        ancount = 0
-        instprocessed = []
-        importedars = {}
-        importedinsts = {}
-        rawacodes = self._parser.getAnalysisKeywords()
-        exclude = self.getKeywordsToBeExcluded()
-        for acode in rawacodes:
-            if acode in exclude or not acode:
-                continue
-            service = self.bsc(getKeyword=acode)
-            if not service:
-                self.warn('Service keyword ${analysis_keyword} not found',
-                          mapping={"analysis_keyword": acode})
-            else:
-                acodes.append(acode)
-        if len(acodes) == 0:
-            self.warn("Service keywords: no matches found")
-
+        self._keywords = {}
+        self._ancount = 0
+        self._importedars = {}
+        self._importedinsts = {}
         # Attachments will be created in any worksheet that contains
         # analyses that are updated by this import
-        attachments = {}
-        infile = self._parser.getInputFile()
-
-        # searchcriteria = self.getIdSearchCriteria()
-        # self.log(_("Search criterias: %s") % (', '.join(searchcriteria)))
-        for objid, results in self._parser.getRawResults().iteritems():
-            # Allowed more than one result for the same sample and analysis.
-            # Needed for calibration tests
-            for result in results:
-                analyses = self._getZODBAnalyses(objid)
-                inst = None
-                if len(analyses) == 0 and self.instrument_uid:
-                    # No registered analyses found, but maybe we need to
-                    # create them first if an instruemnt id has been set in
-                    insts = self.bsc(portal_type='Instrument',
-                                     UID=self.instrument_uid)
-                    if len(insts) == 0:
-                        # No instrument found
-                        self.warn("No Analysis Request with "
-                                  "'${allowed_ar_states}' "
-                                  "states found, And no QC"
-                                  "analyses found for ${object_id}",
-                                  mapping={"allowed_ar_states": ', '.join(
-                                      allowed_ar_states_msg),
-                                          "object_id": objid})
-                        self.warn("Instrument not found")
-                        continue
-
-                    inst = insts[0].getObject()
-
-                    # Create a new ReferenceAnalysis and link it to
-                    # the Instrument
-                    # Here we have an objid (i.e. R01200012) and
-                    # a dict with results (the key is the AS keyword).
-                    # How can we create a ReferenceAnalysis if we don't know
-                    # which ReferenceSample we might use?
-                    # Ok. The objid HAS to be the ReferenceSample code.
-                    refsample = self.bc(portal_type='ReferenceSample',
-                                        id=objid)
-                    if refsample and len(refsample) == 1:
-                        refsample = refsample[0].getObject()
-
-                    elif refsample and len(refsample) > 1:
-                        # More than one reference sample found!
-                        self.warn(
-                            "More than one reference sample found for"
-                            "'${object_id}'",
-                            mapping={"object_id": objid})
-                        continue
+        self._attachments = {}
 
-                    else:
-                        # No reference sample found!
-                        self.warn("No Reference Sample found for ${object_id}",
-                                  mapping={"object_id": objid})
-                        continue
-
-                    # For each acode, create a ReferenceAnalysis and attach it
-                    # to the Reference Sample
-                    services = self.bsc(portal_type='AnalysisService')
-                    service_uids = [service.UID for service in services
-                                    if service.getObject().getKeyword()
-                                    in result.keys()]
-                    analyses = inst.addReferences(refsample, service_uids)
-
-                elif len(analyses) == 0:
-                    # No analyses found
-                    self.warn("No Analysis Request with "
-                              "'${allowed_ar_states}' "
-                              "states neither QC analyses found "
-                              "for ${object_id}",
-                              mapping={
-                                 "allowed_ar_states": ', '.join(
-                                     allowed_ar_states_msg),
-                                 "object_id": objid})
-                    continue
+        records = parser.iter_records()
+        if not streaming:
+            self._processRecords(list(records))
+        else:
+            while True:
+                chunk = list(islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                self._processRecords(chunk)
+                transaction.commit()
+            if parser.resume() is False:
+                return False
 
-                # Look for timestamp
-                capturedate = result.get('DateTime', {}).get('DateTime', None)
-                if capturedate:
-                    del result['DateTime']
-                for acode, values in result.iteritems():
-                    if acode not in acodes:
-                        # Analysis keyword doesn't exist
-                        continue
-
-                    ans = [analysis for analysis in analyses
-                           if analysis.getKeyword() == acode]
-
-                    if len(ans) > 1:
-                        self.warn("More than one analysis found for "
-                                  "${object_id} and ${analysis_keyword}",
-                                  mapping={"object_id": objid,
-                                           "analysis_keyword": acode})
-                        continue
-
-                    elif len(ans) == 0:
-                        self.warn("No analyses found for ${object_id} "
-                                  "and ${analysis_keyword}",
-                                  mapping={"object_id": objid,
-                                           "analysis_keyword": acode})
-                        continue
-
-                    analysis = ans[0]
-
-                    # Create attachment in worksheet linked to this analysis.
-                    # Only if this import has not already created the
-                    # attachment
-                    # And only if the filename of the attachment is unique in
-                    # this worksheet.  Otherwise we will attempt to use
-                    # existing attachment.
-                    wss = analysis.getBackReferences('WorksheetAnalysis')
-                    ws = wss[0] if wss else None
-                    if ws:
-                        if ws.getId() not in attachments:
-                            fn = infile.filename
-                            fn_attachments = self.get_attachment_filenames(ws)
-                            if fn in fn_attachments:
-                                attachments[ws.getId()] = fn_attachments[fn]
-                            else:
-                                attachments[ws.getId()] = \
-                                    self.create_attachment(ws, infile)
-
-                    if capturedate:
-                        values['DateTime'] = capturedate
-                    processed = self._process_analysis(objid, analysis, values)
-                    if processed:
-                        ancount += 1
-                        if inst:
-                            # Calibration Test (import to Instrument)
-                            instprocessed.append(inst.UID())
-                            importedinst = inst.title in importedinsts.keys() \
-                                and importedinsts[inst.title] or []
-                            if acode not in importedinst:
-                                importedinst.append(acode)
-                            importedinsts[inst.title] = importedinst
-                        else:
-                            ar = analysis.portal_type == 'Analysis' \
-                                and analysis.aq_parent or None
-                            if ar and ar.UID:
-                                importedar = ar.getId() in importedars.keys() \
-                                            and importedars[ar.getId()] or []
-                                if acode not in importedar:
-                                    importedar.append(acode)
-                                importedars[ar.getId()] = importedar
-
-                        if ws:
-                            self.attach_attachment(
-                                analysis, attachments[ws.getId()])
-                        else:
-                            self.warn(
-                                "Attachment cannot be linked to analysis as "
-                                "it is not assigned to a worksheet (%s)" %
-                                analysis)
-
-        for arid, acodes in importedars.iteritems():
+        for arid, acodes in self._importedars.iteritems():
             acodesmsg = ["Analysis %s" % acod for acod in acodes]
             self.log(
                     "${request_id}: ${analysis_keywords} imported sucessfully",
                     mapping={"request_id": arid,
                              "analysis_keywords": acodesmsg})
 
-        for instid, acodes in importedinsts.iteritems():
+        for instid, acodes in self._importedinsts.iteritems():
             acodesmsg = ["Analysis %s" % acod for acod in acodes]
             msg = "%s: %s %s" % (instid,
                                  ", ".join(acodesmsg),
@@ -623,15 +533,200 @@ class AnalysisResultsImporter(Logger):
                 "${nr_updated_instruments} Instruments and "
                 "${nr_updated_results} "
                 "results updated",
-                mapping={"nr_updated_ars": str(len(importedars)),
-                         "nr_updated_instruments": str(len(importedinsts)),
-                         "nr_updated_results": str(ancount)})
+                mapping={"nr_updated_ars": str(len(self._importedars)),
+                         "nr_updated_instruments": str(
+                             len(self._importedinsts)),
+                         "nr_updated_results": str(self._ancount)})
         else:
             self.log(
                 "Import finished successfully: ${nr_updated_ars} ARs and "
                 "${nr_updated_results} results updated",
-                mapping={"nr_updated_ars": str(len(importedars)),
-                         "nr_updated_results": str(ancount)})
+                mapping={"nr_updated_ars": str(len(self._importedars)),
+                         "nr_updated_results": str(self._ancount)})
+
+    def _processRecords(self, records):
+        """ Processes a chunk of (objid, values) records. The keywords and the
+            analyses of all the objects of the chunk are resolved at once
+            before the records are processed one by one
+        """
+        keywords = set()
+        for objid, result in records:
+            keywords.update(result.keys())
+        self._resolveKeywords(keywords)
+        self._resolveObjects(set([objid for objid, result in records]))
+        for objid, result in records:
+            self._processRecord(objid, result)
+
+    def _resolveKeywords(self, keywords):
+        """ Checks that an Analysis Service exists for each of the keywords
+            not checked yet, with a single query for all of them
+        """
+        exclude = self.getKeywordsToBeExcluded()
+        rawacodes = [acode for acode in keywords
+                     if acode and acode not in exclude
+                     and acode not in self._keywords]
+        first = not self._keywords
+        services = rawacodes and self.bsc(getKeyword=rawacodes) or []
+        found = set([service.getKeyword for service in services])
+        for acode in rawacodes:
+            self._keywords[acode] = acode in found
+            if acode not in found:
+                self.warn('Service keyword ${analysis_keyword} not found',
+                          mapping={"analysis_keyword": acode})
+        if first and not any(self._keywords.values()):
+            self.warn("Service keywords: no matches found")
+
+    def _processRecord(self, objid, result):
+        """ Imports the results of a single record for the object objid
+        """
+        allowed_ar_states_msg = [t(_(s)) for s in self.getAllowedARStates()]
+        infile = self._parser.getInputFile()
+        attachments = self._attachments
+        importedars = self._importedars
+        importedinsts = self._importedinsts
+
+        analyses = self._getZODBAnalyses(objid)
+        inst = None
+        if len(analyses) == 0 and self.instrument_uid:
+            # No registered analyses found, but maybe we need to
+            # create them first if an instruemnt id has been set in
+            insts = self.bsc(portal_type='Instrument',
+                             UID=self.instrument_uid)
+            if len(insts) == 0:
+                # No instrument found
+                self.warn("No Analysis Request with "
+                          "'${allowed_ar_states}' "
+                          "states found, And no QC"
+                          "analyses found for ${object_id}",
+                          mapping={"allowed_ar_states": ', '.join(
+                              allowed_ar_states_msg),
+                                  "object_id": objid})
+                self.warn("Instrument not found")
+                return
+
+            inst = insts[0].getObject()
+
+            # Create a new ReferenceAnalysis and link it to
+            # the Instrument
+            # Here we have an objid (i.e. R01200012) and
+            # a dict with results (the key is the AS keyword).
+            # How can we create a ReferenceAnalysis if we don't know
+            # which ReferenceSample we might use?
+            # Ok. The objid HAS to be the ReferenceSample code.
+            refsample = self.bc(portal_type='ReferenceSample',
+                                id=objid)
+            if refsample and len(refsample) == 1:
+                refsample = refsample[0].getObject()
+
+            elif refsample and len(refsample) > 1:
+                # More than one reference sample found!
+                self.warn(
+                    "More than one reference sample found for"
+                    "'${object_id}'",
+                    mapping={"object_id": objid})
+                return
+
+            else:
+                # No reference sample found!
+                self.warn("No Reference Sample found for ${object_id}",
+                          mapping={"object_id": objid})
+                return
+
+            # For each acode, create a ReferenceAnalysis and attach it
+            # to the Reference Sample
+            services = self.bsc(portal_type='AnalysisService',
+                                getKeyword=result.keys())
+            service_uids = [service.UID for service in services]
+            analyses = inst.addReferences(refsample, service_uids)
+
+        elif len(analyses) == 0:
+            # No analyses found
+            self.warn("No Analysis Request with "
+                      "'${allowed_ar_states}' "
+                      "states neither QC analyses found "
+                      "for ${object_id}",
+                      mapping={
+                         "allowed_ar_states": ', '.join(
+                             allowed_ar_states_msg),
+                         "object_id": objid})
+            return
+
+        # Look for timestamp
+        capturedate = result.get('DateTime', {}).get('DateTime', None)
+        if capturedate:
+            del result['DateTime']
+        for acode, values in result.iteritems():
+            if not self._keywords.get(acode):
+                # Analysis keyword doesn't exist
+                continue
+
+            ans = [analysis for analysis in analyses
+                   if analysis.getKeyword() == acode]
+
+            if len(ans) > 1:
+                self.warn("More than one analysis found for "
+                          "${object_id} and ${analysis_keyword}",
+                          mapping={"object_id": objid,
+                                   "analysis_keyword": acode})
+                continue
+
+            elif len(ans) == 0:
+                self.warn("No analyses found for ${object_id} "
+                          "and ${analysis_keyword}",
+                          mapping={"object_id": objid,
+                                   "analysis_keyword": acode})
+                continue
+
+            analysis = ans[0]
+
+            # Create attachment in worksheet linked to this analysis.
+            # Only if this import has not already created the
+            # attachment
+            # And only if the filename of the attachment is unique in
+            # this worksheet.  Otherwise we will attempt to use
+            # existing attachment.
+            wss = analysis.getBackReferences('WorksheetAnalysis')
+            ws = wss[0] if wss else None
+            if ws:
+                if ws.getId() not in attachments:
+                    fn = infile.filename
+                    fn_attachments = self.get_attachment_filenames(ws)
+                    if fn in fn_attachments:
+                        attachments[ws.getId()] = fn_attachments[fn]
+                    else:
+                        attachments[ws.getId()] = \
+                            self.create_attachment(ws, infile)
+
+            if capturedate:
+                values['DateTime'] = capturedate
+            processed = self._process_analysis(objid, analysis, values)
+            if processed:
+                self._ancount += 1
+                if inst:
+                    # Calibration Test (import to Instrument)
+                    importedinst = inst.title in importedinsts.keys() \
+                        and importedinsts[inst.title] or []
+                    if acode not in importedinst:
+                        importedinst.append(acode)
+                    importedinsts[inst.title] = importedinst
+                else:
+                    ar = analysis.portal_type == 'Analysis' \
+                        and analysis.aq_parent or None
+                    if ar and ar.UID:
+                        importedar = ar.getId() in importedars.keys() \
+                                    and importedars[ar.getId()] or []
+                        if acode not in importedar:
+                            importedar.append(acode)
+                        importedars[ar.getId()] = importedar
+
+                if ws:
+                    self.attach_attachment(
+                        analysis, attachments[ws.getId()])
+                else:
+                    self.warn(
+                        "Attachment cannot be linked to analysis as "
+                        "it is not assigned to a worksheet (%s)" %
+                        analysis)
 
     def create_mime_attachmenttype(self):
         # Create the AttachmentType for mime type if not exists
@@ -720,42 +815,87 @@ class AnalysisResultsImporter(Logger):
             self._priorizedsearchcriteria = criteria
         return obj
 
+    def _resolveObjects(self, objids):
+        """ Resolves the analyses of all the object ids from the results file
+            at once. The Analysis Requests are searched with one query per
+            search criteria (getId, getSampleID, getClientSampleID and UID)
+            for all the object ids that are not resolved yet, and their
+            analyses in allowed states with a single query afterwards.
+            Object ids without Analysis Request are looked up in the
+            reference analyses when processed.
+        """
+        self._ar_analyses = {}
+        self._analyses = {}
+        pending = set(filter(None, objids))
+        allowed_ar_states = self.getAllowedARStates()
+
+        # Analysis Request ID -> object ids
+        ars = {}
+        for index in ['getId', 'getSampleID', 'getClientSampleID', 'UID']:
+            if not pending:
+                break
+            query = {index: list(pending), 'review_state': allowed_ar_states}
+            matches = {}
+            for brain in self.ar_catalog(query):
+                matches.setdefault(getattr(brain, index), []).append(brain)
+            for objid, brains in matches.items():
+                if objid not in pending:
+                    continue
+                pending.discard(objid)
+                self._ar_analyses[objid] = []
+                if len(brains) > 1:
+                    self.err("More than one Analysis Request found for "
+                             "${object_id}", mapping={"object_id": objid})
+                    continue
+                ars.setdefault(brains[0].getId, []).append(objid)
+
+        if not ars:
+            return
+
+        # Fetch the analyses in allowed states of all Analysis Requests
+        query = dict(portal_type='Analysis',
+                     getRequestID=ars.keys(),
+                     review_state=self.getAllowedAnalysisStates(),
+                     sort_on='getKeyword')
+        for brain in self.bac(query):
+            for objid in ars.get(brain.getRequestID, []):
+                self._ar_analyses[objid].append(brain)
+
     def _getZODBAnalyses(self, objid):
         """ Searches for analyses from ZODB to be filled with results.
             objid can be either AR ID or Worksheet's Reference Sample IDs.
-            It uses the getIdSearchCriteria() for searches
+            The analyses of Analysis Requests are resolved in bulk by
+            _resolveObjects() beforehand, the remaining object ids are
+            searched in the reference analyses.
             Only analyses that matches with getAnallowedAnalysisStates() will
             be returned. If not a ReferenceAnalysis, getAllowedARStates() is
             also checked.
             Returns empty array if no analyses found
         """
-        # ars = []
-        analyses = []
-        # HACK: Use always the full search workflow
-        # searchcriteria = self.getIdSearchCriteria()
-        searchcriteria = ['getId', 'getSampleID', 'getClientSampleID']
-        allowed_ar_states = self.getAllowedARStates()
         allowed_an_states = self.getAllowedAnalysisStates()
-        # allowed_ar_states_msg = [_(s) for s in allowed_ar_states]
+        if objid in self._analyses:
+            # Analyses might have been transitioned since they were cached,
+            # e.g. submitted after a previous record of the same object
+            analyses = filter(
+                lambda an: api.get_workflow_status_of(an) in allowed_an_states,
+                self._analyses[objid])
+            self._analyses[objid] = analyses
+            return analyses
+
+        analyses = []
         allowed_an_states_msg = [_(s) for s in allowed_an_states]
 
-        # Acceleration of searches using priorization
-        if self._priorizedsearchcriteria in ['rgid', 'rid', 'ruid']:
-            # Look from reference analyses
-            analyses = self._getZODBAnalysesFromReferenceAnalyses(
-                    objid, self._priorizedsearchcriteria)
-        if len(analyses) == 0:
-            # Look from ar and derived
-            analyses = self._getZODBAnalysesFromAR(objid,
-                                                   '',
-                                                   searchcriteria,
-                                                   allowed_ar_states)
-
-        # Discard analyses that don't match with allowed_an_states
-        analyses = [analysis for analysis in analyses
-                    if analysis.portal_type != 'Analysis' or
-                    self.wf.getInfoFor(analysis, 'review_state')
-                    in allowed_an_states]
+        if objid in self._ar_analyses:
+            analyses = [api.get_object(brain)
+                        for brain in self._ar_analyses[objid]]
+        else:
+            # Acceleration of searches using priorization
+            if self._priorizedsearchcriteria in ['rgid', 'rid', 'ruid']:
+                analyses = self._getZODBAnalysesFromReferenceAnalyses(
+                        objid, self._priorizedsearchcriteria)
+            if len(analyses) == 0:
+                analyses = self._getZODBAnalysesFromReferenceAnalyses(
+                        objid, None)
 
         if len(analyses) == 0:
             self.warn(
@@ -765,40 +905,8 @@ class AnalysisResultsImporter(Logger):
                     allowed_an_states_msg),
                          "object_id": objid})
 
-        return analyses
-
-    def _getZODBAnalysesFromAR(self, objid, criteria,
-                               allowedsearches, arstates):
-        ars = []
-        analyses = []
-        if criteria:
-            ars = self._getObjects(objid, criteria, arstates)
-            if not ars or len(ars) == 0:
-                return self._getZODBAnalysesFromAR(objid, None,
-                                                   allowedsearches, arstates)
         else:
-            sortorder = ['arid', 'sid', 'csid', 'aruid']
-            for crit in sortorder:
-                if (crit == 'arid' and 'getId' in allowedsearches) \
-                    or (crit == 'sid' and 'getSampleID' in allowedsearches) \
-                    or (crit == 'csid' and 'getClientSampleID'
-                                in allowedsearches) \
-                        or (crit == 'aruid' and 'getId' in allowedsearches):
-                    ars = self._getObjects(objid, crit, arstates)
-                    if ars and len(ars) > 0:
-                        break
-
-        if not ars or len(ars) == 0:
-            return self._getZODBAnalysesFromReferenceAnalyses(objid, None)
-
-        elif len(ars) > 1:
-            self.err("More than one Analysis Request found for ${object_id}",
-                     mapping={"object_id": objid})
-            return []
-
-        ar = ars[0].getObject()
-        analyses = [analysis.getObject() for analysis in ar.getAnalyses()]
-
+            self._analyses[objid] = analyses
         return analyses
 
     def _getZODBAnalysesFromReferenceAnalyses(self, objid, criteria):
@@ -860,32 +968,35 @@ class AnalysisResultsImporter(Logger):
         :param analysis: Analysis Object
         """
         analyses = self._getZODBAnalyses(objid)
-        # Filter Analyses With Calculation
-        analyses_with_calculation = filter(
-                                        lambda an: an.getCalculation(),
-                                        analyses)
-        for analysis_with_calc in analyses_with_calculation:
-            # Get the calculation to get the formula so that we can check
-            # if param analysis keyword is used on the calculation formula
-            calcultion = analysis_with_calc.getCalculation()
-            formula = calcultion.getMinifiedFormula()
-            # The analysis that we are currenly on
-            analysis_keyword = analysis.getKeyword()
-            if analysis_keyword not in formula:
+        # The analysis that we are currenly on
+        analysis_keyword = analysis.getKeyword()
+
+        # Calculated analyses with the analysis keyword used in the formula,
+        # it means that they are dependent on the analysis given
+        dependents = []
+        for analysis_with_calc in analyses:
+            calculation = analysis_with_calc.getCalculation()
+            if not calculation:
                 continue
-
-            # If the analysis_keyword is in the formula, it means that this
-            # analysis is a dependent on that calculated analysis
-            calc_passed = analysis_with_calc.calculateResult(override=self._override[1])
-            if calc_passed:
-                api.do_transition_for(analysis_with_calc, "submit")
-                self.log(
-                    "${request_id}: calculated result for "
-                    "'${analysis_keyword}': '${analysis_result}'",
-                    mapping={"request_id": objid,
-                             "analysis_keyword": analysis_with_calc.getKeyword(),
-                             "analysis_result": str(analysis_with_calc.getResult())}
-                )
+            if analysis_keyword in calculation.getMinifiedFormula():
+                dependents.append(analysis_with_calc)
+        if not dependents:
+            return
+
+        # Calculate the dependents in dependency order in a single pass.
+        # Other analyses without result are neither calculated nor submitted
+        calculated = calculate_results(dependents,
+                                       override=self._override[1],
+                                       cascade=False)
+        for analysis_with_calc in calculated:
+            api.do_transition_for(analysis_with_calc, "submit")
+            self.log(
+                "${request_id}: calculated result for "
+                "'${analysis_keyword}': '${analysis_result}'",
+                mapping={"request_id": objid,
+                         "analysis_keyword": analysis_with_calc.getKeyword(),
+                         "analysis_result": str(analysis_with_calc.getResult())}
+            )
 
 
     def _process_analysis(self, objid, analysis, values):
@@ -15,6 +15,9 @@ from datetime import datetime
 
 class TimaCSVParser(InstrumentCSVResultsFileParser):
 
+    # Each line is a single record, so the file can be parsed incrementally
+    streaming = True
+
     def __init__(self, csv):
         InstrumentCSVResultsFileParser.__init__(self, csv)
         self._columns = []
@@ -9,6 +9,8 @@ import urllib
 
 import transaction
 import zLOG
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from DateTime import DateTime
 from Products.ATContentTypes.utils import DT2dt
 from bika.lims import api
@@ -18,14 +20,45 @@ from bika.lims.browser.fields.uidreferencefield \
     import get_backreferences as get_backuidreferences
 from bika.lims.interfaces import IIdServer
 from bika.lims.numbergenerator import INumberGenerator
+from bika.lims.numbergenerator import get_portal_annotation
+from persistent import Persistent
 from zope.component import getAdapters
 from zope.component import getUtility
 
+# Annotation key of the persistent ID index. The index keeps track of the IDs
+# assigned by the ID server and of the highest sequence number per number
+# generator key, so that neither the seeding of the number generator nor the
+# check for duplicate IDs need to search the catalog
+ID_INDEX_STORAGE = "bika.lims.idserver.id_index"
+
+# Number of objects woken up between commits while rebuilding the ID index
+REBUILD_BATCH_SIZE = 1000
+
 
 class IDServerUnavailable(Exception):
     pass
 
 
+class SequenceNumber(Persistent):
+    """Highest sequence number of a single number generator key
+
+    Every key has its own persistent object, so objects created concurrently
+    with the same prefix only write this record, and the conflict is resolved
+    by keeping the highest number.
+    """
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def _p_resolveConflict(self, old_state, saved_state, new_state):
+        """Resolve conflicting writes by keeping the highest number
+        """
+        state = dict(new_state)
+        state["value"] = max(saved_state.get("value", 0),
+                             new_state.get("value", 0))
+        return state
+
+
 def idserver_generate_id(context, prefix, batch_size=None):
     """ Generate a new id using external ID server.
     """
@@ -234,6 +267,216 @@ def get_ids_with_prefix(portal_type, prefix):
     return ids
 
 
+def get_id_index(create=False):
+    """Returns the persistent ID index
+
+    The index is a BTree with the following keys:
+
+        - sequences: number generator key -> highest sequence number, see
+          `SequenceNumber`
+        - ids: ID -> portal type of all the IDs assigned by the ID server
+        - portal_types: portal types whose IDs are all in the index
+
+    :param create: Create the index storage if it does not exist yet
+    :returns: ID index storage or None
+    """
+    annotation = get_portal_annotation()
+    storage = annotation.get(ID_INDEX_STORAGE)
+    if storage is None and create:
+        storage = OOBTree()
+        storage["sequences"] = OOBTree()
+        storage["ids"] = OOBTree()
+        storage["portal_types"] = OOTreeSet()
+        annotation[ID_INDEX_STORAGE] = storage
+    return storage
+
+
+def flush_id_index():
+    """Removes the ID index storage
+    """
+    annotation = get_portal_annotation()
+    if annotation.get(ID_INDEX_STORAGE) is not None:
+        del annotation[ID_INDEX_STORAGE]
+
+
+def index_id(id, portal_type, key=None, seq=0):
+    """Registers the ID in the ID index
+
+    :param id: The ID to register
+    :param portal_type: The portal type of the object with the given ID
+    :param key: The number generator key of the ID sequence (if any)
+    :param seq: The sequence number of the ID
+    """
+    index = get_id_index(create=True)
+    index["ids"][id] = portal_type
+    if key is None:
+        return
+    sequences = index["sequences"]
+    number = sequences.get(key)
+    if number is None:
+        sequences[key] = SequenceNumber(seq)
+    elif seq > number.value:
+        number.value = seq
+
+
+def get_indexed_seq_number(key):
+    """Returns the highest sequence number of the key in the ID index
+
+    :param key: The number generator key of the ID sequence
+    :returns: The highest sequence number or 0
+    """
+    index = get_id_index()
+    if index is None:
+        return 0
+    number = index["sequences"].get(key)
+    return number and number.value or 0
+
+
+def unindex_id(id):
+    """Removes the ID from the ID index
+
+    N.B. The highest sequence number of the ID sequence is kept, so that the
+         sequence numbers of removed objects are not reused
+
+    :param id: The ID to remove
+    """
+    index = get_id_index()
+    if index is None:
+        return
+    if id in index["ids"]:
+        del index["ids"][id]
+
+
+def is_id_indexed(id):
+    """Checks if the ID was already assigned by the ID server
+
+    :param id: The ID to check
+    :returns: True if the ID is registered in the ID index
+    """
+    index = get_id_index()
+    if index is None:
+        return False
+    return id in index["ids"]
+
+
+def get_max_seq_number(portal_type, prefix, id_template, **kw):
+    """Returns the highest sequence number of the existing IDs with the given
+    portal type and prefix
+
+    The number is looked up in the ID index. Only if the IDs of the portal type
+    are not indexed yet, the catalog is searched for IDs with the same prefix.
+    """
+    index = get_id_index()
+    if index is not None and portal_type in index["portal_types"]:
+        key = make_storage_key(portal_type, prefix)
+        return get_indexed_seq_number(key)
+
+    existing = get_ids_with_prefix(portal_type, prefix)
+    numbers = map(lambda id: get_seq_number_from_id(
+        id, id_template, prefix, **kw), existing)
+    if not numbers:
+        return 0
+    return max(numbers)
+
+
+def get_generated_prefix(config, variables, **kw):
+    """Returns the normalized static part (prefix) of generated IDs
+    """
+    # separator where to split the ID
+    separator = kw.get('separator', '-')
+
+    # The ID format for string interpolation, e.g. WS-{seq:03d}
+    id_template = config.get("form", "")
+
+    # The split length defines where the variable part of the ID template begins
+    split_length = config.get("split_length", 1)
+
+    # The prefix tempalte is the static part of the ID
+    prefix_template = slice(id_template, separator=separator, end=split_length)
+
+    # generate the key for the number generator storage
+    prefix = prefix_template.format(**variables)
+
+    # normalize out any unicode characters like Ö, É, etc. from the prefix
+    return api.normalize_filename(prefix)
+
+
+def index_object_id(obj, **kw):
+    """Registers the ID of the given object in the ID index
+    """
+    obj_id = api.get_id(obj)
+
+    # allow portal_type override
+    portal_type = kw.get("portal_type") or api.get_portal_type(obj)
+
+    key = None
+    seq = 0
+    config = get_config(obj, portal_type=portal_type)
+    if config.get("sequence_type", "generated") == "generated":
+        variables = get_variables(obj, portal_type=portal_type)
+        prefix = get_generated_prefix(config, variables, **kw)
+        if obj_id.startswith(prefix):
+            key = make_storage_key(portal_type, prefix)
+            seq = get_seq_number_from_id(
+                obj_id, config.get("form", ""), prefix, **kw)
+
+    index_id(obj_id, portal_type, key=key, seq=seq)
+
+
+def get_id_index_portal_types():
+    """Returns the portal types with an ID formatting config in the setup
+    """
+    config_map = api.get_bika_setup().getIDFormatting()
+    return map(lambda config: config["portal_type"], config_map)
+
+
+def rebuild_id_index(portal_types=None, **kw):
+    """Rebuilds the ID index from the IDs in the UID catalog
+
+    The sequence number keys of generated IDs are computed from the objects
+    like when the IDs are generated, see `index_object_id`, so the objects are
+    woken up and the transaction is committed every `REBUILD_BATCH_SIZE`
+    objects. The IDs of other sequence types are indexed from the catalog.
+
+    :param portal_types: The portal types to index. Defaults to the portal
+                         types with an ID formatting config
+    :returns: The number of indexed IDs
+    """
+    if portal_types is None:
+        portal_types = get_id_index_portal_types()
+
+    flush_id_index()
+    index = get_id_index(create=True)
+    catalog = api.get_tool("uid_catalog")
+
+    indexed = 0
+    for portal_type in portal_types:
+        config = get_config(None, portal_type=portal_type)
+        generated = config.get("sequence_type", "generated") == "generated"
+
+        brains = catalog({"portal_type": portal_type})
+        total = len(brains)
+        logger.info("Rebuilding ID index for {} {} objects ..."
+                    .format(total, portal_type))
+        for num, brain in enumerate(brains):
+            if not generated:
+                index_id(api.get_id(brain), portal_type)
+                indexed += 1
+                continue
+            if num and num % REBUILD_BATCH_SIZE == 0:
+                logger.info("Rebuilding ID index for {}: {}/{}"
+                            .format(portal_type, num, total))
+                transaction.commit()
+                api.get_portal()._p_jar.cacheGC()
+            obj = brain._unrestrictedGetObject()
+            index_object_id(obj, portal_type=portal_type, **kw)
+            indexed += 1
+        index["portal_types"].insert(portal_type)
+
+    logger.info("Rebuilt ID index with {} IDs".format(indexed))
+    return indexed
+
+
 def make_storage_key(portal_type, prefix=None):
     """Make a storage (dict-) key for the number generator
     """
@@ -287,41 +530,25 @@ def get_generated_number(context, config, variables, **kw):
     sequence type "Generated"
     """
 
-    # separator where to split the ID
-    separator = kw.get('separator', '-')
-
     # allow portal_type override
     portal_type = kw.get("portal_type") or api.get_portal_type(context)
 
     # The ID format for string interpolation, e.g. WS-{seq:03d}
     id_template = config.get("form", "")
 
-    # The split length defines where the variable part of the ID template begins
-    split_length = config.get("split_length", 1)
-
-    # The prefix tempalte is the static part of the ID
-    prefix_template = slice(id_template, separator=separator, end=split_length)
-
     # get the number generator
     number_generator = getUtility(INumberGenerator)
 
-    # generate the key for the number generator storage
-    prefix = prefix_template.format(**variables)
-
-    # normalize out any unicode characters like Ö, É, etc. from the prefix
-    prefix = api.normalize_filename(prefix)
+    # The static part of the ID
+    prefix = get_generated_prefix(config, variables, **kw)
 
     # The key used for the storage
     key = make_storage_key(portal_type, prefix)
 
     # Handle flushed storage
     if key not in number_generator:
-        max_num = 0
-        existing = get_ids_with_prefix(portal_type, prefix)
-        numbers = map(lambda id: get_seq_number_from_id(id, id_template, prefix), existing)
         # figure out the highest number in the sequence
-        if numbers:
-            max_num = max(numbers)
+        max_num = get_max_seq_number(portal_type, prefix, id_template, **kw)
         # set the number generator
         logger.info("*** SEEDING Prefix '{}' to {}".format(prefix, max_num))
         number_generator.set_number(key, max_num)
@@ -406,17 +633,17 @@ def renameAfterCreation(obj):
     if not new_id:
         new_id = generateUniqueId(obj)
 
-    # TODO: This is a naive check just in current folder
-    # -> this should check globally for duplicate objects with same prefix
-    # N.B. a check like `search_by_prefix` each time would probably slow things
-    # down too much!
-    # -> A solution could be to store all IDs with a certain prefix in a storage
+    # Check globally for duplicate IDs with the ID index and in the current
+    # folder for IDs not assigned by the ID server
     parent = api.get_parent(obj)
-    if new_id in parent.objectIds():
+    if is_id_indexed(new_id) or new_id in parent.objectIds():
         # XXX We could do the check in a `while` loop and generate a new one.
         raise KeyError("The ID {} is already taken in the path {}".format(
             new_id, api.get_path(parent)))
     # rename the object to the new id
     parent.manage_renameObject(obj.id, new_id)
 
+    # keep the ID index up to date
+    index_object_id(obj)
+
     return new_id
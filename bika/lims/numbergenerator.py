@@ -7,16 +7,17 @@
 
 import thread
 import logging
-import datetime
+import transaction
+from collections import deque
 from bika.lims.interfaces import INumberGenerator
-from BTrees.OIBTree import OIBTree
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
 from plone import api
+from ZODB.POSException import ConflictError
 from zope.annotation.interfaces import IAnnotations
-from zope.component import getGlobalSiteManager
 from zope.interface import implements
 
 
-
 lock = thread.allocate_lock()
 
 logger = logging.getLogger("bika.lims.idserver")
@@ -24,8 +25,19 @@ logger = logging.getLogger("bika.lims.idserver")
 STORAGE_KEY  = "bika.lims.numbercounter"
 STORAGE_HASH = "bika.lims.numbercounter.hash"
 
+# BBB: Storage of all counters in a single OIBTree. Migrated on first access
 NUMBER_STORAGE = "bika.lims.consecutive_numbers_storage"
 
+# Storage of the counters: key -> NumberCounter
+COUNTER_STORAGE = "bika.lims.consecutive_numbers_counters"
+
+# Number of attempts to reserve a block of numbers on write conflicts
+RESERVE_ATTEMPTS = 10
+
+# Process local pools of reserved numbers
+# {(database name, storage oid, key): deque of numbers}
+_reserved = {}
+
 
 def get_storage_location():
     """ get the portal with the plone.api
@@ -41,6 +53,29 @@ def get_portal_annotation():
     return IAnnotations(get_storage_location())
 
 
+class NumberCounter(Persistent):
+    """Persistent counter of a single key
+
+    Every key has its own persistent counter object, so concurrent transactions
+    only write the same database record if they generate numbers for the same
+    key.
+    """
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def _p_resolveConflict(self, old_state, saved_state, new_state):
+        """Resolve conflicting writes of the counter
+
+        Concurrent increments are not merged like `BTrees.Length` does, because
+        both transactions handed out the same number. Only writes that set the
+        counter to the same value, e.g. concurrent seeding, are resolved.
+        """
+        if saved_state == new_state:
+            return saved_state
+        raise ConflictError
+
+
 class NumberGenerator(object):
     """ perisistent consecutive numbers
     """
@@ -51,14 +86,24 @@ class NumberGenerator(object):
         """ get the counter storage
         """
         annotation = get_portal_annotation()
-        if annotation.get(NUMBER_STORAGE) is None:
-            annotation[NUMBER_STORAGE]  = OIBTree()
-        return annotation[NUMBER_STORAGE]
+        if annotation.get(COUNTER_STORAGE) is None:
+            counters = OOBTree()
+            # Migrate the numbers of the former single OIBTree storage
+            legacy = annotation.get(NUMBER_STORAGE)
+            if legacy is not None:
+                for key, value in legacy.items():
+                    counters[key] = NumberCounter(value)
+                del annotation[NUMBER_STORAGE]
+            annotation[COUNTER_STORAGE] = counters
+        return annotation[COUNTER_STORAGE]
 
     def flush(self):
         """ delete all annotation storages
         """
         annotations = get_portal_annotation()
+        if annotations.get(COUNTER_STORAGE) is not None:
+            self.release_numbers()
+            del annotations[COUNTER_STORAGE]
         if annotations.get(NUMBER_STORAGE) is not None:
             del annotations[NUMBER_STORAGE]
 
@@ -70,64 +115,185 @@ class NumberGenerator(object):
 
     def values(self):
         out = []
-        for value in self.storage.values():
-            out.append(value)
+        for counter in self.storage.values():
+            out.append(counter.value)
         return out
 
     def __iter__(self):
         return self.storage.__iter__()
 
+    def __contains__(self, key):
+        return key in self.storage
+
     def __getitem__(self, key):
-        return self.storage.__getitem__(key)
+        return self.storage.__getitem__(key).value
+
+    def __delitem__(self, key):
+        self.release_numbers(key)
+        self.storage.__delitem__(key)
 
     def get(self, key, default=None):
-        return self.storage.get(key, default)
+        counter = self.storage.get(key)
+        if counter is None:
+            return default
+        return counter.value
 
-    def get_number(self, key):
-        """ get the next consecutive number
+    def get_counter(self, key):
+        """ get the persistent counter of the key
         """
         storage = self.storage
+        counter = storage.get(key)
+        if counter is None:
+            counter = NumberCounter()
+            storage[key] = counter
+        return counter
 
-        logger.debug("NUMBER before => %s" % storage.get(key, '-'))
-        try:
-            logger.debug("*** consecutive number lock acquire ***")
-            lock.acquire()
-            try:
-                counter = storage[key]
-                storage[key] = counter + 1
-            except KeyError:
-                storage[key] = 1
-        finally:
-            logger.debug("*** consecutive number lock release ***")
-            self.storage._p_changed = True
-            lock.release()
+    def get_number(self, key):
+        """ get the next consecutive number
+        """
+        # Use the numbers reserved by this process first
+        number = self.pop_reserved_number(key)
+        if number is not None:
+            logger.debug("NUMBER reserved => %s" % number)
+            return number
 
-        logger.debug("NUMBER after => %s" % storage.get(key, '-'))
-        return storage[key]
+        counter = self.get_counter(key)
+        logger.debug("NUMBER before => %s" % counter.value)
+        counter.value += 1
+        logger.debug("NUMBER after => %s" % counter.value)
+        return counter.value
 
     def set_number(self, key, value):
         """ set a key's value
         """
-        storage = self.storage
-
         if not isinstance(value, int):
             logger.error("set_number: Value must be an integer")
             return
 
+        self.release_numbers(key)
+        counter = self.get_counter(key)
+        counter.value = value
+        return counter.value
+
+    def generate_number(self, key="default"):
+        """ get a number
+        """
+        return self.get_number(key)
+
+    def reserve_numbers(self, key, size):
+        """Reserve a block of consecutive numbers for bulk creation
+
+        The counter is incremented by `size` in a separate transaction that is
+        committed right away. The reserved numbers are handed out by
+        `generate_number` of this process afterwards, so the transactions that
+        create the objects do not write the counter and do not conflict with
+        other ZEO clients. Reserved numbers that are not used leave a gap.
+
+        If the counter of the key was not committed yet, no numbers are
+        reserved and `generate_number` increments the counter as usual.
+
+        :param key: The key of the counter
+        :param size: Number of numbers to reserve
+        :returns: List of the reserved numbers
+        """
+        if size < 1:
+            return []
+
+        numbers = self._reserve_block(key, size)
+        if numbers is None:
+            logger.info("Counter '{}' not committed yet, no numbers reserved"
+                        .format(key))
+            return []
+
+        lock.acquire()
         try:
-            lock.acquire()
-            storage[key] = value
+            pool_key = self._get_pool_key(key)
+            _reserved.setdefault(pool_key, deque()).extend(numbers)
         finally:
-            self.storage._p_changed = True
             lock.release()
 
-        return storage[key]
+        return numbers
 
+    def pop_reserved_number(self, key):
+        """Returns the next number reserved by this process or None
+        """
+        lock.acquire()
+        try:
+            pool_key = self._get_pool_key(key)
+            pool = _reserved.get(pool_key)
+            if not pool:
+                return None
+            number = pool.popleft()
+            if not pool:
+                del _reserved[pool_key]
+            return number
+        finally:
+            lock.release()
 
-    def generate_number(self, key="default"):
-        """ get a number
+    def count_reserved_numbers(self, key):
+        """Returns the number of numbers reserved by this process for the key
         """
-        return self.get_number(key)
+        lock.acquire()
+        try:
+            return len(_reserved.get(self._get_pool_key(key), []))
+        finally:
+            lock.release()
+
+    def release_numbers(self, key=None):
+        """Discard the numbers reserved by this process
+
+        :param key: The key of the counter. All keys if None
+        """
+        lock.acquire()
+        try:
+            if key is not None:
+                _reserved.pop(self._get_pool_key(key), None)
+                return
+            base = self._get_pool_key(None)[:2]
+            for pool_key in _reserved.keys():
+                if pool_key[:2] == base:
+                    del _reserved[pool_key]
+        finally:
+            lock.release()
+
+    def _get_pool_key(self, key):
+        """Returns the key of the process local pool of reserved numbers
+        """
+        storage = self.storage
+        jar = storage._p_jar
+        database = jar.db().database_name if jar is not None else None
+        return (database, storage._p_oid, key)
+
+    def _reserve_block(self, key, size):
+        """Increment the committed counter of the key in a separate transaction
+
+        :returns: List of reserved numbers or None if the counter of the key
+                  is not committed yet or was modified in this transaction
+        """
+        counter = self.storage.get(key)
+        if counter is None or counter._p_oid is None or counter._p_changed:
+            return None
+
+        db = counter._p_jar.db()
+        tm = transaction.TransactionManager()
+        connection = db.open(transaction_manager=tm)
+        try:
+            for attempt in range(RESERVE_ATTEMPTS):
+                try:
+                    tm.begin()
+                    committed = connection.get(counter._p_oid)
+                    start = committed.value + 1
+                    committed.value += size
+                    tm.commit()
+                    return range(start, start + size)
+                except ConflictError:
+                    tm.abort()
+                    logger.info("Conflict reserving {} numbers for '{}' "
+                                "(attempt {})".format(size, key, attempt + 1))
+            raise ConflictError(
+                "Could not reserve {} numbers for '{}'".format(size, key))
+        finally:
+            connection.close()
 
     def __call__(self, key="default"):
         return self.generate_number(key)
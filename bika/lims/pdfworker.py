@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Renders a PDF with WeasyPrint in a clean interpreter
+
+`bika.lims.utils.createPdfs` runs this script with the Python interpreter of
+the instance, so the Zope process is never forked. It reads the pickled
+(HTML report, prefetched resources) tuple from stdin and writes the PDF data
+to stdout. Only the standard library and WeasyPrint are imported.
+
+Usage:
+
+    python pdfworker.py < task.pickle > report.pdf
+"""
+
+import cPickle
+import sys
+
+from weasyprint import HTML
+from weasyprint import default_url_fetcher
+
+
+def render(htmlreport, resources):
+    """Returns the PDF data of the HTML report
+
+    :param htmlreport: Rendered HTML report as UTF-8 string
+    :param resources: Dictionary of URL -> data as returned by the URL
+                      fetcher, for the resources referenced in the report
+    """
+
+    def url_fetcher(url):
+        if url in resources:
+            return resources[url]
+        return default_url_fetcher(url)
+
+    renderer = HTML(string=htmlreport, url_fetcher=url_fetcher,
+                    encoding='utf-8')
+    return renderer.write_pdf()
+
+
+def main():
+    htmlreport, resources = cPickle.load(sys.stdin)
+    sys.stdout.write(render(htmlreport, resources))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
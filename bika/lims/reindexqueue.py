@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Deferred reindexing of objects
+
+Objects queued for reindexing are reindexed once, right before the current
+transaction is committed. Multiple reindex requests of the same object are
+merged and their index names united, so an Analysis Request whose analyses
+are transitioned one after another is only reindexed once.
+
+The reindex of objects that support it (see `is_reindex_deferred`) can also be
+deferred for a whole block of code with `deferred_reindex`, e.g. while
+creating Analysis Requests in bulk.
+"""
+
+import threading
+from contextlib import contextmanager
+
+import transaction
+from Acquisition import aq_base
+from Acquisition import aq_parent
+from bika.lims import logger
+
+_local = threading.local()
+
+# Process wide counters of the reindex queue
+_counters = {
+    "queued": 0,
+    "reindexed": 0,
+    "skipped": 0,
+}
+
+
+class ReindexQueue(object):
+    """Objects to reindex in a transaction with the indexes to update
+    """
+
+    def __init__(self):
+        # id of the object -> (object, set of index names or None for all)
+        self.objects = {}
+        # keep the insertion order, so objects are reindexed in the same
+        # order they were queued
+        self.order = []
+        self.queued = 0
+
+    def add(self, obj, idxs=None):
+        key = id(aq_base(obj))
+        self.queued += 1
+        if key not in self.objects:
+            self.order.append(key)
+            self.objects[key] = (obj, idxs and set(idxs) or None)
+            return
+        queued_obj, queued_idxs = self.objects[key]
+        if queued_idxs is not None and idxs:
+            queued_idxs.update(idxs)
+        else:
+            self.objects[key] = (queued_obj, None)
+
+    def __len__(self):
+        return len(self.order)
+
+    def flush(self):
+        """Reindexes the queued objects
+        """
+        reindexed = 0
+        skipped = 0
+        while self.order:
+            key = self.order.pop(0)
+            obj, idxs = self.objects.pop(key)
+            if not is_contained(obj):
+                # Removed after it was queued
+                skipped += 1
+                continue
+            if idxs is None:
+                obj.reindexObject()
+            else:
+                obj.reindexObject(idxs=sorted(idxs))
+            reindexed += 1
+
+        _counters["queued"] += self.queued
+        _counters["reindexed"] += reindexed
+        _counters["skipped"] += skipped
+        if self.queued:
+            logger.debug("Reindex queue: {} reindex requests merged into {} "
+                         "reindexes ({} avoided)".format(
+                             self.queued, reindexed, self.queued - reindexed))
+        self.queued = 0
+        return reindexed
+
+
+def is_contained(obj):
+    """Checks if the object is still contained in its parent
+    """
+    parent = aq_parent(obj)
+    if parent is None:
+        return False
+    contained = getattr(aq_base(parent), "_getOb", None)
+    if contained is None:
+        return True
+    return aq_base(parent._getOb(obj.getId(), None)) is aq_base(obj)
+
+
+def get_reindex_queue():
+    """Returns the reindex queue of the current transaction
+    """
+    txn = transaction.get()
+    queue = getattr(_local, "queue", None)
+    if queue is None or getattr(_local, "transaction", None) is not txn:
+        queue = ReindexQueue()
+        _local.queue = queue
+        _local.transaction = txn
+        txn.addBeforeCommitHook(_flush_before_commit, (queue, ))
+    return queue
+
+
+def _flush_before_commit(queue):
+    queue.flush()
+
+
+def queue_reindex(obj, idxs=None):
+    """Queues the object to be reindexed before the transaction is committed
+
+    :param obj: The object to reindex
+    :param idxs: The names of the indexes to update. All indexes if None
+    """
+    get_reindex_queue().add(obj, idxs=idxs)
+
+
+def flush_reindex_queue():
+    """Reindexes the queued objects of the current transaction now, e.g. to
+    search for them in the catalogs before the transaction is committed
+
+    :returns: The number of reindexed objects
+    """
+    return get_reindex_queue().flush()
+
+
+@contextmanager
+def deferred_reindex():
+    """Context manager that defers the reindex of the objects that support it
+    until the end of the block, where all of them are reindexed in one pass.
+    Nested blocks are reindexed by the outermost one.
+
+    Objects support it by queueing themselves in `reindexObject` while
+    `is_reindex_deferred` returns True. New objects are still indexed right
+    away, so they can be searched by UID or path within the block.
+    """
+    depth = getattr(_local, "deferred", 0)
+    _local.deferred = depth + 1
+    try:
+        yield
+    finally:
+        _local.deferred = depth
+    if not depth:
+        flush_reindex_queue()
+
+
+def is_reindex_deferred():
+    """Checks if the reindex of the objects is deferred by `deferred_reindex`
+    """
+    return getattr(_local, "deferred", 0) > 0
+
+
+def get_reindex_counters():
+    """Returns the process wide counters of the reindex queue: the number of
+    queued reindex requests, the number of reindexed objects, the number of
+    skipped (removed) objects and the number of avoided reindexes
+    """
+    counters = dict(_counters)
+    counters["avoided"] = counters["queued"] - counters["reindexed"]
+    return counters
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Measures the cost of adding backreferences to a single target, as done by
+UIDReferenceFields, with the former list storage and with the BTree set
+storage. The backreferences are added to a temporary storage, nothing is
+committed.
+
+Usage:
+bin/instance run benchmark_backreferences.py <ploneSiteId> \
+    [<number of references>]
+"""
+
+import time
+import uuid
+from sys import argv
+
+import transaction
+from bika.lims.browser.fields.uidreferencefield import get_backreferences_set
+from persistent.dict import PersistentDict
+from persistent.list import PersistentList
+from zope.component.hooks import setSite
+
+site_id = argv[1]
+size = int(argv[2]) if len(argv) > 2 else 100000
+
+portal = app[site_id]
+setSite(portal)
+uids = [uuid.uuid4().hex for num in range(size)]
+
+
+def add_to_list(backrefs, uid):
+    if "benchmark" not in backrefs:
+        backrefs["benchmark"] = PersistentList()
+    if uid not in backrefs["benchmark"]:
+        backrefs["benchmark"].append(uid)
+
+
+def add_to_set(backrefs, uid):
+    get_backreferences_set(backrefs, "benchmark").insert(uid)
+
+
+def measure(title, add):
+    backrefs = PersistentDict()
+    # Store the backreferences in the database, so every savepoint writes the
+    # changed records like a commit would do
+    portal._benchmark_backreferences = backrefs
+    start = time.time()
+    for num, uid in enumerate(uids):
+        add(backrefs, uid)
+        if num % 1000 == 0:
+            transaction.savepoint(optimistic=True)
+    duration = time.time() - start
+    print("{:<12} {:>8.3f}s {:>10.3f}ms/reference".format(
+        title, duration, duration * 1000 / size))
+
+
+print("{} references".format(size))
+measure("List", add_to_list)
+measure("BTree set", add_to_set)
+transaction.abort()
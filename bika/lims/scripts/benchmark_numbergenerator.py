@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Measures the throughput of the number generator with concurrent workers.
+
+Every worker runs in its own thread with its own database connection and
+generates numbers in separate transactions, like concurrent requests of one or
+more ZEO clients would do. Conflicting transactions are retried.
+
+Usage:
+bin/instance run benchmark_numbergenerator.py <ploneSiteId> \
+    [<workers> [<numbers per worker> [<block size> [<keys>]]]]
+
+With a block size > 1, the workers reserve blocks of numbers in advance.
+With more than one key, the workers generate numbers for different keys.
+"""
+
+import threading
+import time
+from sys import argv
+
+import transaction
+from bika.lims.numbergenerator import NumberGenerator
+from ZODB.POSException import ConflictError
+from zope.component.hooks import setSite
+
+site_id = argv[1]
+workers = int(argv[2]) if len(argv) > 2 else 4
+numbers = int(argv[3]) if len(argv) > 3 else 100
+block_size = int(argv[4]) if len(argv) > 4 else 1
+keys = int(argv[5]) if len(argv) > 5 else 1
+
+db = app._p_jar.db()
+results = []
+
+
+def get_key(worker):
+    return "benchmark-{}".format(worker % keys)
+
+
+def worker(num):
+    tm = transaction.TransactionManager()
+    connection = db.open(transaction_manager=tm)
+    root = connection.root()["Application"]
+    setSite(root[site_id])
+    number_generator = NumberGenerator()
+    key = get_key(num)
+    generated = []
+    conflicts = 0
+    try:
+        while len(generated) < numbers:
+            try:
+                tm.begin()
+                if block_size > 1 and \
+                        not number_generator.count_reserved_numbers(key):
+                    number_generator.reserve_numbers(key, block_size)
+                    tm.abort()
+                    continue
+                number = number_generator.generate_number(key)
+                tm.commit()
+                generated.append(number)
+            except ConflictError:
+                tm.abort()
+                conflicts += 1
+    finally:
+        number_generator.release_numbers(key)
+        connection.close()
+    results.append((key, generated, conflicts))
+
+
+# Make sure the counters exist and are committed
+setSite(app[site_id])
+number_generator = NumberGenerator()
+for num in range(workers):
+    number_generator.set_number(get_key(num), 0)
+transaction.commit()
+
+threads = [threading.Thread(target=worker, args=(num, ))
+           for num in range(workers)]
+start = time.time()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+duration = time.time() - start
+
+total = sum([len(generated) for key, generated, conflicts in results])
+conflicts = sum([conflicts for key, generated, conflicts in results])
+duplicates = 0
+for num in range(keys):
+    key = "benchmark-{}".format(num)
+    generated = []
+    for result in results:
+        if result[0] == key:
+            generated.extend(result[1])
+    duplicates += len(generated) - len(set(generated))
+
+print("Workers: {} | Keys: {} | Block size: {}".format(
+    workers, keys, block_size))
+print("Generated {} numbers in {:.2f}s ({:.1f} numbers/s)".format(
+    total, duration, total / duration))
+print("Conflicts: {} | Duplicates: {}".format(conflicts, duplicates))
+
+# Remove the benchmark counters
+for num in range(keys):
+    key = "benchmark-{}".format(num)
+    if key in number_generator:
+        del number_generator[key]
+transaction.commit()
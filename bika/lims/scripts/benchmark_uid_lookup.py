@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Measures the cost per UID of looking up objects by UID: one by one without
+the request cache (as before), in bulk with `get_objects_by_uids` and one by
+one again with the request cache filled.
+
+Usage:
+bin/instance run benchmark_uid_lookup.py <ploneSiteId> \
+    [<number of UIDs> [<portal_type>]]
+"""
+
+import time
+from sys import argv
+
+from bika.lims import api
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+from zope.globalrequest import setRequest
+
+site_id = argv[1]
+size = int(argv[2]) if len(argv) > 2 else 1000
+portal_type = argv[3] if len(argv) > 3 else "Analysis"
+
+setSite(app[site_id])
+uc = api.get_tool("uid_catalog")
+uids = [brain.UID for brain in uc(portal_type=portal_type)[:size]]
+if not uids:
+    raise SystemExit("No {} objects found".format(portal_type))
+
+
+def measure(title, func):
+    start = time.time()
+    func()
+    duration = time.time() - start
+    print("{:<28} {:>8.3f}s {:>10.3f}ms/UID".format(
+        title, duration, duration * 1000 / len(uids)))
+
+
+def single():
+    for uid in uids:
+        api.get_object_by_uid(uid)
+
+
+def bulk():
+    api.get_objects_by_uids(uids)
+
+
+print("{} {} UIDs".format(len(uids), portal_type))
+
+# Wake up the objects first, so the ZODB cache does not distort the results
+single()
+
+# No request, no cache
+measure("Single lookups (no cache)", single)
+
+app = makerequest(app)
+setRequest(app.REQUEST)
+api.invalidate_uid_cache()
+measure("Bulk lookup (empty cache)", bulk)
+measure("Single lookups (cached)", single)
+
+api.invalidate_uid_cache()
+measure("Single lookups (empty cache)", single)
+setRequest(None)
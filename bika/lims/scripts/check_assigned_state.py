@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Checks the counters of assigned and unassigned analyses of all Analysis
+Requests against the analysis catalog. Missing or inconsistent counters are
+rebuilt and the `assigned_state` index is updated, unless --check-only is
+given.
+
+Usage:
+bin/instance run check_assigned_state.py <ploneSiteId> [--check-only]
+"""
+
+from sys import argv
+
+import transaction
+from bika.lims.assignedstate import check_assigned_states
+from zope.component.hooks import setSite
+
+plone = app[argv[1]]
+setSite(plone)
+
+check_assigned_states(fix="--check-only" not in argv[2:])
+
+transaction.commit()
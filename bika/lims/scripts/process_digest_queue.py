@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Digests the Analysis Requests waiting in the digest queue, e.g. the ones left
+in the queue when an instance was stopped before its background worker could
+process them.
+
+Usage:
+bin/instance run process_digest_queue.py <ploneSiteId>
+"""
+
+from sys import argv
+
+import transaction
+from bika.lims.digestqueue import process_digest_queue
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+from zope.globalrequest import setRequest
+
+app = makerequest(app)
+setRequest(app.REQUEST)
+plone = app[argv[1]]
+setSite(plone)
+
+process_digest_queue()
+
+transaction.commit()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Rebuilds a catalog into a shadow catalog while the current catalog keeps
+serving the searches. The shadow catalog is swapped in when all the workers
+have finished.
+
+To rebuild with several ZEO clients at the same time, run the script once per
+client with the same number of workers and a different worker number (from 0
+to workers - 1). An interrupted rebuild is resumed by running the script again
+with the same parameters.
+
+Usage:
+bin/instance run rebuild_catalog.py <ploneSiteId> <catalogId> \
+    [<workers> <worker>]
+"""
+
+from sys import argv
+
+from bika.lims import logger
+from zope.component.hooks import setSite
+
+plone = app[argv[1]]
+setSite(plone)
+
+catalog = plone[argv[2]]
+workers = int(argv[3]) if len(argv) > 3 else 1
+worker = int(argv[4]) if len(argv) > 4 else 0
+
+if catalog.shadowRebuild(workers=workers, worker=worker):
+    logger.info("{} rebuilt".format(argv[2]))
+else:
+    logger.info("Worker {} finished, {} is swapped in by the last worker"
+                .format(worker, argv[2]))
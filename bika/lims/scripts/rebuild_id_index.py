@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Rebuilds the ID index of the ID server from the IDs in the UID catalog.
+Without portal types given, the portal types with an ID formatting config in
+Bika Setup are indexed.
+
+Usage:
+bin/instance run rebuild_id_index.py <ploneSiteId> [<portal_type> ...]
+"""
+
+from sys import argv
+
+import transaction
+from bika.lims.idserver import rebuild_id_index
+from zope.component.hooks import setSite
+
+plone = app[argv[1]]
+setSite(plone)
+
+portal_types = argv[2:] or None
+rebuild_id_index(portal_types=portal_types)
+
+transaction.commit()
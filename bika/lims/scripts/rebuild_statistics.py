@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Rebuilds the statistics of the dashboard from the objects of the catalogs.
+Without portal types given, all the tracked portal types are counted. The
+dashboard searches the catalogs until the statistics are built.
+
+Usage:
+bin/instance run rebuild_statistics.py <ploneSiteId> [<portal_type> ...]
+"""
+
+from sys import argv
+
+import transaction
+from bika.lims.statistics import TRACKED_TYPES
+from bika.lims.statistics import rebuild_statistics
+from zope.component.hooks import setSite
+
+plone = app[argv[1]]
+setSite(plone)
+
+portal_types = argv[2:] or TRACKED_TYPES
+rebuild_statistics(portal_types=portal_types)
+
+transaction.commit()
@@ -612,3 +612,7 @@ def setupVarious(context):
     #  'jsregistry')
 
     create_CAS_IdentifierType(site)
+
+    # Start counting the objects displayed in the dashboard
+    from bika.lims.statistics import init_statistics
+    init_statistics()
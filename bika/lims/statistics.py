@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Persistent counters of the objects displayed in the dashboard
+
+The number of objects is stored per portal type and per combination of the
+values the dashboard filters by (review state, cancellation state, creator,
+departments, etc.), both in total and per creation day. The totals of every
+combination of the states are stored too, so the dashboard panels read their
+counts directly. The counters are updated when the objects are added,
+transitioned, modified or removed, so the dashboard panels and evolution
+charts do not need to search the catalogs.
+
+The statistics of a new site are counted from the start. The statistics of
+existing sites are built with the `rebuild_statistics.py` script, the
+dashboard searches the catalogs until then.
+"""
+
+import datetime
+from itertools import combinations
+from itertools import product
+
+import transaction
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from bika.lims import api
+from bika.lims import logger
+from bika.lims.numbergenerator import get_portal_annotation
+from persistent import Persistent
+
+STATISTICS_STORAGE = "bika.lims.statistics"
+
+# Number of objects counted between commits while rebuilding the statistics
+REBUILD_BATCH_SIZE = 1000
+
+# Portal types with statistics
+TRACKED_TYPES = (
+    "AnalysisRequest",
+    "Analysis",
+    "Sample",
+    "Worksheet",
+)
+
+# Values of the objects the statistics are counted by
+FIELDS = (
+    "review_state",
+    "cancellation_state",
+    "worksheetanalysis_review_state",
+    "getPrinted",
+    "Creator",
+    "getDepartmentUIDs",
+)
+
+# Positions of the state fields, whose totals are stored for every
+# combination of the fields, e.g. ((0, ), (0, 1), (0, 1, 2), ...)
+STATE_POSITIONS = tuple(
+    positions for size in range(1, 5)
+    for positions in combinations(range(4), size))
+
+# Catalog indexes the statistics can be filtered by -> field
+INDEXES = {
+    "review_state": "review_state",
+    "cancellation_state": "cancellation_state",
+    "worksheetanalysis_review_state": "worksheetanalysis_review_state",
+    "getPrinted": "getPrinted",
+    "Creator": "Creator",
+    "getDepartmentUIDs": "getDepartmentUIDs",
+    "getDepartmentUID": "getDepartmentUIDs",
+}
+
+# Query parameters that do not filter the results
+IGNORED_PARAMETERS = ("portal_type", "sort_on", "sort_order", "created")
+
+# Roles that see all the objects of the laboratory
+LAB_ROLES = (
+    "Manager",
+    "LabManager",
+    "LabClerk",
+    "Analyst",
+    "Verifier",
+)
+
+
+class StatisticsStorage(Persistent):
+    """Counters of the tracked objects
+
+    `totals` maps (portal_type, values) and `days` maps (portal_type, day,
+    values) to `BTrees.Length` counters, which resolve concurrent increments.
+    `states` maps (portal_type, positions, values at positions) to the
+    totals of every combination of the state fields (see `STATE_POSITIONS`).
+    `objects` maps the UID of every counted object to its (portal_type, day,
+    values) record, so the counters of the former values are decremented when
+    the values of the object change. `built` is False while the statistics
+    are rebuilt, so they are not used for counting yet.
+    """
+
+    def __init__(self):
+        self.totals = OOBTree()
+        self.days = OOBTree()
+        self.states = OOBTree()
+        self.objects = OOBTree()
+        self.built = False
+
+    def change(self, record, delta):
+        """Increments the counters of the record by delta
+        """
+        portal_type, day = record[:2]
+        values = record[2:]
+        keys = [(self.totals, (portal_type, ) + values),
+                (self.days, record)]
+        for positions in STATE_POSITIONS:
+            state = tuple([values[position] for position in positions])
+            keys.append((self.states, (portal_type, positions, state)))
+        for tree, key in keys:
+            counter = tree.get(key)
+            if counter is None:
+                counter = Length()
+                tree[key] = counter
+            counter.change(delta)
+
+
+def get_storage():
+    """Returns the statistics storage or None if not built yet
+    """
+    return get_portal_annotation().get(STATISTICS_STORAGE)
+
+
+def flush_statistics():
+    """Deletes the statistics storage
+    """
+    annotation = get_portal_annotation()
+    if annotation.get(STATISTICS_STORAGE) is not None:
+        del annotation[STATISTICS_STORAGE]
+
+
+def to_key(value):
+    """Converts the value to a byte string suitable for the storage keys
+    """
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+def get_creation_day(obj):
+    """Returns the proleptic Gregorian ordinal of the creation date
+    """
+    created = api.get_creation_date(obj)
+    return to_day(created)
+
+
+def to_day(date):
+    """Returns the proleptic Gregorian ordinal of the DateTime
+    """
+    return datetime.date(date.year(), date.month(), date.day()).toordinal()
+
+
+def get_catalog_brain(obj):
+    """Returns the brain of the object in its primary catalog or None
+    """
+    catalog = api.get_catalogs_for(obj)[0]
+    brains = catalog.unrestrictedSearchResults(UID=api.get_uid(obj))
+    return brains and brains[0] or None
+
+
+def get_department_uids(obj, brain=None):
+    """Returns the department UIDs of the object
+
+    Analysis Requests and Worksheets compute their departments from all their
+    analyses, so they are read from the `getDepartmentUIDs` metadata column of
+    the catalog and only computed if the object is not cataloged yet.
+
+    :param obj: The object to get the departments of
+    :param brain: The catalog brain of the object, looked up if not given
+    :returns: List of department UIDs
+    """
+    department = getattr(obj, "getDepartmentUID", None)
+    if department is not None:
+        return [department()]
+    if not hasattr(obj, "getDepartmentUIDs"):
+        return []
+    if brain is None:
+        brain = get_catalog_brain(obj)
+    departments = getattr(brain, "getDepartmentUIDs", None)
+    if not isinstance(departments, (list, tuple)):
+        departments = obj.getDepartmentUIDs()
+    return departments or []
+
+
+def get_statistics_values(obj, brain=None):
+    """Returns the values of the object the statistics are counted by
+
+    :param obj: The object to get the values of
+    :param brain: The catalog brain of the object, see `get_department_uids`
+    """
+    values = []
+    for state_var in FIELDS[:3]:
+        values.append(to_key(api.get_workflow_status_of(obj, state_var)))
+
+    printed = getattr(obj, "getPrinted", None)
+    values.append(to_key(printed and printed() or ""))
+
+    values.append(to_key(obj.Creator()))
+
+    departments = get_department_uids(obj, brain=brain)
+    values.append(tuple(sorted(map(to_key, filter(None, departments)))))
+    return tuple(values)
+
+
+def get_statistics_record(obj, brain=None):
+    """Returns the (portal_type, day, values) record of the object
+    """
+    portal_type = api.get_portal_type(obj)
+    day = get_creation_day(obj)
+    return (portal_type, day) + get_statistics_values(obj, brain=brain)
+
+
+def update_statistics(obj):
+    """Counts the object with its current values
+
+    Does nothing if the portal type of the object is not tracked, the storage
+    is not built yet or the values of the object did not change.
+    """
+    if api.get_portal_type(obj) not in TRACKED_TYPES:
+        return
+    storage = get_storage()
+    if storage is None:
+        return
+    uid = api.get_uid(obj)
+    if not uid or "portal_factory" in api.get_path(obj):
+        return
+    record = get_statistics_record(obj)
+    old_record = storage.objects.get(uid)
+    if old_record == record:
+        return
+    if old_record is not None:
+        storage.change(old_record, -1)
+    storage.change(record, 1)
+    storage.objects[uid] = record
+
+
+def remove_statistics(obj):
+    """Stops counting the object
+    """
+    if api.get_portal_type(obj) not in TRACKED_TYPES:
+        return
+    storage = get_storage()
+    if storage is None:
+        return
+    old_record = storage.objects.pop(api.get_uid(obj), None)
+    if old_record is not None:
+        storage.change(old_record, -1)
+
+
+def init_statistics():
+    """Starts counting the objects of a new site. The statistics of sites
+    with tracked objects are built with `rebuild_statistics` instead, which
+    wakes up all the objects
+
+    :returns: True if the statistics were initialized
+    """
+    if get_storage() is not None:
+        return False
+    for portal_type in TRACKED_TYPES:
+        catalog = api.get_catalogs_for(portal_type)[0]
+        if len(catalog.unrestrictedSearchResults(portal_type=portal_type)):
+            logger.info("Statistics not initialized: there are {} objects, "
+                        "run rebuild_statistics.py".format(portal_type))
+            return False
+    storage = StatisticsStorage()
+    storage.built = True
+    get_portal_annotation()[STATISTICS_STORAGE] = storage
+    return True
+
+
+def rebuild_statistics(portal_types=TRACKED_TYPES):
+    """Rebuilds the statistics from the objects of the catalogs
+
+    The transaction is committed every `REBUILD_BATCH_SIZE` objects. Objects
+    modified meanwhile are counted by `update_statistics` already and skipped.
+
+    :param portal_types: The portal types to count
+    :returns: The number of counted objects
+    """
+    flush_statistics()
+    storage = StatisticsStorage()
+    get_portal_annotation()[STATISTICS_STORAGE] = storage
+
+    counted = 0
+    for portal_type in portal_types:
+        catalog = api.get_catalogs_for(portal_type)[0]
+        brains = catalog.unrestrictedSearchResults(portal_type=portal_type)
+        total = len(brains)
+        logger.info("Rebuilding statistics for {} {} objects ..."
+                    .format(total, portal_type))
+        for num, brain in enumerate(brains):
+            if num and num % REBUILD_BATCH_SIZE == 0:
+                logger.info("Rebuilding statistics: {}/{}"
+                            .format(num, total))
+                transaction.commit()
+                api.get_portal()._p_jar.cacheGC()
+            if api.get_uid(brain) in storage.objects:
+                continue
+            obj = brain._unrestrictedGetObject()
+            record = get_statistics_record(obj, brain=brain)
+            storage.change(record, 1)
+            storage.objects[api.get_uid(obj)] = record
+            counted += 1
+    storage.built = True
+    return counted
+
+
+def is_lab_user():
+    """Checks if the current user sees all the objects of the laboratory,
+    so the statistics match the (permission filtered) catalog results
+    """
+    user = api.get_current_user()
+    roles = user.getRolesInContext(api.get_portal())
+    return bool(set(roles).intersection(LAB_ROLES))
+
+
+def get_filters(query, catalog=None):
+    """Converts the catalog query to a list of (field position, accepted
+    values) filters
+
+    Query parameters the catalog does not have an index for are ignored, like
+    the catalog does.
+
+    :returns: List of filters or None if the query cannot be answered with the
+              statistics
+    """
+    if query.get("portal_type") not in TRACKED_TYPES:
+        return None
+    indexes = catalog is not None and catalog.indexes() or None
+    filters = []
+    for index, value in query.items():
+        if index in IGNORED_PARAMETERS:
+            continue
+        if indexes is not None and index not in indexes:
+            continue
+        field = INDEXES.get(index)
+        if field is None:
+            return None
+        if isinstance(value, dict):
+            if set(value.keys()).difference(["query", "operator"]):
+                return None
+            if value.get("operator", "or") != "or":
+                return None
+            value = value.get("query")
+        if isinstance(value, basestring):
+            value = [value]
+        accepted = set(map(to_key, value or []))
+        if not accepted or "" in accepted:
+            # Empty values are handled differently by the catalog indexes
+            return None
+        filters.append((FIELDS.index(field), accepted))
+    return filters
+
+
+def matches(values, filters):
+    """Checks if the values of a counter match the filters
+    """
+    for position, accepted in filters:
+        value = values[position]
+        if isinstance(value, tuple):
+            if not accepted.intersection(value):
+                return False
+        elif value not in accepted:
+            return False
+    return True
+
+
+def count(query, catalog=None):
+    """Returns the number of objects matching the catalog query
+
+    :param query: Catalog query with a single tracked portal type
+    :param catalog: The catalog the query is meant for
+    :returns: The number of objects or None if the statistics are not built
+              or cannot answer the query
+    """
+    storage = get_storage()
+    if storage is None or not storage.built:
+        return None
+    filters = get_filters(query, catalog)
+    if filters is None:
+        return None
+    portal_type = to_key(query["portal_type"])
+    if not filters:
+        # All the objects, sum the totals of the review states
+        total = 0
+        prefix = (portal_type, (0, ))
+        for key, counter in storage.states.items(min=prefix):
+            if key[:2] != prefix:
+                break
+            total += counter()
+        return total
+
+    positions = tuple(sorted([position for position, accepted in filters]))
+    if positions in STATE_POSITIONS:
+        # Filters by states only, read their totals directly
+        accepted = dict(filters)
+        values = [accepted[position] for position in positions]
+        total = 0
+        for state in product(*values):
+            counter = storage.states.get((portal_type, positions, state))
+            if counter is not None:
+                total += counter()
+        return total
+
+    # Filters by creator or departments, sum the matching totals
+    total = 0
+    for key, counter in storage.totals.items(min=(portal_type, )):
+        if key[0] != portal_type:
+            break
+        if matches(key[1:], filters):
+            total += counter()
+    return total
+
+
+def count_by_day(query, date_from, date_to, catalog=None):
+    """Returns the number of objects matching the catalog query created
+    between the dates, grouped by creation day and review state
+
+    :param query: Catalog query with a single tracked portal type
+    :param date_from: Minimum creation date
+    :type date_from: DateTime
+    :param date_to: Maximum creation date
+    :type date_to: DateTime
+    :param catalog: The catalog the query is meant for
+    :returns: List of (creation date, review state, count) or None if the
+              statistics are not built or cannot answer the query
+    """
+    storage = get_storage()
+    if storage is None or not storage.built:
+        return None
+    filters = get_filters(query, catalog)
+    if filters is None:
+        return None
+    portal_type = to_key(query["portal_type"])
+    day_from = to_day(date_from)
+    day_to = to_day(date_to)
+    out = []
+    items = storage.days.items(min=(portal_type, day_from),
+                               max=(portal_type, day_to + 1))
+    for key, counter in items:
+        amount = counter()
+        if not amount or key[1] > day_to:
+            continue
+        if matches(key[2:], filters):
+            date = datetime.date.fromordinal(key[1])
+            out.append((date, key[2], amount))
+    return out
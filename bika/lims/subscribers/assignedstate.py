@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from bika.lims.assignedstate import remove_assigned_state
+from bika.lims.assignedstate import update_assigned_state
+from bika.lims.reindexqueue import queue_reindex
+
+
+def ObjectAddedEventHandler(analysis, event):
+    """Counts added analyses in the assigned state of the Analysis Request.
+
+    Assignments are counted by the analysis workflow events
+    """
+    update_assigned_state(analysis, request=event.newParent)
+    queue_reindex(event.newParent, idxs=["assigned_state"])
+
+
+def ObjectRemovedEventHandler(analysis, event):
+    """Removes deleted analyses from the assigned state of the Analysis Request
+    """
+    remove_assigned_state(analysis, request=event.oldParent)
+    queue_reindex(event.oldParent, idxs=["assigned_state"])
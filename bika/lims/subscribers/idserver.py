@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from bika.lims.idserver import index_object_id
+from bika.lims.idserver import is_id_indexed
+from bika.lims.idserver import unindex_id
+
+
+def ObjectMovedEventHandler(obj, event):
+    """Keeps the ID index of the ID server up to date when objects with IDs
+    assigned by the ID server are renamed or removed.
+
+    Newly added objects are indexed by `renameAfterCreation`
+    """
+    old_name = event.oldName
+    new_name = event.newName
+    if old_name is None or old_name == new_name:
+        # Object added or moved to another folder
+        return
+    if not is_id_indexed(old_name):
+        return
+    unindex_id(old_name)
+    if new_name is None or event.newParent is None:
+        # Object removed
+        return
+    index_object_id(obj)
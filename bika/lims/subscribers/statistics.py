@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from bika.lims.statistics import remove_statistics
+from bika.lims.statistics import update_statistics
+
+
+def ObjectModifiedEventHandler(obj, event):
+    """Updates the dashboard statistics of added or modified objects.
+
+    Workflow transitions are counted by `AfterTransitionEventHandler`
+    """
+    update_statistics(obj)
+
+
+def ObjectRemovedEventHandler(obj, event):
+    """Removes deleted objects from the dashboard statistics
+    """
+    remove_statistics(obj)
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from bika.lims import api
+
+
+def ObjectMovedEventHandler(obj, event):
+    """Removes renamed, moved or deleted objects from the UID -> object cache
+    of the current request, so they are looked up again
+    """
+    if event.oldParent is None:
+        # Object added
+        return
+    uid = api.get_uid(obj)
+    if uid:
+        api.invalidate_uid_cache(uid)
@@ -9,6 +9,7 @@ from plone.app.testing import TEST_USER_ID
 from plone.app.testing import TEST_USER_NAME
 from plone.app.testing import login
 from plone.app.testing import setRoles
+from bika.lims.utils.analysis import calculate_results
 from bika.lims.workflow import doActionFor
 from bika.lims.testing import BIKA_LIMS_FUNCTIONAL_TESTING
 from bika.lims.tests.base import BikaFunctionalTestCase
@@ -375,6 +376,14 @@ class TestCalculations(BikaFunctionalTestCase):
                 'getResult returns an empty string')
             self.assertEqual(float(calcanalysis.getResult()), float(f['exresult']))
 
+            # The batch calculation of all analyses gives the same result
+            calcanalysis.setResult('')
+            analyses = ar.getAnalyses(full_objects=True)
+            calculated = calculate_results(analyses)
+            self.assertEqual([an.UID() for an in calculated],
+                             [calcanalysis.UID()])
+            self.assertEqual(float(calcanalysis.getResult()), float(f['exresult']))
+
     def test_calculation_fixed_precision(self):
         # Input results
         # Client:       Happy Hills
@@ -194,6 +194,7 @@ class UpgradeUtils(object):
         self.portal = portal
         self.reindexcatalog = {}
         self.refreshcatalog = []
+        self.refreshcolumns = {}
         self.pgthreshold = pgthreshold
 
     def getInstalledVersion(self, product):
@@ -291,6 +292,10 @@ class UpgradeUtils(object):
                 catalog, column
             ))
             self.refreshcatalog.append(cat.id)
+        columns = self.refreshcolumns.get(cat.id, [])
+        if column not in columns:
+            columns.append(column)
+            self.refreshcolumns[cat.id] = columns
         transaction.commit()
 
     def reindexIndex(self, catalog, index):
@@ -309,15 +314,33 @@ class UpgradeUtils(object):
         recatalogs all objects in the database, this method only reindexes over
         the already cataloged objects.
 
-        If a metacolumn is added it refreshes the catalog, if only a new index
-        is added, it reindexes only those new indexes.
+        Bika catalogs only fill the added indexes and metadata columns with
+        `updateIndexesAndColumns`. For other catalogs, if a metacolumn is
+        added it refreshes the catalog, if only a new index is added, it
+        reindexes only those new indexes.
         """
         to_refresh = self.refreshcatalog[:]
         to_reindex = self.reindexcatalog.keys()
         to_reindex = to_reindex[:]
         done = []
+        # Fill only the added indexes and columns of the Bika catalogs
+        for catalog_id in to_refresh + to_reindex:
+            if catalog_id in done:
+                continue
+            catalog = getToolByName(self.portal, catalog_id)
+            if not hasattr(aq_base(catalog), 'updateIndexesAndColumns'):
+                continue
+            logger.info(
+                'Catalog {0} updating started'.format(catalog_id))
+            catalog.updateIndexesAndColumns(
+                indexes=self.reindexcatalog.get(catalog_id, []),
+                columns=self.refreshcolumns.get(catalog_id, []))
+            logger.info('Catalog {0} updated'.format(catalog_id))
+            done.append(catalog_id)
         # Start reindexing the catalogs with new columns
         for catalog_to_refresh in to_refresh:
+            if catalog_to_refresh in done:
+                continue
             logger.info(
                 'Catalog {0} refreshing started'.format(catalog_to_refresh))
             catalog = getToolByName(self.portal, catalog_to_refresh)
@@ -4,14 +4,34 @@
 #
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+import transaction
+from bika.lims import api
 from bika.lims import logger
+from bika.lims.catalog.analysis_catalog import CATALOG_ANALYSIS_LISTING
+from bika.lims.catalog.analysisrequest_catalog import \
+    CATALOG_ANALYSIS_REQUEST_LISTING
+from bika.lims.browser.fields.uidreferencefield import \
+    migrate_backreferences
 from bika.lims.config import PROJECTNAME as product
+from bika.lims.interfaces import INumberGenerator
 from bika.lims.upgrade import upgradestep
 from bika.lims.upgrade.utils import UpgradeUtils
+from zope.component import getUtility
 
 version = '1.2.4'  # Remember version number in metadata.xml and setup.py
 profile = 'profile-{0}:default'.format(product)
 
+# Number of objects migrated per transaction
+MIGRATE_BATCH_SIZE = 1000
+
+# Catalog -> query of the usual targets of UIDReferenceFields, which have the
+# largest lists of backreferences
+BACKREFERENCE_TARGETS = [
+    ("bika_setup_catalog", {}),
+    ("portal_catalog", {"portal_type": ["Client", "Contact"]}),
+    ("bika_catalog", {"portal_type": "Sample"}),
+]
+
 
 @upgradestep(product, version)
 def upgrade(tool):
@@ -28,6 +48,92 @@ def upgrade(tool):
 
     # -------- ADD YOUR STUFF HERE --------
 
+    # Resolve the searchterm of the AR listings with a text index
+    add_listing_searchable_text_index(portal, ut)
+
+    # Sort the AR listings in the catalog instead of in memory
+    add_listing_sort_indexes(portal, ut)
+
+    # Decide the editability of analyses in listings from the metadata
+    ut.addColumn(CATALOG_ANALYSIS_LISTING, 'getPointOfCapture')
+
+    # Filter the reflexed analyses of the Analysis Requests in the catalog
+    ut.addIndex(CATALOG_ANALYSIS_LISTING, 'isReflexed', 'FieldIndex')
+    ut.addColumn(CATALOG_ANALYSIS_LISTING, 'isReflexed')
+
+    # Move the numbers of the number generator to per-key counters
+    migrate_number_generator_storage(portal)
+
+    # Store the backreferences of UIDReferenceFields in BTree sets
+    migrate_backreferences_storage(portal)
+
+    # Reindex the catalogs with new indexes or columns
+    ut.refreshCatalogs()
+
     logger.info("{0} upgraded to version {1}".format(product, version))
 
     return True
+
+
+def add_listing_searchable_text_index(portal, ut):
+    """Adds the `listing_searchable_text` index to the AR listing catalog
+    """
+    ut.addIndex(CATALOG_ANALYSIS_REQUEST_LISTING, 'listing_searchable_text',
+                'ZCTextIndex')
+
+
+def add_listing_sort_indexes(portal, ut):
+    """Adds FieldIndexes for the sortable columns of the AR listings, so they
+    are sorted in the catalog instead of manually on the metadata
+    """
+    indexes = [
+        'getCreatorFullName',
+        'getBatchID',
+        'getClientOrderNumber',
+        'getClientReference',
+        'getContactFullName',
+        'getSampleTypeTitle',
+        'getSamplePointTitle',
+        'getStorageLocationTitle',
+        'getSamplingDeviationTitle',
+        'getProfilesTitleStr',
+        'getTemplateTitle',
+    ]
+    for index in indexes:
+        ut.addIndex(CATALOG_ANALYSIS_REQUEST_LISTING, index, 'FieldIndex')
+
+
+def migrate_number_generator_storage(portal):
+    """Moves the numbers of the single OIBTree storage of the number generator
+    to per-key counters. The migration is done on first access to the storage
+    """
+    number_generator = getUtility(INumberGenerator)
+    logger.info("Number generator keys: {}".format(
+        len(number_generator.storage)))
+
+
+def migrate_backreferences_storage(portal):
+    """Converts the lists of UIDs of the UIDReferenceField backreferences to
+    BTree sets for the usual reference targets: setup items, clients,
+    contacts and samples. The backreferences of other objects are converted
+    when they are referenced again. The transaction is committed every
+    `MIGRATE_BATCH_SIZE` objects
+    """
+    migrated = 0
+    for catalog_id, query in BACKREFERENCE_TARGETS:
+        catalog = api.get_tool(catalog_id)
+        brains = catalog.unrestrictedSearchResults(**query)
+        total = len(brains)
+        logger.info("Migrating the backreferences of {} objects of {} ..."
+                    .format(total, catalog_id))
+        for num, brain in enumerate(brains):
+            if num and num % MIGRATE_BATCH_SIZE == 0:
+                logger.info("Migrating the backreferences: {}/{}"
+                            .format(num, total))
+                transaction.commit()
+                portal._p_jar.cacheGC()
+            obj = brain._unrestrictedGetObject()
+            if migrate_backreferences(obj):
+                migrated += 1
+        transaction.commit()
+    logger.info("Backreferences of {} objects migrated".format(migrated))
@@ -5,9 +5,14 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
+import cPickle
+import multiprocessing
 import os
 import re
+import subprocess
+import sys
 import tempfile
+import traceback
 import types
 import urllib2
 from email import Encoders
@@ -26,6 +31,7 @@ from bika.lims import api as api
 from bika.lims import logger
 from bika.lims.browser import BrowserView
 from email.MIMEBase import MIMEBase
+from multiprocessing.pool import ThreadPool
 from plone.memoize import ram
 from plone.registry.interfaces import IRegistry
 from plone.subrequest import subrequest
@@ -38,6 +44,21 @@ from zope.i18n.locales import locales
 ModuleSecurityInfo('email.Utils').declarePublic('formataddr')
 allow_module('csv')
 
+# URLs of the resources referenced by HTML reports (src, stylesheet links and
+# css url())
+PDF_RESOURCE_URL = re.compile(
+    r"""(?:\bsrc|<link\b[^>]*\bhref)\s*=\s*["']([^"']+)["']"""
+    r"""|url\(\s*["']?([^"')]+)["']?\s*\)""",
+    re.I)
+
+# Default maximum number of processes that render PDFs in parallel
+PDF_PROCESSES = 4
+
+# Script that renders a PDF in a clean interpreter, see `createPdfs`
+PDF_WORKER = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "pdfworker.py")
+
 
 def to_utf8(text):
     if text is None:
@@ -373,6 +394,10 @@ def changeWorkflowState(content, wf_id, state_id, acquire_permissions=False,
 
     # Map changes to the catalogs
     content.reindexObject(idxs=['allowedRolesAndUsers', 'review_state'])
+
+    # The state is changed without a transition event
+    from bika.lims.statistics import update_statistics
+    update_statistics(content)
     return
 
 
@@ -460,7 +485,8 @@ def senaite_url_fetcher(url):
     }
 
 
-def createPdf(htmlreport, outfile=None, css=None, images={}):
+def createPdf(htmlreport, outfile=None, css=None, images={},
+              url_fetcher=senaite_url_fetcher):
     """create a PDF from some HTML.
     htmlreport: rendered html
     outfile: pdf filename; if supplied, caller is responsible for creating
@@ -468,6 +494,7 @@ def createPdf(htmlreport, outfile=None, css=None, images={}):
     css: remote URL of css file to download
     images: A dictionary containing possible URLs (keys) and local filenames
             (values) with which they may to be replaced during rendering.
+    url_fetcher: function WeasyPrint fetches the referenced resources with
     # WeasyPrint will attempt to retrieve images directly from the URL
     # referenced in the HTML report, which may refer back to a single-threaded
     # (and currently occupied) zeoclient, hanging it.  All image source
@@ -497,7 +524,7 @@ def createPdf(htmlreport, outfile=None, css=None, images={}):
 
     # render
     htmlreport = to_utf8(htmlreport)
-    renderer = HTML(string=htmlreport, url_fetcher=senaite_url_fetcher, encoding='utf-8')
+    renderer = HTML(string=htmlreport, url_fetcher=url_fetcher, encoding='utf-8')
     pdf_fn = outfile if outfile else tempfile.mktemp(suffix=".pdf")
     if css:
         renderer.write_pdf(pdf_fn, stylesheets=[CSS(string=css_def)])
@@ -512,6 +539,128 @@ def createPdf(htmlreport, outfile=None, css=None, images={}):
     return pdf_data
 
 
+def get_pdf_resources(htmlreport):
+    """Fetches the local resources (images, stylesheets) referenced in the
+    HTML report with `senaite_url_fetcher`, so the PDF can be rendered
+    without access to the database, e.g. in another process.
+
+    Returns a dictionary of URL -> data as returned by the URL fetcher
+    """
+    request = api.get_request()
+    host = request.get_header("HOST")
+    resources = {}
+    if not host:
+        return resources
+    for match in PDF_RESOURCE_URL.finditer(to_utf8(htmlreport)):
+        url = match.group(1) or match.group(2)
+        if url in resources or host not in url:
+            continue
+        try:
+            resource = senaite_url_fetcher(url)
+        except Exception as e:
+            logger.warn("Cannot fetch '{}' for the PDF: {}".format(url, e))
+            continue
+        file_obj = resource.pop("file_obj", None)
+        if file_obj is not None:
+            resource["string"] = file_obj.read()
+            file_obj.close()
+        resources[url] = resource
+    return resources
+
+
+def get_pdf_processes():
+    """Returns the maximum number of processes that render PDFs in parallel
+    """
+    registry = queryUtility(IRegistry)
+    default = min(PDF_PROCESSES, multiprocessing.cpu_count())
+    if registry is None:
+        return default
+    return registry.get("bika.lims.publish_pdf_processes", default)
+
+
+def _createPdfWorker(task):
+    """Renders a PDF with the prefetched resources of the HTML report in the
+    current thread. The PDF data is None if the PDF could not be rendered
+    """
+    index, htmlreport, resources = task
+
+    def url_fetcher(url):
+        if url in resources:
+            return resources[url]
+        return default_url_fetcher(url)
+
+    start = time()
+    try:
+        pdf_data = createPdf(htmlreport, url_fetcher=url_fetcher)
+    except Exception:
+        logger.error("Rendering the PDF {} failed: {}"
+                     .format(index, traceback.format_exc()))
+        pdf_data = None
+    return index, pdf_data, time() - start
+
+
+def _createPdfProcess(task):
+    """Renders a PDF with the prefetched resources of the HTML report in a new
+    interpreter running `PDF_WORKER`. Runs in the threads of `createPdfs`.
+    The PDF data is None if the PDF could not be rendered
+    """
+    index, htmlreport, resources = task
+    start = time()
+    # The worker imports WeasyPrint from the paths of the instance
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    try:
+        process = subprocess.Popen(
+            [sys.executable, PDF_WORKER], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        pdf_data, error = process.communicate(
+            cPickle.dumps((htmlreport, resources), cPickle.HIGHEST_PROTOCOL))
+    except Exception:
+        logger.error("Rendering the PDF {} failed: {}"
+                     .format(index, traceback.format_exc()))
+        return index, None, time() - start
+    if process.returncode != 0:
+        logger.error("Rendering the PDF {} failed: {}".format(index, error))
+        return index, None, time() - start
+    return index, pdf_data, time() - start
+
+
+def createPdfs(htmlreports, processes=None):
+    """Renders the HTML reports to PDF in a bounded number of processes.
+
+    Every PDF is rendered by a new interpreter running `PDF_WORKER`, which is
+    started and waited for by a pool of threads, so the Zope process with its
+    threads and database connections is never forked. The local resources of
+    the reports are fetched before in the current thread, the worker
+    processes do not access the database. A report that cannot be rendered
+    does not stop the rendering of the others, its PDF data is None.
+
+    :param htmlreports: List of rendered HTML reports
+    :param processes: Maximum number of worker processes
+    :returns: Generator of (index of the HTML report, PDF data, seconds
+              spent rendering) in the order the PDFs are rendered
+    """
+    tasks = []
+    for index, htmlreport in enumerate(htmlreports):
+        tasks.append((index, to_utf8(htmlreport),
+                      get_pdf_resources(htmlreport)))
+    if processes is None:
+        processes = get_pdf_processes()
+    processes = min(processes, len(tasks))
+
+    if processes < 2:
+        for task in tasks:
+            yield _createPdfWorker(task)
+        return
+
+    pool = ThreadPool(processes)
+    try:
+        for result in pool.imap_unordered(_createPdfProcess, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 def attachPdf(mimemultipart, pdfreport, filename=None):
     part = MIMEBase('application', "pdf")
     part.add_header('Content-Disposition',
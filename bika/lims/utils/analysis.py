@@ -6,12 +6,14 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import math
+from collections import OrderedDict
 
 import zope.event
 from Products.Archetypes.event import ObjectInitializedEvent
 from Products.CMFCore.WorkflowCore import WorkflowException
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.utils import _createObjectByType
+from bika.lims import api
 from bika.lims import bikaMessageFactory as _, logger
 from bika.lims.interfaces import IAnalysisService
 from bika.lims.utils import changeWorkflowState
@@ -597,3 +599,148 @@ def get_method_instrument_constraints(context, uids):
             constraints[auid][muid] = targ
             cached_servs[cachedkey][suid][muid] = targ
     return constraints
+
+
+def _get_keywords_map(analysis, cache):
+    """Returns a mapping of keyword -> analyses for the siblings of the
+    analysis given, including the analysis itself. The siblings are looked up
+    once for all analyses of the same analysis request (or worksheet for
+    duplicates) and stored in the cache by UID
+    """
+    uid = api.get_uid(analysis)
+    if uid in cache:
+        return cache[uid]
+
+    get_siblings = getattr(analysis, "getSiblings", None)
+    siblings = get_siblings(retracted=False) if get_siblings else []
+    siblings = list(siblings) + [analysis]
+    keywords = {}
+    for sibling in siblings:
+        keywords.setdefault(sibling.getKeyword(), []).append(sibling)
+    for sibling in siblings:
+        cache.setdefault(api.get_uid(sibling), keywords)
+    return keywords
+
+
+def get_dependency_graph(analyses):
+    """Returns the dependency graph of the analyses given. Dependencies of
+    calculated analyses that are not in the list are added to the graph too.
+
+    The dependencies of each calculation are resolved once and the siblings
+    of each analysis request are looked up once, so overlapping dependencies
+    are not resolved again for every analysis.
+
+    :param analyses: list of analysis objects
+    :return: ordered dict of UID -> (analysis, calculation, dependencies)
+    """
+    graph = OrderedDict()
+    siblings_cache = {}
+    calculation_keywords = {}
+
+    pending = list(analyses)
+    while pending:
+        analysis = pending.pop(0)
+        uid = api.get_uid(analysis)
+        if uid in graph:
+            continue
+
+        calculation = analysis.getCalculation()
+        if not calculation:
+            graph[uid] = (analysis, None, [])
+            continue
+
+        calculation_uid = api.get_uid(calculation)
+        keywords = calculation_keywords.get(calculation_uid)
+        if keywords is None:
+            services = calculation.getDependentServices()
+            keywords = [service.getKeyword() for service in services]
+            calculation_keywords[calculation_uid] = keywords
+
+        siblings = _get_keywords_map(analysis, siblings_cache)
+        dependencies = []
+        for keyword in keywords:
+            for sibling in siblings.get(keyword, []):
+                if api.get_uid(sibling) != uid:
+                    dependencies.append(sibling)
+
+        graph[uid] = (analysis, calculation, dependencies)
+        pending.extend(dependencies)
+
+    return graph
+
+
+def sort_by_dependencies(graph):
+    """Returns the UIDs of the dependency graph in topological order, so that
+    the dependencies of an analysis come before the analysis itself
+
+    :param graph: dependency graph as returned by `get_dependency_graph`
+    :return: list of UIDs
+    """
+    ordered = []
+    visited = set()
+
+    def visit(uid, path):
+        if uid in visited:
+            return
+        if uid in path:
+            logger.warn("Circular dependency between analyses {}"
+                        .format(", ".join(path)))
+            return
+        path.append(uid)
+        for dependency in graph[uid][2]:
+            visit(api.get_uid(dependency), path)
+        path.pop()
+        visited.add(uid)
+        ordered.append(uid)
+
+    for uid in graph:
+        visit(uid, [])
+    return ordered
+
+
+def calculate_results(analyses, override=False, reindex=True, cascade=True):
+    """Calculates the results of the calculated analyses given in one pass.
+
+    The dependency graph of the analyses is built once and traversed in
+    topological order, so every calculation is evaluated once, after the
+    results of its dependencies are available. If `cascade` is True,
+    dependencies without result are calculated as well, like
+    `calculateResult` does with `cascade=True`. Analyses with dependencies
+    that still lack a result are skipped.
+
+    :param analyses: list of analysis objects, e.g. of a worksheet
+    :param override: if True, existing results of the analyses given are
+                     recalculated
+    :param reindex: if True, the analyses with a new result are reindexed
+                    once at the end
+    :param cascade: if True, the calculated dependencies without result of
+                    the analyses given are calculated too. Otherwise, only
+                    the analyses given are calculated
+    :return: list of analyses with a new result
+    """
+    targets = set(map(api.get_uid, analyses))
+    graph = get_dependency_graph(analyses)
+
+    calculated = []
+    for uid in sort_by_dependencies(graph):
+        analysis, calculation, dependencies = graph[uid]
+        if not calculation:
+            continue
+        if not cascade and uid not in targets:
+            continue
+        if analysis.getResult() and not (override and uid in targets):
+            continue
+        if filter(lambda dependency: not dependency.getResult(),
+                  dependencies):
+            continue
+        result = analysis.computeResult(calculation, dependencies)
+        if result is None:
+            continue
+        analysis.setResult(result)
+        calculated.append(analysis)
+
+    if reindex:
+        for analysis in calculated:
+            analysis.reindexObject()
+
+    return calculated
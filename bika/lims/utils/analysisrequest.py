@@ -7,10 +7,12 @@
 
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.utils import safe_unicode
+from bika.lims import api
 from bika.lims import bikaMessageFactory as _
 from bika.lims import logger
 from bika.lims.idserver import renameAfterCreation
 from bika.lims.interfaces import ISample, IAnalysisService, IRoutineAnalysis
+from bika.lims.reindexqueue import deferred_reindex
 from bika.lims.utils import tmpID
 from bika.lims.utils import to_utf8
 from bika.lims.utils import encode_header
@@ -19,16 +21,19 @@ from bika.lims.utils import attachPdf
 from bika.lims.utils.sample import create_sample
 from bika.lims.utils.samplepartition import create_samplepartition
 from bika.lims.workflow import doActionFor
+from bika.lims.workflow import doActionForObjects
 from bika.lims.workflow import doActionsFor
 from bika.lims.workflow import getReviewHistoryActionsList
 from copy import deepcopy
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.Utils import formataddr
-from plone import api
+from plone import api as ploneapi
 from Products.CMFPlone.utils import _createObjectByType
+from ZODB.POSException import ConflictError
 import os
 import tempfile
+import transaction
 
 def create_analysisrequest(client, request, values, analyses=None,
                            partitions=None, specifications=None, prices=None):
@@ -54,6 +59,146 @@ def create_analysisrequest(client, request, values, analyses=None,
         Allow different prices to be set for analyses.  If not set, prices
         are read from the associated analysis service.
     """
+    ar, partitions, secondary = _create_analysisrequest_objects(
+        client, request, values, analyses=analyses, partitions=partitions,
+        specifications=specifications, prices=prices)
+
+    # At this point, we have a fully created AR, with a Sample, Partitions and
+    # Analyses, but the state of all them is the initial ("sample_registered").
+    # We can now transition the whole thing (instead of doing it manually for
+    # each object we created). After and Before transitions will take care of
+    # cascading and promoting the transitions in all the objects "associated"
+    # to this Analysis Request.
+    doActionFor(ar, _get_initial_action(ar))
+
+    _initialise_analysisrequest(ar, values, partitions, secondary)
+    return ar
+
+
+def create_analysisrequests(client, request, records):
+    """Creates many Analysis Requests at once, e.g. from a spreadsheet.
+
+    The services and profiles of all the records, and the objects referenced
+    by UID in their values (contacts, sample types, etc.), are fetched once.
+    The reindex of the Analysis Requests and Samples is deferred until all of
+    them have been created, and the initial transitions are performed in a
+    single batch, so the transitions promoted to other objects are performed
+    once.
+
+    A record that fails does not prevent the creation of the others: its
+    objects are discarded and the error is reported.
+
+    :param client:
+        The container (Client) in which the ARs will be created.
+    :param request:
+        The current Request object.
+    :param records:
+        A list of dicts with the parameters of `create_analysisrequest` for
+        every AR: 'values' and, optionally, 'analyses', 'partitions',
+        'specifications' and 'prices'.
+    :returns:
+        A tuple of the list of the created ARs, with None for the records
+        that failed, and a dict of record index -> error message.
+    """
+    ars = [None] * len(records)
+    errors = {}
+    created = []
+
+    # Fetch the referenced objects into the UID cache of the request
+    _prefetch(records)
+    services = _get_services_lookup(client)
+
+    with deferred_reindex():
+        for num, record in enumerate(records):
+            values = record.get("values", {})
+            savepoint = transaction.savepoint()
+            try:
+                ar, partitions, secondary = _create_analysisrequest_objects(
+                    client, request, values,
+                    analyses=record.get("analyses"),
+                    partitions=record.get("partitions"),
+                    specifications=record.get("specifications"),
+                    prices=record.get("prices"),
+                    services=services)
+            except ConflictError:
+                raise
+            except Exception as e:
+                savepoint.rollback()
+                logger.exception("Cannot create Analysis Request {}"
+                                 .format(num))
+                errors[num] = e.message or repr(e)
+                continue
+            ars[num] = ar
+            created.append((num, ar, values, partitions, secondary))
+
+        # Initial transitions, with the promotions to other objects done once
+        by_action = {}
+        for num, ar, values, partitions, secondary in created:
+            by_action.setdefault(_get_initial_action(ar), []).append(ar)
+        for action, objects in by_action.items():
+            doActionForObjects(objects, action)
+
+        for num, ar, values, partitions, secondary in created:
+            _initialise_analysisrequest(ar, values, partitions, secondary)
+
+    logger.info("{} Analysis Requests created, {} failed".format(
+        len(created), len(errors)))
+    return ars, errors
+
+
+def _prefetch(records):
+    """Fetches the objects referenced by UID in the records with a single
+    search, so they are resolved from the UID cache of the request later on
+    """
+    uids = set()
+    for record in records:
+        items = list(record.get("analyses") or [])
+        for value in record.get("values", {}).values():
+            if isinstance(value, (list, tuple)):
+                items.extend(value)
+            else:
+                items.append(value)
+        for item in items:
+            if isinstance(item, basestring) and "," in item:
+                uids.update(filter(api.is_uid, item.split(",")))
+            elif api.is_uid(item):
+                uids.add(item)
+    api.get_objects_by_uids(list(uids))
+
+
+def _get_services_lookup(context):
+    """Returns a dict of UID, title and keyword -> UID of the analysis
+    services, to resolve the services of many ARs with a single search
+    """
+    bsc = getToolByName(context, 'bika_setup_catalog')
+    lookup = {}
+    for brain in bsc(portal_type='AnalysisService'):
+        for key in (brain.getKeyword, brain.Title, brain.UID):
+            if key:
+                lookup.setdefault(key, brain.UID)
+    return lookup
+
+
+def _get_initial_action(ar):
+    """Returns the transition that moves a new AR, and the objects related to
+    it, to "sampled" (if sampling workflow not enabled) or to "to_be_sampled"
+    statuses
+    """
+    if ar.getSample().getSamplingWorkflowEnabled():
+        return 'sampling_workflow'
+    return 'no_sampling_workflow'
+
+
+def _create_analysisrequest_objects(client, request, values, analyses=None,
+                                    partitions=None, specifications=None,
+                                    prices=None, services=None):
+    """Creates the AR and the Sample, Partitions and Analyses of the AR, in
+    their initial state. See `create_analysisrequest`
+
+    :param services: dict of UID, title and keyword -> UID of the analysis
+        services, see `_get_services_lookup`
+    :returns: the AR, the partitions and whether the AR is secondary
+    """
     # Don't pollute the dict param passed in
     values = deepcopy(values)
 
@@ -78,7 +223,8 @@ def create_analysisrequest(client, request, values, analyses=None,
     # Set analysis request analyses. 'Analyses' param are analyses services
     analyses = analyses if analyses else []
     service_uids = get_services_uids(
-        context=client, analyses_serv=analyses, values=values)
+        context=client, analyses_serv=analyses, values=values,
+        services=services)
     # processForm already has created the analyses, but here we create the
     # analyses with specs and prices. This function, even it is called 'set',
     # deletes the old analyses, so eventually we obtain the desired analyses.
@@ -116,20 +262,15 @@ def create_analysisrequest(client, request, values, analyses=None,
             )
         part_num += 1
 
-    # At this point, we have a fully created AR, with a Sample, Partitions and
-    # Analyses, but the state of all them is the initial ("sample_registered").
-    # We can now transition the whole thing (instead of doing it manually for
-    # each object we created). After and Before transitions will take care of
-    # cascading and promoting the transitions in all the objects "associated"
-    # to this Analysis Request.
-    sampling_workflow_enabled = sample.getSamplingWorkflowEnabled()
-    action = 'no_sampling_workflow'
-    if sampling_workflow_enabled:
-        action = 'sampling_workflow'
-    # Transition the Analysis Request and related objects to "sampled" (if
-    # sampling workflow not enabled) or to "to_be_sampled" statuses.
-    doActionFor(ar, action)
+    return ar, partitions, secondary
 
+
+def _initialise_analysisrequest(ar, values, partitions, secondary):
+    """Transitions the objects of a new AR, once the initial transition has
+    been performed, to fit with the Sample of secondary ARs and with the
+    preservation and rejection values
+    """
+    sample = ar.getSample()
     if secondary:
         # If secondary AR, then we need to manually transition the AR (and its
         # children) to fit with the Sample Partition's current state
@@ -163,8 +304,6 @@ def create_analysisrequest(client, request, values, analyses=None,
     if reject_field and reject_field.get('checkbox', False):
         doActionFor(ar, 'reject')
 
-    return ar
-
 
 def get_sample_from_values(context, values):
     """values may contain a UID or a direct Sample object.
@@ -185,7 +324,8 @@ def get_sample_from_values(context, values):
     return sample
 
 
-def get_services_uids(context=None, analyses_serv=None, values=None):
+def get_services_uids(context=None, analyses_serv=None, values=None,
+                      services=None):
     """
     This function returns a list of UIDs from analyses services from its
     parameters.
@@ -194,6 +334,9 @@ def get_services_uids(context=None, analyses_serv=None, values=None):
     :type analyses_serv: list
     :param values: a dict, where keys are AR|Sample schema field names.
     :type values: dict
+    :param services: a dict of UID, title and keyword -> UID of the analyses
+        services, to resolve the items without searching the catalog
+    :type services: dict
     :returns: a list of analyses services UIDs
     """
     if analyses_serv is None:
@@ -204,7 +347,6 @@ def get_services_uids(context=None, analyses_serv=None, values=None):
     if not context or (not analyses_serv and not values):
         raise RuntimeError(
             "get_services_uids: Missing or wrong parameters.")
-    uid_catalog = getToolByName(context, 'uid_catalog')
     anv = values['Analyses'] if values.get('Analyses', None) else []
     analyses_services = anv + analyses_serv
     # It is possible to create analysis requests
@@ -228,16 +370,16 @@ def get_services_uids(context=None, analyses_serv=None, values=None):
         # Field, somehow 'Profiles' field can have an empty value in the set.
         # Thus, we should avoid querying by empty UID through 'uid_catalog'.
         if profile_uid:
-            profile = uid_catalog(UID=profile_uid)
-            profile = profile[0].getObject()
+            # Profiles looked up in the current request are not searched again
+            profile = api.get_object_by_uid(profile_uid)
             # Only services UIDs
             services_uids = profile.getRawService()
             # _resolve_items_to_service_uids() will remove duplicates
             analyses_services += services_uids
-    return _resolve_items_to_service_uids(analyses_services)
+    return _resolve_items_to_service_uids(analyses_services, services)
 
 
-def _resolve_items_to_service_uids(items):
+def _resolve_items_to_service_uids(items, services=None):
     """ Returns a list of service uids without duplicates based on the items
     :param items:
         A list (or one object) of service-related info items. The list can be
@@ -249,6 +391,9 @@ def _resolve_items_to_service_uids(items):
         - Analysis Service Keyword
         If an item that doesn't match any of the criterias above is found, the
         function will raise a RuntimeError
+    :param services:
+        A dict of UID, title and keyword -> UID of the analysis services. The
+        items are searched in the catalog only if not found in the dict
     """
     portal = None
     bsc = None
@@ -273,8 +418,13 @@ def _resolve_items_to_service_uids(items):
         if item in service_uids:
             continue
 
+        # Maybe object UID, service Title or Keyword of the prefetched ones
+        if services and item in services:
+            service_uids.append(services[item])
+            continue
+
         # Maybe object UID.
-        portal = portal if portal else api.portal.get()
+        portal = portal if portal else ploneapi.portal.get()
         bsc = bsc if bsc else getToolByName(portal, 'bika_setup_catalog')
         brains = bsc(UID=item)
         if brains:
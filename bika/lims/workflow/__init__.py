@@ -10,6 +10,8 @@ from bika.lims import PMF
 from bika.lims.browser import ulocalized_time
 from bika.lims.interfaces import IJSONReadExtender
 from bika.lims.jsonapi import get_include_fields
+from bika.lims.reindexqueue import queue_reindex
+from bika.lims.statistics import update_statistics
 from bika.lims.utils import changeWorkflowState
 from bika.lims.utils import t
 from bika.lims import logger
@@ -23,7 +25,13 @@ from zope.component import adapts
 from zope.interface import implementer
 from zope.interface import implements
 from zope.interface import Interface
+import collections
 import traceback
+from contextlib import contextmanager
+
+
+# Request key of the transitions to promote at the end of a batch
+BATCH_PROMOTIONS_KEY = "workflow_batch_promotions"
 
 
 def skip(instance, action, peek=False, unskip=False):
@@ -121,6 +129,84 @@ def doActionFor(instance, action_id, active_only=True, allowed_transition=True):
     return actionperformed, message
 
 
+def doActionForObjects(instances, action_id):
+    """Performs the transition to all the instances passed in as a batch.
+
+    The transitions are not promoted to the parents of the instances (e.g.
+    the Analysis Request or the Worksheet of the analyses) after every single
+    instance. The parents are collected instead and transitioned once, after
+    all the instances have been transitioned, so their guards are evaluated
+    only once per batch (see `transitionBatch`).
+
+    :param instances: Objects to be transitioned
+    :param action_id: transition id
+    :returns: the instances for which the transition has been performed
+    :rtype: list
+    """
+    transitioned = []
+    with transitionBatch():
+        for instance in instances:
+            performed, message = doActionFor(instance, action_id)
+            if performed:
+                transitioned.append(instance)
+    logger.info("Transition '{}' performed for {}/{} objects".format(
+        action_id, len(transitioned), len(instances)))
+    return transitioned
+
+
+@contextmanager
+def transitionBatch():
+    """Context manager that defers the transitions promoted to the parents of
+    the transitioned objects (see `promoteTransition`) until the end of the
+    block. Every parent is transitioned once per transition id. Nested
+    batches are promoted by the outermost one.
+    """
+    request = api.get_request()
+    if request is None or request.get(BATCH_PROMOTIONS_KEY) is not None:
+        yield
+        return
+
+    request.set(BATCH_PROMOTIONS_KEY, collections.OrderedDict())
+    try:
+        yield
+    finally:
+        promotions = request.get(BATCH_PROMOTIONS_KEY)
+        request.set(BATCH_PROMOTIONS_KEY, None)
+
+    logger.info("Promoting transitions to {} parents".format(len(promotions)))
+    for instance, action_id, check in promotions.values():
+        if check is not None and not check(instance):
+            continue
+        doActionFor(instance, action_id)
+
+
+def promoteTransition(instance, action_id, check=None):
+    """Promotes a transition to the instance passed in, usually the parent of
+    an object that has been transitioned.
+
+    If a batch of transitions is running (see `doActionForObjects`), the
+    promotion is deferred until all the objects of the batch have been
+    transitioned and done only once per instance and transition.
+
+    :param instance: Object to be transitioned
+    :param action_id: transition id
+    :param check: optional function that returns whether the instance can
+                  be transitioned, called right before the transition
+    """
+    if not instance:
+        return
+    request = api.get_request()
+    promotions = request and request.get(BATCH_PROMOTIONS_KEY) or None
+    if promotions is not None:
+        key = (api.get_uid(instance), action_id)
+        if key not in promotions:
+            promotions[key] = (instance, action_id, check)
+        return
+    if check is not None and not check(instance):
+        return
+    doActionFor(instance, action_id)
+
+
 def _logTransitionFailure(obj, transition_id):
     wftool = getToolByName(obj, "portal_workflow")
     chain = wftool.getChainFor(obj)
@@ -201,6 +287,15 @@ def BeforeTransitionEventHandler(instance, event):
     before_event()
 
 
+def get_state_variables(instance):
+    """Returns the names of the state variables of the workflows bound to the
+    instance, e.g. 'review_state', which are also the names of the indexes of
+    the workflow states
+    """
+    wf_tool = api.get_tool("portal_workflow")
+    return [wf.state_var for wf in wf_tool.getWorkflowsFor(instance)]
+
+
 def AfterTransitionEventHandler(instance, event):
     """ This event is executed after each transition and delegates further
     actions to 'after_x_transition_event' function if exists in the instance
@@ -217,6 +312,10 @@ def AfterTransitionEventHandler(instance, event):
     :param event: event that holds the transition performed
     :type event: IObjectEvent
     """
+    # Count the object with its new state in the dashboard statistics, also
+    # on creation
+    update_statistics(instance)
+
     # there is no transition for the state change (creation doesn't have a
     # 'transition')
     if not event.transition:
@@ -233,9 +332,13 @@ def AfterTransitionEventHandler(instance, event):
     logger.info(msg)
 
     # Because at this point, the object has been transitioned already, but
-    # further actions are probably needed still, so be sure is reindexed
-    # before going forward.
-    instance.reindexObject()
+    # further actions are probably needed still, so be sure the catalogs tell
+    # its new state before going forward: the after transition events and
+    # the guards of the objects the transition is promoted to search by the
+    # state and read the metadata, which is updated by any reindex. The rest
+    # of the indexes are updated once, before the transaction is committed
+    instance.reindexObject(idxs=get_state_variables(instance))
+    queue_reindex(instance)
 
     key = 'after_{0}_transition_event'.format(event.transition.id)
     after_event = getattr(instance, key, False)
@@ -331,6 +434,64 @@ def wasTransitionPerformed(instance, transition_id):
     return transition_id in transitions
 
 
+def wasTransitionPerformedFor(brain, transition_id):
+    """Checks if the transition has already been performed to the analysis
+    of the catalog brain passed in. The metadata of the analyses catalog is
+    used for 'submit' and 'verify' transitions, the object is only woken up
+    if the metadata does not tell.
+    """
+    if transition_id == 'submit':
+        return bool(brain.getSubmittedBy)
+    if transition_id == 'verify':
+        state = brain.review_state
+        if state in ['verified', 'published']:
+            return True
+        if state not in ['rejected', 'invalid']:
+            return False
+    return wasTransitionPerformed(api.get_object(brain), transition_id)
+
+
+def areAnalysesTransitioned(query, transition_id, dettached_states=None):
+    """Returns true if the analyses matching the query passed in have been all
+    transitioned in accordance with the transition_id passed in, evaluated
+    with the metadata of the analyses catalog. Cancelled analyses and
+    analyses in dettached states are dismissed, but at least one analysis
+    must be transitioned for this function to return True.
+
+    :param query: analyses catalog query, e.g. {'getRequestUID': uid}
+    :param transition_id: transition id
+    :param dettached_states: states of the analyses to be dismissed
+    """
+    from bika.lims.catalog.analysis_catalog import CATALOG_ANALYSIS_LISTING
+    catalog = api.get_tool(CATALOG_ANALYSIS_LISTING)
+    brains = catalog(query)
+    cancelled_query = dict(query, cancellation_state='cancelled')
+    cancelled = set(map(api.get_uid, catalog(cancelled_query)))
+    invalid = 0
+    for brain in brains:
+        # The analysis has already been transitioned?
+        if wasTransitionPerformedFor(brain, transition_id):
+            continue
+
+        # Maybe the analysis is in an 'inactive' state?
+        if api.get_uid(brain) in cancelled:
+            invalid += 1
+            continue
+
+        # Maybe the analysis is in a dettached state?
+        if dettached_states and brain.review_state in dettached_states:
+            invalid += 1
+            continue
+
+        # At this point we can assume this analysis is an a valid state and
+        # could potentially be transitioned, but the parent can only be
+        # transitioned if all the analyses have been transitioned previously
+        return False
+
+    # Be sure that at least there is one analysis in an active state
+    return len(brains) - invalid > 0
+
+
 def isActive(instance):
     """Returns True if the object is neither in a cancelled nor inactive state
     """
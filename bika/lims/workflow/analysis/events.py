@@ -8,11 +8,14 @@
 import transaction
 from Products.CMFCore.utils import getToolByName
 
+from bika.lims.assignedstate import update_assigned_state
 from bika.lims.interfaces import IRoutineAnalysis
 from bika.lims.interfaces.analysis import IRequestAnalysis
+from bika.lims.reindexqueue import queue_reindex
 from bika.lims.utils import changeWorkflowState
 from bika.lims.utils.analysis import create_analysis
 from bika.lims.workflow import doActionFor
+from bika.lims.workflow import promoteTransition
 from bika.lims.workflow import skip
 
 
@@ -27,7 +30,7 @@ def after_submit(obj):
     """
     ws = obj.getWorksheet()
     if ws:
-        doActionFor(ws, 'submit')
+        promoteTransition(ws, 'submit')
     _reindex_request(obj)
 
 
@@ -74,6 +77,7 @@ def after_retract(obj):
     if ws:
         ws.addAnalysis(analysis)
     analysis.reindexObject()
+    update_assigned_state(obj)
 
     # retract our dependencies
     dependencies = obj.getDependencies()
@@ -109,7 +113,7 @@ def after_verify(obj):
     # is no need to check here if all analyses within the AR have been
     # transitioned already.
     ar = obj.getRequest()
-    doActionFor(ar, 'verify')
+    promoteTransition(ar, 'verify')
 
     # Ecalate to Worksheet. Note that the guard for verify transition from
     # Worksheet will check if the Worksheet can be transitioned, so there is no
@@ -117,13 +121,14 @@ def after_verify(obj):
     # already
     ws = obj.getWorksheet()
     if ws:
-        doActionFor(ws, 'verify')
+        promoteTransition(ws, 'verify')
     _reindex_request(obj)
 
 
 def after_assign(obj):
     """Function triggered after an 'assign' transition for the analysis passed
     in is performed."""
+    update_assigned_state(obj)
     # Reindex the entire request to update the FieldIndex `assigned_state`
     _reindex_request(obj, idxs=['assigned_state',])
 
@@ -131,6 +136,7 @@ def after_assign(obj):
 def after_unassign(obj):
     """Function triggered after an 'unassign' transition for the analysis passed
     in is performed."""
+    update_assigned_state(obj)
     # Reindex the entire request to update the FieldIndex `assigned_state`
     _reindex_request(obj, idxs=['assigned_state',])
 
@@ -146,6 +152,7 @@ def after_cancel(obj):
         skip(obj, "cancel", unskip=True)
         ws.removeAnalysis(obj)
     obj.reindexObject()
+    update_assigned_state(obj)
     _reindex_request(obj)
 
 
@@ -159,6 +166,7 @@ def after_reject(obj):
         ws = obj.getWorksheet()
         ws.removeAnalysis(obj)
     obj.reindexObject()
+    update_assigned_state(obj)
     _reindex_request(obj)
 
 
@@ -202,10 +210,11 @@ def after_attach(obj):
 
 
 def _reindex_request(obj, idxs=None):
+    """Queues the Analysis Request of the analysis for reindexing. The
+    Analysis Request is reindexed once before the transaction is committed,
+    regardless of the number of its analyses transitioned
+    """
     if not IRequestAnalysis.providedBy(obj):
         return
     request = obj.getRequest()
-    if idxs is None:
-        request.reindexObject()
-    else:
-        request.reindexObject(idxs=idxs)
+    queue_reindex(request, idxs=idxs)
@@ -7,7 +7,9 @@
 
 from Products.CMFCore.utils import getToolByName
 
+from bika.lims import api
 from bika.lims import logger
+from bika.lims.workflow import areAnalysesTransitioned
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import getCurrentState
 from bika.lims.workflow import isActive
@@ -62,40 +64,21 @@ def verify(obj):
     (cancelled, inactive) are dismissed, but at least one analysis must be in
     an active state (and verified), otherwise always return False. If the
     Analysis Request is in inactive state (cancelled/inactive), returns False
-    Note this guard depends entirely on the current status of the children
+    Note this guard depends entirely on the current status of the children.
+    The analyses are evaluated with the metadata of the analyses catalog.
     :returns: true or false
     """
     if not isBasicTransitionAllowed(obj):
         return False
 
-    analyses = obj.getAnalyses(full_objects=True)
-    invalid = 0
-    for an in analyses:
-        # The analysis has already been verified?
-        if wasTransitionPerformed(an, 'verify'):
-            continue
-
-        # Maybe the analysis is in an 'inactive' state?
-        if not isActive(an):
-            invalid += 1
-            continue
-
-        # Maybe the analysis has been rejected or retracted?
-        dettached = ['rejected', 'retracted', 'attachments_due']
-        status = getCurrentState(an)
-        if status in dettached:
-            invalid += 1
-            continue
-
-        # At this point we can assume this analysis is an a valid state and
-        # could potentially be verified, but the Analysis Request can only be
-        # verified if all the analyses have been transitioned to verified
-        return False
-
-    # Be sure that at least there is one analysis in an active state, it
-    # doesn't make sense to verify an Analysis Request if all the analyses that
-    # contains are rejected or cancelled!
-    return len(analyses) - invalid > 0
+    # Analyses that have been rejected or retracted are dismissed. Be sure
+    # that at least there is one analysis in an active state, it doesn't make
+    # sense to verify an Analysis Request if all the analyses that contains
+    # are rejected or cancelled!
+    query = {'portal_type': 'Analysis',
+             'path': {'query': api.get_path(obj), 'level': 0}}
+    dettached = ['rejected', 'retracted', 'attachments_due']
+    return areAnalysesTransitioned(query, 'verify', dettached)
 
 
 def prepublish(obj):
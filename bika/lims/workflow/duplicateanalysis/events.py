@@ -13,6 +13,7 @@ from bika.lims.utils import changeWorkflowState
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import getCurrentState
 from bika.lims.workflow import isBasicTransitionAllowed
+from bika.lims.workflow import promoteTransition
 from bika.lims.workflow import wasTransitionPerformed
 from bika.lims.workflow.analysis import events as analysis_events
 
@@ -42,7 +43,7 @@ def after_verify(obj):
     # already
     ws = obj.getWorksheet()
     if ws:
-        doActionFor(ws, 'verify')
+        promoteTransition(ws, 'verify')
 
 
 def after_retract(obj):
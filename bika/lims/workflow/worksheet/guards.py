@@ -5,6 +5,9 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
+from bika.lims import api
+from bika.lims.catalog.analysis_catalog import CATALOG_ANALYSIS_LISTING
+from bika.lims.workflow import areAnalysesTransitioned
 from bika.lims.workflow import getCurrentState
 from bika.lims.workflow import isActive
 from bika.lims.workflow import isBasicTransitionAllowed
@@ -19,7 +22,15 @@ def _children_are_ready(obj, transition_id, dettached_states=None):
     least one child with for which the transition_id performed is required for
     this function to return true (if all children are in dettached states, it
     always return False).
+    The analyses are evaluated with the metadata of the analyses catalog, the
+    objects are only woken up if not all analyses are cataloged.
     """
+    uids = obj.getRawAnalyses()
+    catalog = api.get_tool(CATALOG_ANALYSIS_LISTING)
+    if uids and len(catalog(UID=uids)) == len(uids):
+        return areAnalysesTransitioned(
+            {'UID': uids}, transition_id, dettached_states)
+
     analyses = obj.getAnalyses()
     invalid = 0
     for an in analyses: